@@ -1,5 +1,6 @@
 import streamlit as st
-from app_functions import *
+from pipeline_functions import *
+from run_log_functions import append_run, import_json_logs
 import os
 import json
 import time
@@ -14,8 +15,13 @@ if 'output_file_path' not in st.session_state:
     st.session_state.output_file_name = None
 if 'learning_outcomes' not in st.session_state:
     st.session_state.learning_outcomes = None
+if 'run_details' not in st.session_state:
+    st.session_state.run_details = None
 if 'default_description' not in st.session_state:
     st.session_state.default_description = None
+if 'stage_memo' not in st.session_state:
+    # Results of the stages of earlier runs, so an edit only reruns the stages it affects
+    st.session_state.stage_memo = StageMemo(STAGE_MEMO_PATH)
 
 
 # Logo
@@ -52,13 +58,15 @@ with st.sidebar:
     with st.expander("PROCESS INPUTS", True):
         citation_style = st.selectbox("Citation Style", ["APA", "MLA", "Chicago", "Harvard"])
         model = st.selectbox('Choose gpt model',['gpt-4o','gpt-4-turbo','gpt-3.5-turbo'])
+        profile = st.selectbox('Model profile', list(ROUTING_PROFILES), help="'default' uses the chosen model for every stage, the others route each stage to its own model and token cap")
         document_title = st.text_input("Output Title",placeholder='Course_Outline.docx')
     st.write("*This app was designed on Streamlit by Jun Albert S. Pardillo (2024).*")
 
 if st.button("GENERATE COURSE OUTLINE",use_container_width=True):
     
     if course_title and course_description is None:
-        st.session_state.default_description = generate_description(course_title,target_students)
+        with use_profile(profile):
+            st.session_state.default_description = generate_description(course_title,target_students)
  
     # Combing the course details into a single string
     course_details = f"""Course Title: {course_title}
@@ -71,45 +79,52 @@ if st.button("GENERATE COURSE OUTLINE",use_container_width=True):
 
     st.session_state.start_time = time.time()
 
-    with st.spinner("Generating Course Topics..."):
-        # Genereate topics and search queries
-        queries =  generate_queries(course_details=course_details)
-    st.success("Queries Generated")
-    print(queries)
-
-    with st.spinner("Searching Online for Reference Materials..."):
-        # Get Search Results from Google Scholar
-        total_search_results = get_search_results(json.loads(queries))
-    st.success("Search Results Generated")
-
-    with st.spinner("Generating Learning Outcomes..."):
-        # Get Learning Outcomes from GPT-4
-        st.session_state.learning_outcomes = generate_learning_outcomes(
-            course_details=course_details, 
-            total_search_results=total_search_results, 
-            citation_style=citation_style,
-            model=model
-        )
-
-    if st.session_state.learning_outcomes:
-        st.success("Learning Outcomes Generated")
-    else:
+    # Stage progress and the learning outcomes are shown as the pipeline runs
+    progress = st.status(PIPELINE_STAGE_MESSAGES["queries"][0], expanded=True)
+    learning_outcomes_placeholder = st.empty()
+    streamed_learning_outcomes = []
+
+    def show_stage(stage, status, result):
+        if stage not in PIPELINE_STAGE_MESSAGES:
+            return
+        running_message, done_message = PIPELINE_STAGE_MESSAGES[stage]
+        if status == "started":
+            progress.update(label=running_message)
+        elif status == "done":
+            progress.write(done_message)
+        elif status == "reused":
+            progress.write(f"{done_message} (reused from the previous run)")
+        else:
+            progress.update(label=f"{running_message} failed", state="error")
+
+    def show_learning_outcomes(chunk):
+        streamed_learning_outcomes.append(chunk)
+        with learning_outcomes_placeholder.container():
+            st.subheader("Learning Outcomes")
+            st.write("".join(streamed_learning_outcomes))
+
+    # Run queries -> searches -> reference filtering -> learning outcomes -> outline -> document
+    results = run_outline_pipeline(
+        course_details=course_details,
+        total_hours=total_hours,
+        weekly_hours=weekly_hours,
+        citation_style=citation_style,
+        model=model,
+        document_title=document_title,
+        on_event=show_stage,
+        on_token=show_learning_outcomes,
+        memo=st.session_state.stage_memo,
+        profile=profile
+    )
+    progress.update(label="Course Outline Generated", state="complete", expanded=False)
+    learning_outcomes_placeholder.empty()
+    print(results["queries"])
+    st.session_state.run_details = {"Timings": results["timings"], "Token Stats": results["references"]["token_stats"]}
+
+    st.session_state.learning_outcomes = results["learning_outcomes"]
+    if not st.session_state.learning_outcomes:
         st.error("Learning Outcomes failed")
-    learning_outcomes = st.session_state.learning_outcomes
-
-    with st.spinner("Generating Course Outline..."):
-        # Generate Course Outline
-        course_outline = generate_course_outline(
-            course_details=course_details, 
-            learning_outcomes=learning_outcomes, 
-            total_hours=total_hours, 
-            weekly_hours=weekly_hours,
-            model=model
-        ) 
-        course_outline_json = json.loads(course_outline)
-
-    # Create word document from course outline json
-    st.session_state.doc_path = create_word_document_from_json(course_outline_json,title=document_title)
+    st.session_state.doc_path = results["document"]
     end_time = time.time()
     st.session_state.execution_time = end_time - st.session_state.start_time
     st.session_state.start_time = None
@@ -140,20 +155,16 @@ if st.button("GENERATE COURSE OUTLINE",use_container_width=True):
             "Class Hours per Week": weekly_hours
         },
         "Model": model,
+        "Profile": profile,
         "Execution Time": st.session_state.execution_time,
+        "Stages": results["trace_summary"],
         "Save Location": st.session_state.output_file_path,
         "Date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
     }
 
-    log_file = 'output_logs.json'
-    if os.path.exists(log_file):
-        with open(log_file, 'r') as f:
-            logs = json.load(f)
-    else:
-        logs = []
-    logs.append(log_details)
-    with open(log_file, 'w') as f:
-        json.dump(logs, f, indent=4)
+    # Runs logged by older versions in output_logs.json are moved to the append-only log once
+    import_json_logs('output_logs.json')
+    append_run(log_details)
 
 # Once process is finished, provide output
 if st.session_state.output_file_path:
@@ -164,6 +175,8 @@ if st.session_state.output_file_path:
     mins = round((st.session_state.execution_time // 60),0)
     secs = round((st.session_state.execution_time % 60),0)
     st.write(f"Execution Time: {int(mins)} minutes and {int(secs)} seconds")
+    with st.expander("RUN DETAILS"):
+        st.json(st.session_state.run_details)
     with open(st.session_state.output_file_path, "rb") as file:
         btn = st.download_button(   
             label="Download Course Outline",
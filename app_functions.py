@@ -1,8 +1,17 @@
+import json
+import contextvars
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from search_functions import *
 from gpt_functions import *
 from document_functions  import *
+from compaction_functions import *
+from tracing_functions import *
+from routing_functions import *
+from ranking_functions import *
 
 # Generate topics and search queries for each topic
+@traced()
 def generate_queries(course_details, model='gpt-4o'):
     prompt = f"""
     You are a capable and experienced researcher and professional educator. Provided are details regarding a course outline for which we need to look for references. 
@@ -30,49 +39,72 @@ def generate_queries(course_details, model='gpt-4o'):
     {course_details}
     """
     
-    try:
-        queries = gpt_response(prompt, model, response_format='json_object')
-    except Exception as e:
-        print(f"Error generating queries: {e}")
-        queries = {"queries": []}
-    
+    # Transient API errors are retried by gpt_response(), anything else is raised to the caller
+    queries = gpt_response(prompt, response_format='json_object', **route("queries", model))
     return queries
 
-# For each query, get the top 5 results from Google Scholar and combine into a single string
-def get_search_results(queries_json, num_results=5):
+# Format the Google Scholar results of a single topic
+def format_search_results(topic, results):
+    """
+    Params:
+    topic (str): The topic of the search query
+    results (list): The SearchResult list from search_google_scholar() function
+    """
+    return TopicResults(topic, "", results).to_prompt()
+
+# For each query, get the top 5 results from Google Scholar
+def get_topic_results(queries_json, num_results=5, max_workers=SEARCH_MAX_WORKERS):
     """
     Params:
     queries_json (json): The json object containing the queries and topics from generate_queries() function
+    max_workers (int): Max number of searches running at the same time
+
+    Output:
+    topic_results (list): TopicResults of every topic whose search succeeded, in topic order
     """
-    total_search_results = ""
-    for query in queries_json.get('queries', []):
-        try:
-            results = search_google_scholar(query['query'], num_results)
-            temp_result = f"Topic: {query['topic']}\nResults:\n"
-            
-            for search_result in results.get('organic_results', []):
-                temp_result += f"""
-                Title: {search_result['title']}
-                Link: {search_result['link']}
-                Snippet: {search_result.get('snippet', 'N/A')}
-                Publication Summary: {search_result.get('publication_info', {}).get('summary', 'N/A')}
-                """
-                
-            total_search_results += temp_result
-        except Exception as e:
-            print(f"Error fetching results for query '{query['query']}': {e}")
+    topic_results = []
+    queries = queries_json.get('queries', [])
+    # Searches run concurrently, results come back in topic order
+    all_results = search_google_scholar_many([query['query'] for query in queries], num_results, max_workers=max_workers)
+
+    for query, results in zip(queries, all_results):
+        if isinstance(results, Exception):
+            print(f"Error fetching results for query '{query['query']}': {results}")
             continue
-    
+        topic_results.append(TopicResults(query['topic'], query['query'], results))
+    return topic_results
+
+# For each query, get the top 5 results from Google Scholar and combine into a single string
+@traced()
+def get_search_results(queries_json, num_results=5, max_workers=SEARCH_MAX_WORKERS, token_budget=None, return_stats=False):
+    """
+    Params:
+    queries_json (json): The json object containing the queries and topics from generate_queries() function
+    max_workers (int): Max number of searches running at the same time
+    token_budget (int): Deduplicate and trim the results to this many tokens with compact_search_results(). None keeps every result
+    return_stats (bool): Also return the token counts before/after compaction
+    """
+    topic_results = get_topic_results(queries_json, num_results, max_workers)
+
+    stats = None
+    if token_budget is not None:
+        total_search_results, stats = compact_search_results(topic_results, token_budget)
+        print(f"Search results compacted from {stats['tokens_before']} to {stats['tokens_after']} tokens")
+    else:
+        total_search_results = "".join(topic.to_prompt() for topic in topic_results)
+
+    if return_stats:
+        return total_search_results, stats
     return total_search_results
 
-# Generate Learning Outcomes following Bloom's Taxonomy
-def generate_learning_outcomes(course_details, total_search_results, citation_style='APA', model='gpt-3.5-turbo'):
+# Filter out search results that aren't suitable as references for the course
+@traced()
+def filter_references(course_details, total_search_results, model='gpt-3.5-turbo'):
     """
     Params:
     course_details (str): The course details inputted by user
-    total_search_results (str): The search results from search_google_scholar() function
+    total_search_results (str): The search results from get_search_results() or format_search_results() function
     """
-
     relevant_references_prompt = f""" Provided below are the search results for reference material from Google Scholar for suggested topics for the provided course. Filter out sources that aren't ideal to use as reference material for this course, instead only keep recent and relevant academic materials such as textbooks. Follow the following format for your output:
     
     Title: "Reference Title"
@@ -86,7 +118,22 @@ def generate_learning_outcomes(course_details, total_search_results, citation_st
     Search Results:
     {total_search_results}"""
 
-    filtered_search_results = gpt_response(relevant_references_prompt,model)
+    # The filtered references are a subset of the search results, so the output can't be much longer than them
+    filtered_search_results = gpt_response(relevant_references_prompt, **route("filter", model, input_tokens=count_tokens(total_search_results)))
+    return filtered_search_results
+
+# Generate Learning Outcomes following Bloom's Taxonomy
+@traced()
+def generate_learning_outcomes(course_details, total_search_results, citation_style='APA', model='gpt-3.5-turbo', stream=False, filtered_search_results=None):
+    """
+    Params:
+    course_details (str): The course details inputted by user
+    total_search_results (str): The search results from search_google_scholar() function
+    stream (bool): Return a generator of the learning outcomes text as it is generated (i.e. for st.write_stream)
+    filtered_search_results (str): Search results already passed through filter_references(), skips the filter call
+    """
+    if filtered_search_results is None:
+        filtered_search_results = filter_references(course_details, total_search_results, model)
 
     learning_outcomes_prompt = f'''You are a curricular development expert focused on authoring course outlines.
     Provided below are course details for a course outline you will need to generate.
@@ -148,11 +195,190 @@ Provided below are the search results for reference material from Google Scholar
 
 '''
 
-    learning_outcomes = gpt_response(learning_outcomes_prompt, model)
+    learning_outcomes = gpt_response(learning_outcomes_prompt, stream=stream, **route("learning_outcomes", model))
     return learning_outcomes
 
+FAN_OUT_MIN_WEEKS = 24  # Courses with at least this many weeks get their activities generated per topic
+ACTIVITY_ATTEMPTS = 3   # Calls of a topic whose activities don't have one row per week before it fails
+
+# The course outline without its activities, with the number of weeks suggested for every topic
+COURSE_PLAN_SCHEMA = deepcopy(COURSE_OUTLINE_SCHEMA)
+del COURSE_PLAN_SCHEMA["properties"]["activities"]
+COURSE_PLAN_SCHEMA["required"].remove("activities")
+COURSE_PLAN_SCHEMA["properties"]["topics"]["items"]["properties"]["weeks"] = {"type": "integer"}
+COURSE_PLAN_SCHEMA["properties"]["topics"]["items"]["required"].append("weeks")
+
+TOPIC_ACTIVITIES_SCHEMA = {
+    "type": "object",
+    "properties": {"activities": COURSE_OUTLINE_SCHEMA["properties"]["activities"]},
+    "required": ["activities"],
+    "additionalProperties": False
+}
+
+def topic_weeks(topic):
+    """Weeks suggested for a topic of the course plan, as an int of at least 1
+
+    Models without structured output may write the weeks as text ("3") or leave them out, the outline shouldn't fail
+    for a suggestion.
+    """
+    try:
+        weeks = int(float(topic.get('weeks', 1)))
+    except (TypeError, ValueError, OverflowError):
+        return 1
+    return max(1, weeks)
+
+def assign_weeks(suggested_weeks, total_weeks):
+    """Splits the weeks of the course between topics in order, in proportion to the weeks suggested for each
+
+    Every topic gets at least one week while there are weeks left (largest remainder rounding otherwise).
+
+    Output:
+    week_ranges (list): (first week, last week) of every topic, None for topics left without a week
+    """
+    weights = [max(1, weeks) for weeks in suggested_weeks]
+    shares = [weight * total_weeks / sum(weights) for weight in weights] if weights else []
+    counts = [int(share) for share in shares]
+    for i in sorted(range(len(shares)), key=lambda i: shares[i] - counts[i], reverse=True)[:total_weeks - sum(counts)]:
+        counts[i] += 1
+    # Topics rounded down to no week take one from the topic with the most weeks
+    for i in range(len(counts)):
+        if counts[i] == 0 and max(counts) > 1:
+            counts[counts.index(max(counts))] -= 1
+            counts[i] = 1
+
+    week_ranges = []
+    first_week = 1
+    for count in counts:
+        week_ranges.append((first_week, first_week + count - 1) if count else None)
+        first_week += count
+    return week_ranges
+
+def generate_topic_activities(course_details, learning_outcomes, topic, first_week, last_week, model='gpt-3.5-turbo'):
+    """
+    Params:
+    topic (dict): Topic of the course plan, with its ILOs
+    first_week, last_week (int): Weeks of the course assigned to the topic
+
+    Output:
+    activities (list): One activity per week of the topic, labelled "Week first_week" to "Week last_week"
+
+    Raises ValueError when none of the ACTIVITY_ATTEMPTS calls returned one activity per week.
+    """
+    weeks = last_week - first_week + 1
+    ilos = "\n".join(f"    - {ilo}" for ilo in topic['ilos'])
+    prompt = f'''You are a highly-capable researcher and curricular development expert. Provided below are course details for a course outline you are generating.
+
+    Course Details:
+    {course_details}
+    {learning_outcomes}
+
+    -------------------
+
+    Create the weekly activities of the topic "{topic['topic']}", which is covered in Weeks: Week {first_week} to Week {last_week} ({weeks} weeks).
+    Its intended learning outcomes are:
+{ilos}
+
+    Create exactly one activity per week, in week order. Each activity should have a week ("Week {first_week}"...), the topic,
+    an activity description, the expected output or assessment, and the assessment tools.
+    Output the activities as JSON: {{"activities": [{{"week": ..., "topic": ..., "activity_description": ..., "expected_output": ..., "assessment_tools": ...}}]}}
+    '''
+    routing = route("activities", model, weeks=weeks)
+    response_format = json_schema_format("topic_activities", TOPIC_ACTIVITIES_SCHEMA) if supports_structured_output(routing['model']) else 'json_object'
+    for attempt in range(ACTIVITY_ATTEMPTS):
+        # A cached answer with the wrong number of weeks would be returned again, retries skip the cache
+        response = gpt_response(prompt, response_format=response_format, use_cache=attempt == 0, **routing)
+        activities = validate_course_outline(json.loads(response), TOPIC_ACTIVITIES_SCHEMA, "activities")['activities']
+        if len(activities) == weeks:
+            break
+        print(f"Topic '{topic['topic']}' got {len(activities)} activities for its {weeks} weeks (attempt {attempt + 1}/{ACTIVITY_ATTEMPTS})")
+    else:
+        raise ValueError(f"Topic '{topic['topic']}' got {len(activities)} activities for its {weeks} weeks after {ACTIVITY_ATTEMPTS} attempts")
+    # The weeks are relabelled, so the merged table has every week once and in order
+    for i, activity in enumerate(activities):
+        activity['week'] = f"Week {first_week + i}"
+    return activities
+
+def generate_course_outline_fan_out(course_details, learning_outcomes, total_hours=54, weekly_hours=3, model='gpt-3.5-turbo'):
+    """Course outline whose weekly activities are generated per topic, in parallel calls
+
+    One call plans the outline (details, CLOs, topics with ILOs and suggested weeks, references), the weeks are split
+    between the topics with assign_weeks(), then every topic's activities are generated at the same time and merged
+    in week order. Each call only writes a few weeks, so long courses aren't cut at max_tokens and the latency stays
+    about the same whatever the number of weeks.
+
+    Output:
+    course_outline_json (str): The course outline in the JSON format read by create_word_document_from_json()
+    """
+    total_weeks = total_hours // weekly_hours
+    routing = route("course_plan", model)
+    plan_prompt = f'''You are a highly-capable researcher and curricular development expert. Provided below are course details for a course outline you will need to generate.
+
+    Course Details:
+    {course_details}
+    {learning_outcomes}
+
+    -------------------
+
+    Plan the weeks of the course outline: output the course details, CLOs, topics with their ILOs and the references as JSON.
+    For every topic, also give the number of weeks it should take. This course has {total_weeks} weeks in total ({total_hours} hours, {weekly_hours} hours per week).
+    You may make slight modifications to the provided course description for improvements without removing any context, but avoid changing the course title, instructor name, and weekly hours.
+    If a reference has no link, leave its link empty.
+    '''
+    if supports_structured_output(routing['model']):
+        response_format = json_schema_format("course_plan", COURSE_PLAN_SCHEMA)
+    else:
+        response_format = 'json_object'
+        plan_prompt += f"""
+    Follow this JSON format: {{"course_title": ..., "course_description": ..., "instructor_name": ..., "credit_units": ..., "total_hours": ..., "weekly_hours": ...,
+    "clos": ["CLO 1", ...], "topics": [{{"topic": "Topic 1", "ilos": ["ILO 1", ...], "weeks": 3}}, ...], "references": [{{"reference": "Reference 1", "link": "Link 1"}}, ...]}}
+    """
+    plan = json.loads(gpt_response(plan_prompt, response_format=response_format, **routing))
+    # The weeks only guide assign_weeks(), a missing or malformed suggestion counts as 1 week
+    if isinstance(plan, dict) and isinstance(plan.get('topics'), list):
+        for topic in plan['topics']:
+            if isinstance(topic, dict):
+                topic['weeks'] = topic_weeks(topic)
+    plan = validate_course_outline(plan, COURSE_PLAN_SCHEMA, "plan")
+
+    week_ranges = assign_weeks([topic['weeks'] for topic in plan['topics']], total_weeks)
+    topics = [(topic, week_range) for topic, week_range in zip(plan['topics'], week_ranges) if week_range is not None]
+    # The topic calls run in copies of this context, so they keep the stage deadline and their spans nest in this one
+    contexts = [contextvars.copy_context() for _ in topics]
+    with ThreadPoolExecutor(max_workers=max(1, len(topics))) as executor:
+        topic_activities = list(executor.map(
+            lambda context, topic: context.run(generate_topic_activities, course_details, learning_outcomes, topic[0], *topic[1], model),
+            contexts, topics
+        ))
+
+    for topic in plan['topics']:
+        topic.pop('weeks', None)
+    plan['activities'] = [activity for activities in topic_activities for activity in activities]
+    return json.dumps(validate_course_outline(plan))
+
 # Generate Course Outline and Activities
-def generate_course_outline(course_details, learning_outcomes, total_hours=54, weekly_hours=3,model = 'gpt-3.5-turbo'):
+@traced()
+def generate_course_outline(course_details, learning_outcomes, total_hours=54, weekly_hours=3,model = 'gpt-3.5-turbo', single_pass=None, fan_out=None):
+    """
+    Params:
+    course_details (str): The course details inputted by user
+    learning_outcomes (str): The learning outcomes from generate_learning_outcomes() function
+    single_pass (bool): Generate the JSON outline directly in one structured output call instead of a text outline
+                        converted to JSON by a second call. Default (None) uses single pass when the model supports it
+    fan_out (bool): Generate the weekly activities per topic in parallel calls, see generate_course_outline_fan_out().
+                    Default (None) fans out for courses of at least FAN_OUT_MIN_WEEKS weeks, except through the Batch API
+                    (where every topic call would wait for its own batch round)
+
+    Output:
+    course_outline_json (str): The course outline in the JSON format read by create_word_document_from_json()
+    """
+    if fan_out is None:
+        fan_out = total_hours // weekly_hours >= FAN_OUT_MIN_WEEKS and not completions_deferred()
+    if fan_out:
+        return generate_course_outline_fan_out(course_details, learning_outcomes, total_hours, weekly_hours, model)
+    routing = route("course_outline", model, weeks=total_hours // weekly_hours)
+    if single_pass is None:
+        single_pass = supports_structured_output(routing['model'])
+
     activities_prompt = f'''You are a highly-capable researcher and curricular development expert. Provided below are course details for a course outline you will need to generate.
 
     Course Details:
@@ -170,8 +396,18 @@ def generate_course_outline(course_details, learning_outcomes, total_hours=54, w
     You may make slight modifications to the provided course description for improvements without removing any context, but avoid changing the course title, instructor name, and weekly hours. 
     '''
 
+    if single_pass:
+        # Generate the outline directly as JSON following the schema of the word document
+        structured_prompt = activities_prompt + f"""
+    Output the complete course outline (course details, CLOs, topics with their ILOs, references and the weekly activities) as JSON.
+    Use "Week 1", "Week 2"... for the week of each activity. If a reference has no link, leave its link empty.
+    """
+        course_outline_json = gpt_response(structured_prompt, response_format=json_schema_format("course_outline", COURSE_OUTLINE_SCHEMA), **routing)
+        validate_course_outline(json.loads(course_outline_json))
+        return course_outline_json
+
     # Initial prompt output to generate course outline with text model
-    course_outline = gpt_response(activities_prompt,model, response_format='text')
+    course_outline = gpt_response(activities_prompt, response_format='text', **routing)
 
     # print(course_outline)
 
@@ -240,15 +476,27 @@ def generate_course_outline(course_details, learning_outcomes, total_hours=54, w
     {course_outline}
     """
 
-    course_outline_json = gpt_response(json_prompt,model, response_format='json_object')
+    course_outline_json = gpt_response(json_prompt, response_format='json_object', **routing)
 
     return  course_outline_json
 
 # Generate course description
+@traced()
 def generate_description(course_title,target_students, model = 'gpt-3.5-turbo'):
     description_prompt = f"""You are a highly-capable educator and curricular development expert. Create a comprehensive but concise description for a course called "{course_title}" which is meant for {target_students}. 
     Keep the description within 100 words, and provide a general overview of what one  can expect from this course."""
 
-    description = gpt_response(description_prompt,model)
+    description = gpt_response(description_prompt, **route("description", model))
+
+    return description
 
-    return description
\ No newline at end of file
+# Combine the course details into a single string, as the front ends do
+def format_course_details(course_title, course_description, instructor_name, credit_units, target_students, total_hours, weekly_hours):
+    course_details = f"""Course Title: {course_title}
+    Course Description: {course_description}
+    Instructor Name: {instructor_name}
+    Credit Units: {credit_units}
+    Target Students: {target_students}
+    Total Hours: {total_hours}
+    Class Hours per Week: {weekly_hours}"""
+    return course_details
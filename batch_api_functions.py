@@ -0,0 +1,162 @@
+"""Catalog generation through the OpenAI Batch API
+
+Overnight runs don't need low latency, so every LLM call of a stage is collected for all courses,
+written to a batch JSONL file and submitted as one Batch API job (half the price of regular calls
+and separate rate limits). Once the job completes, all courses move on to their next call.
+
+Usage:
+    python catalog_functions.py courses.csv --batch-api --poll-interval 300
+"""
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from catalog_functions import *
+
+
+# Terminal statuses of a batch job
+BATCH_DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def load_batch_state(output_dir):
+    return load_checkpoint(os.path.join(output_dir, "batch_state.json")) or {"answers": {}, "failures": {}, "batch_id": None, "round": 0}
+
+def save_batch_state(output_dir, state):
+    save_checkpoint(os.path.join(output_dir, "batch_state.json"), state)
+
+def write_batch_file(path, requests):
+    """Writes requests (request key -> chat completion params) as a Batch API input file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, params in requests.items():
+            f.write(json.dumps({"custom_id": key, "method": "POST", "url": "/v1/chat/completions", "body": params}) + "\n")
+
+def read_batch_keys(path):
+    """Request keys (custom_ids) of a Batch API input file"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['custom_id'] for line in f if line.strip()]
+
+def submit_batch(path, completion_window="24h"):
+    """Uploads a batch input file and creates the batch job, returning its id"""
+    client = get_client()
+    with open(path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window=completion_window)
+    return batch.id
+
+def wait_for_batch(batch_id, poll_interval=60, keys=()):
+    """Polls the batch job until it is finished
+
+    A batch that failed, expired or was cancelled is read like a completed one: the requests it finished are answered
+    and the others are errors, so they are resubmitted in the next round.
+
+    Params:
+    keys (list): Request keys of the batch, those without an output or error line are counted as errors
+
+    Output:
+    answers (dict): Request key -> response text of the requests that succeeded
+    errors (dict): Request key -> error message of the requests that failed
+    """
+    client = get_client()
+    batch = client.batches.retrieve(batch_id)
+    while batch.status not in BATCH_DONE_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        print(f"Batch {batch_id} ended with status '{batch.status}'")
+
+    answers, errors = {}, {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            output = json.loads(line)
+            response = output.get('response') or {}
+            if response.get('status_code') == 200:
+                answers[output['custom_id']] = response['body']['choices'][0]['message']['content']
+            else:
+                errors[output['custom_id']] = str(output.get('error') or response.get('body'))
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                output = json.loads(line)
+                errors[output['custom_id']] = str(output.get('error') or output.get('response'))
+    for key in keys:
+        if key not in answers and key not in errors:
+            errors[key] = f"No result in batch {batch_id} (status '{batch.status}')"
+    return answers, errors
+
+def run_catalog_batch(courses, output_dir="catalog_outputs", concurrency=4, poll_interval=60, max_attempts=3, completion_window="24h"):
+    """Generates the outlines of every course, sending the LLM calls of each round as one Batch API job
+
+    Each round runs every unfinished course as far as it can go: stages whose answers are known run
+    (searches and documents included), and the next LLM call of every course is collected into the batch.
+    Answers and the running batch id are saved in batch_state.json, so an interrupted run resumes
+    polling the same job instead of submitting it again.
+
+    Params:
+    concurrency (int): Courses advanced at the same time within a round (searches, documents)
+    poll_interval (float): Seconds between batch status checks
+    max_attempts (int): Times a failed request is resubmitted before its course is marked as failed
+    completion_window (str): Batch API completion window
+
+    Output:
+    report (dict): Same as run_catalog(), plus the number of batch rounds
+    """
+    os.makedirs(os.path.join(output_dir, "checkpoints"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "batches"), exist_ok=True)
+    state = load_batch_state(output_dir)
+    done = read_manifest(output_dir)
+    pending = [course for course in courses if course['id'] not in done]
+    remaining = list(pending)
+    records = []
+    start = time.perf_counter()
+    rounds = 0
+
+    def advance(course):
+        try:
+            with deferred_completions(state['answers']):
+                return run_course(course, output_dir), None
+        except PendingCompletion as request:
+            return None, request
+        except Exception as e:
+            return failed_record(course, e), None
+
+    while remaining:
+        # Resume polling a batch that was submitted before an interruption
+        if state['batch_id'] is None:
+            requests = {}
+            still_running = []
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for course, (record, request) in zip(remaining, executor.map(advance, remaining)):
+                    if request is not None and state['failures'].get(request.key, 0) >= max_attempts:
+                        record, request = failed_record(course, f"Batch request failed {max_attempts} times"), None
+                    if record is not None:
+                        record['seconds'] = round(time.perf_counter() - start, 3)
+                        append_manifest(output_dir, record)
+                        records.append(record)
+                    else:
+                        requests[request.key] = request.params
+                        still_running.append(course)
+            remaining = still_running
+            if not requests:
+                break
+
+            state['round'] += 1
+            batch_path = os.path.join(output_dir, "batches", f"round_{state['round']}.jsonl")
+            write_batch_file(batch_path, requests)
+            state['batch_id'] = submit_batch(batch_path, completion_window)
+            save_batch_state(output_dir, state)
+            print(f"Submitted batch {state['batch_id']} with {len(requests)} requests (round {state['round']})")
+
+        batch_path = os.path.join(output_dir, "batches", f"round_{state['round']}.jsonl")
+        keys = read_batch_keys(batch_path) if os.path.exists(batch_path) else []
+        answers, errors = wait_for_batch(state['batch_id'], poll_interval, keys)
+        rounds += 1
+        state['answers'].update(answers)
+        for key in errors:
+            state['failures'][key] = state['failures'].get(key, 0) + 1
+        state['batch_id'] = None
+        save_batch_state(output_dir, state)
+
+    report = catalog_report(courses, pending, records, time.perf_counter() - start, output_dir)
+    report['batch_rounds'] = rounds
+    return report
@@ -0,0 +1,1563 @@
+"""Local benchmarks for CurriculumGPT
+
+These run against fake upstream servers on localhost, so no OpenAI or SerpAPI credits are spent.
+Usage:
+    python benchmark_functions.py client_pool concurrent_search llm_cache search_cache streaming outline pipeline batch_api compaction search_model key_pool resilience tracing run_log document export jobs cassette stage_memo outline_fan_out routing reference_store prerank
+"""
+import re
+import json
+import sys
+import math
+import time
+import random
+import asyncio
+import threading
+import statistics
+import tempfile
+import itertools
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Canned payloads
+def fake_course_outline(weeks=18, topics=5):
+    """Course outline JSON in the format read by create_word_document_from_json()"""
+    return {
+        "course_title": "Introduction to Machine Learning",
+        "course_description": "An introductory course on the concepts and practice of machine learning.",
+        "instructor_name": "Dr. Juan Dela Cruz",
+        "credit_units": "3",
+        "total_hours": str(weeks * 3),
+        "weekly_hours": "3",
+        "clos": [f"Course learning outcome {i + 1}" for i in range(4)],
+        "topics": [{"topic": f"Topic {i + 1}", "ilos": [f"ILO {i + 1}.{j + 1}" for j in range(2)]} for i in range(topics)],
+        "references": [{"reference": f"Author, A. (2023). Reference {i + 1}. Publisher.", "link": f"https://example.org/{i + 1}"} for i in range(topics)],
+        "activities": [{
+            "week": f"Week {week + 1}",
+            "topic": f"Topic {week * topics // weeks + 1}",
+            "activity_description": f"Lecture and laboratory exercise for week {week + 1}.",
+            "expected_output": "Laboratory report",
+            "assessment_tools": "Rubric"
+        } for week in range(weeks)]
+    }
+
+def fake_completion_content(body, server):
+    """Picks a canned completion for a chat completion request body"""
+    response_format = body.get('response_format', {}).get('type', 'text')
+    prompt = body.get('messages', [{}])[-1].get('content', '')
+    # Calls of generate_course_outline_fan_out(): the plan, then the activities of one topic
+    if "Plan the weeks of the course outline" in prompt:
+        plan = fake_course_outline(server.weeks, server.topics)
+        del plan["activities"]
+        for topic in plan["topics"]:
+            topic["weeks"] = server.weeks // server.topics
+        return json.dumps(plan)
+    weeks = re.search(r"Weeks: Week (\d+) to Week (\d+)", prompt)
+    if weeks:
+        first_week, last_week = int(weeks.group(1)), int(weeks.group(2))
+        activities = fake_course_outline(last_week)["activities"][first_week - 1:]
+        return json.dumps({"activities": activities})
+    if response_format == 'json_schema' or (response_format == 'json_object' and '"activities"' in prompt):
+        return json.dumps(fake_course_outline(server.weeks))
+    if response_format == 'json_object' and '"queries"' in prompt:
+        return json.dumps({"queries": [{"topic": f"Topic {i + 1}", "query": f"query {i + 1}"} for i in range(server.topics)]})
+    if response_format == 'json_object':
+        return "{}"
+    # Calls of filter_references(): keeps the hits of the prompt whose links are in server.suitable_links
+    if server.suitable_links is not None and "Filter out sources that aren't ideal" in prompt:
+        hits = re.findall(r"Title: (.*?)\s*(?:\||\n)\s*Link: (\S+)", prompt)
+        return "\n\n".join(f'Title: "{title}"\nLink: "{link}"' for title, link in hits if link in server.suitable_links)
+    return server.content or "Fake completion."
+
+def fake_scholar_fixture(query, num_results):
+    """Google Scholar hits of mixed quality for a query, as a careful reviewer would sort them
+
+    Output:
+        organic_results (list): Hits in the SerpAPI format, in a seeded order for the query
+        suitable (set): Links of the hits worth citing as course references
+    """
+    rng = random.Random(query)
+    subject = query.title()
+    year = lambda: rng.randint(2020, 2024)
+    kinds = [
+        # (suitable, title, publication summary, snippet, citations)
+        (True, f"{subject}: Principles and Practice", f"A Author - {year()} - books.google.com", f"This textbook introduces {query} from first principles.", rng.randint(50, 800)),
+        (True, f"Recent advances in {query}", f"B Author - Journal of {subject}, {year()} - Springer", f"A survey of the methods of {query}.", rng.randint(5, 200)),
+        (True, f"The Handbook of {subject}", f"C Editor - {year()} - Routledge", f"Chapters on every area of {query}.", rng.randint(20, 400)),
+        (False, f"{subject} among secondary school teachers", f"D Author - {year()} - proquest.com", f"This thesis studies {query} in schools.", rng.randint(0, 3)),
+        (False, f"Lecture notes on {query}", f"E Author - {year()} - researchgate.net", f"Slides of a course on {query}.", 0),
+        (False, "Consumer preferences for specialty coffee", f"F Author - Journal of Marketing, {year()} - Elsevier", "A survey of coffee drinkers.", rng.randint(10, 300)),
+        (False, f"Applying {query} in a regional hospital: a case study", f"G Author - Proceedings of the Health Informatics Conference, {year()} - ieeexplore.ieee.org", f"A case study of {query} in one hospital.", rng.randint(0, 20)),
+    ]
+    rng.shuffle(kinds)
+    organic_results = []
+    suitable = set()
+    for i, (is_suitable, title, summary, snippet, citations) in enumerate(kinds[:num_results]):
+        link = f"https://example.org/{query.replace(' ', '-')}/{i + 1}"
+        organic_results.append({"position": i, "title": title, "link": link, "snippet": snippet,
+                                "publication_info": {"summary": summary}, "inline_links": {"cited_by": {"total": citations}}})
+        if is_suitable:
+            suitable.add(link)
+    return organic_results, suitable
+
+def fake_serpapi_response(params, organic_results):
+    return {
+        "search_metadata": {"id": "fake", "status": "Success", "created_at": "2024-01-01 00:00:00 UTC", "total_time_taken": 1.2,
+                            "google_scholar_url": "https://scholar.google.com/scholar?q=fake", "json_endpoint": "https://serpapi.com/searches/fake.json"},
+        "search_parameters": params,
+        "search_information": {"total_results": 12345, "time_taken_displayed": 0.05, "query_displayed": params.get('q', '')},
+        "organic_results": organic_results,
+        "pagination": {"current": 1, "next": "https://scholar.google.com/scholar?start=10", "other_pages": {str(i): f"https://scholar.google.com/scholar?start={i}0" for i in range(2, 11)}},
+        "serpapi_pagination": {"current": 1, "next": "https://serpapi.com/search.json?start=10"}
+    }
+
+def sample_latency(latency, rng):
+    """Seconds to sleep for a latency setting, drawn from rng for distributions
+
+    Params:
+        latency: Seconds (float), or a distribution: ("uniform", low, high), ("lognormal", median, sigma)
+                 or ("exponential", mean)
+        rng (random.Random): Seeded generator, so a run draws the same latencies every time
+    """
+    if not isinstance(latency, (tuple, list)):
+        return latency
+    distribution, *params = latency
+    if distribution == "uniform":
+        return rng.uniform(*params)
+    if distribution == "lognormal":
+        median, sigma = params
+        return median * math.exp(rng.gauss(0, sigma))
+    if distribution == "exponential":
+        return rng.expovariate(1 / params[0])
+    raise ValueError(f"Unknown latency distribution {distribution}")
+
+def count_tokens(text):
+    # Rough estimate used by the fake servers, about 4 characters per token
+    return max(1, len(text) // 4)
+
+
+# Fake upstream servers
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers POST /chat/completions like the OpenAI API
+
+    A completion takes server.latency seconds (or a draw of its distribution) plus server.token_latency seconds per completion token,
+    both divided by the speed of its model in server.model_speed (1.0 for models that aren't in it).
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        parts = path.split('/')
+        if '/batches/' in path:
+            return self.send_json(self.batch_object(parts[-1]))
+        if path.endswith('/content') and parts[-2] in self.server.files:
+            return self.send_bytes(self.server.files[parts[-2]]['content'])
+        self.send_json({"error": {"message": f"Unknown path {path}"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw_body = self.rfile.read(length)
+        path = urlparse(self.path).path
+        if path.endswith('/files'):
+            return self.create_file(raw_body)
+        if path.endswith('/batches'):
+            return self.create_batch(json.loads(raw_body))
+
+        body = json.loads(raw_body or b'{}')
+        self.server.requests.append(body)
+        speed = self.server.model_speed.get(body.get('model'), 1.0)
+        time.sleep(sample_latency(self.server.latency, self.server.latencies) / speed)
+        if self.inject_fault():
+            return
+
+        content = fake_completion_content(body, self.server)
+        if body.get('stream'):
+            return self.send_stream(body, content)
+        # Like the API, a completion longer than max_tokens is cut
+        finish_reason = "stop"
+        if body.get('max_tokens') and count_tokens(content) > body['max_tokens']:
+            content = content[:body['max_tokens'] * 4]
+            finish_reason = "length"
+
+        usage = {
+            "prompt_tokens": sum(count_tokens(message['content']) for message in body.get('messages', [])),
+            "completion_tokens": count_tokens(content)
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.server.usage.append(usage)
+        time.sleep(usage["completion_tokens"] * self.server.token_latency / speed)
+
+        payload = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'gpt-4o-mini'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason
+            }],
+            "usage": usage
+        }
+        self.send_json(payload)
+
+    # Files and batches endpoints of the Batch API
+    def create_file(self, raw_body):
+        message = BytesParser(policy=default_policy).parsebytes(
+            b"Content-Type: " + self.headers['Content-Type'].encode() + b"\r\n\r\n" + raw_body
+        )
+        fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True) for part in message.iter_parts()}
+        file_id = f"file-{next(self.server.ids)}"
+        self.server.files[file_id] = {"content": fields['file'], "purpose": fields.get('purpose', b'').decode()}
+        self.send_json({
+            "id": file_id, "object": "file", "bytes": len(fields['file']), "created_at": int(time.time()),
+            "filename": "batch.jsonl", "purpose": self.server.files[file_id]['purpose'], "status": "processed"
+        })
+
+    def create_batch(self, body):
+        """Answers every request of the input file right away, the batch reports completed after server.batch_delay seconds
+
+        While server.batch_expirations is positive, batches expire instead with only the first half of their requests answered.
+        """
+        batch_id = f"batch-{next(self.server.ids)}"
+        lines = [json.loads(line) for line in self.server.files[body['input_file_id']]['content'].decode().splitlines() if line.strip()]
+        status = "completed"
+        if self.server.batch_expirations > 0:
+            self.server.batch_expirations -= 1
+            status = "expired"
+            lines = lines[:len(lines) // 2]
+        outputs, errors = [], []
+        for line in lines:
+            self.server.requests.append(line['body'])
+            if self.server.batch_failures > 0:
+                self.server.batch_failures -= 1
+                errors.append({"id": f"batch_req_{len(errors)}", "custom_id": line['custom_id'], "response": None,
+                               "error": {"code": "server_error", "message": "Fake batch request error"}})
+                continue
+            content = fake_completion_content(line['body'], self.server)
+            outputs.append({"id": f"batch_req_{len(outputs)}", "custom_id": line['custom_id'], "error": None, "response": {
+                "status_code": 200,
+                "body": {"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+            }})
+
+        output_file_id, error_file_id = f"file-{next(self.server.ids)}", None
+        self.server.files[output_file_id] = {"content": "".join(json.dumps(o) + "\n" for o in outputs).encode(), "purpose": "batch_output"}
+        if errors:
+            error_file_id = f"file-{next(self.server.ids)}"
+            self.server.files[error_file_id] = {"content": "".join(json.dumps(e) + "\n" for e in errors).encode(), "purpose": "batch_output"}
+        self.server.batches[batch_id] = {
+            "body": body, "created": time.time(), "requests": len(lines), "status": status,
+            "output_file_id": output_file_id, "error_file_id": error_file_id, "failed": len(errors)
+        }
+        self.send_json(self.batch_object(batch_id))
+
+    def batch_object(self, batch_id):
+        batch = self.server.batches[batch_id]
+        completed = time.time() - batch['created'] >= self.server.batch_delay
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": batch['body']['endpoint'],
+            "input_file_id": batch['body']['input_file_id'],
+            "completion_window": batch['body']['completion_window'],
+            "status": batch['status'] if completed else "in_progress",
+            "created_at": int(batch['created']),
+            "output_file_id": batch['output_file_id'] if completed else None,
+            "error_file_id": batch['error_file_id'] if completed else None,
+            "request_counts": {"total": batch['requests'], "completed": batch['requests'] - batch['failed'] if completed else 0, "failed": batch['failed'] if completed else 0}
+        }
+
+    def send_bytes(self, data):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, body, content):
+        """Sends content as server-sent chat.completion.chunk events, one word at a time"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = content.split(" ")
+        tokens = [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+        for token in tokens:
+            time.sleep(count_tokens(token) * self.server.token_latency / self.server.model_speed.get(body.get('model'), 1.0))
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get('model', 'gpt-4o-mini'),
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        if body.get('stream_options', {}).get('include_usage'):
+            usage = {
+                "prompt_tokens": sum(count_tokens(message['content']) for message in body.get('messages', [])),
+                "completion_tokens": count_tokens(content)
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get('model', 'gpt-4o-mini'), "choices": [], "usage": usage}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def inject_fault(self):
+        """Answers with an error (429 with Retry-After or 503) for server.error_rate of the completions
+        and stalls server.stall_rate of them for server.stall_seconds. Returns True when the request was answered"""
+        draw = self.server.faults.random()
+        if draw < self.server.error_rate:
+            if draw < self.server.error_rate / 2:
+                self.send_json({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, 429, {"Retry-After": "0.1"})
+            else:
+                self.send_json({"error": {"message": "The server is overloaded", "type": "server_error", "code": None}}, 503)
+            return True
+        if draw < self.server.error_rate + self.server.stall_rate:
+            time.sleep(self.server.stall_seconds)
+        return False
+
+    def send_json(self, payload, status=200, headers=None):
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeSerpAPIHandler(FakeOpenAIHandler):
+    """Answers GET /search like SerpAPI's google_scholar engine
+
+    The latency of a query can be set in server.query_latency (dict of query -> seconds),
+    other queries sleep server.latency seconds. Keys in server.key_errors (dict of api key -> status)
+    are answered with that status, like SerpAPI does for rate-limited (429) or invalid (401) keys.
+    Keys in server.searches_left (dict of api key -> searches) use up one search per request and run out of
+    searches at 0, GET /account.json reports them like the SerpAPI Account API.
+    """
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if urlparse(self.path).path.endswith("/account.json"):
+            self.server.account_requests.append(params)
+            searches_left = self.server.searches_left.get(params.get('api_key'))
+            return self.send_json({} if searches_left is None else {"total_searches_left": searches_left})
+        query = params.get('q', '')
+        time.sleep(sample_latency(self.server.query_latency.get(query, self.server.latency), self.server.latencies))
+
+        self.server.requests.append(params)
+        status = self.server.key_errors.get(params.get('api_key'))
+        if status is None and params.get('api_key') in self.server.searches_left:
+            if self.server.searches_left[params['api_key']] <= 0:
+                status = 429
+            else:
+                self.server.searches_left[params['api_key']] -= 1
+        if status is not None:
+            error = "Invalid API key." if status == 401 else "Your account has run out of searches."
+            body = json.dumps({"error": error}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        num = int(params.get('num', 3))
+        if self.server.scholar_hits is not None:
+            return self.send_json(fake_serpapi_response(params, self.server.scholar_hits(query, num)))
+        organic_results = [{
+            "position": i,
+            "title": f"{query} result {i + 1}",
+            "link": f"https://example.org/{query.replace(' ', '-')}/{i + 1}",
+            "snippet": f"Snippet about {query}. " + " ".join(["This work covers the main concepts, methods and applications of the field."] * (i % 4)),
+            "publication_info": {
+                "summary": f"A Author - Publisher, {2024 - 2 * i} - example.org",
+                "authors": [{"name": "A Author", "link": "https://scholar.google.com/citations?user=fake", "serpapi_scholar_link": "https://serpapi.com/search.json?engine=google_scholar_author&author_id=fake"}]
+            },
+            "result_id": f"fake-{query}-{i}",
+            "type": "Book",
+            "resources": [{"title": "example.org", "file_format": "PDF", "link": f"https://example.org/{i + 1}.pdf"}],
+            "inline_links": {
+                "serpapi_cite_link": f"https://serpapi.com/search.json?engine=google_scholar_cite&q=fake-{i}",
+                "cited_by": {"total": 1000 // (i + 1), "link": "https://scholar.google.com/scholar?cites=fake", "cites_id": "fake", "serpapi_scholar_link": "https://serpapi.com/search.json?cites=fake&engine=google_scholar"},
+                "related_pages_link": "https://scholar.google.com/scholar?q=related:fake",
+                "versions": {"total": 5, "link": "https://scholar.google.com/scholar?cluster=fake", "cluster_id": "fake", "serpapi_scholar_link": "https://serpapi.com/search.json?cluster=fake&engine=google_scholar"}
+            }
+        } for i in range(num - 1)]
+        # Popular textbook returned for every query, as Google Scholar does for broad topics
+        organic_results.append({
+            "position": num - 1,
+            "title": "Introduction to the Field: A Textbook",
+            "link": "https://example.org/textbook",
+            "snippet": "The standard textbook of the field.",
+            "publication_info": {"summary": "B Author - Publisher, 2019 - example.org"},
+            "inline_links": {"cited_by": {"total": 5000}}
+        })
+        self.send_json(fake_serpapi_response(params, organic_results))
+
+class FakeServer(ThreadingHTTPServer):
+    # Load tests open hundreds of connections at once, more than the default backlog of 5
+    request_queue_size = 1024
+
+def start_fake_server(handler, latency=0.0, query_latency=None, token_latency=0.0):
+    """Starts a fake server on a free localhost port in a daemon thread
+
+    Params:
+        handler (BaseHTTPRequestHandler): Request handler class, i.e. FakeOpenAIHandler
+        latency (float): Seconds to sleep before every response, or a distribution (see sample_latency())
+        query_latency (dict): Per-query latency for FakeSerpAPIHandler
+        token_latency (float): Seconds per completion token for FakeOpenAIHandler
+
+    Output:
+        server (FakeServer): The running server, stop it with server.shutdown()
+        url (str): Base url of the server
+    """
+    server = FakeServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.query_latency = query_latency or {}
+    server.token_latency = token_latency
+    server.content = None  # Text of FakeOpenAIHandler completions
+    server.weeks = 18      # Weeks of FakeOpenAIHandler course outlines
+    server.topics = 5      # Topics of FakeOpenAIHandler search queries
+    server.usage = []
+    server.ids = itertools.count(1)  # Ids of fake files and batches
+    server.files = {}
+    server.batches = {}
+    server.batch_delay = 0.0         # Seconds before a fake batch completes
+    server.batch_failures = 0        # Number of upcoming batch requests that fail
+    server.batch_expirations = 0     # Number of upcoming batches that expire half done
+    server.requests = []
+    server.key_errors = {}           # Api key -> error status of FakeSerpAPIHandler
+    server.faults = random.Random(0) # Seeded, so fault injection is the same on every run
+    server.latencies = random.Random(1)  # Seeded draws of latency distributions
+    server.error_rate = 0.0          # Share of completions answered with 429/503
+    server.stall_rate = 0.0          # Share of completions stalled for stall_seconds
+    server.stall_seconds = 0.0
+    server.model_speed = {}          # Model -> speed of FakeOpenAIHandler completions (2.0 answers twice as fast)
+    server.searches_left = {}        # Api key -> searches left of FakeSerpAPIHandler (unlimited for other keys)
+    server.account_requests = []     # Params of the /account.json requests of FakeSerpAPIHandler
+    server.scholar_hits = None       # Function (query, num) -> organic results of FakeSerpAPIHandler
+    server.suitable_links = None     # Links FakeOpenAIHandler keeps when filtering references, see fake_scholar_fixture()
+    # Stalled requests are abandoned by the client, don't print their broken pipes
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def summarize(timings):
+    """Mean, p50 and p95 of a list of timings in seconds, reported in milliseconds"""
+    timings = sorted(timings)
+    return {
+        "calls": len(timings),
+        "mean_ms": round(statistics.mean(timings) * 1000, 2),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 2),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 2),
+    }
+
+
+# Benchmarks
+def benchmark_client_pool(calls=100, concurrent_calls=10, latency=0.2):
+    """Per-call overhead of a new OpenAI client per call versus the pooled client
+
+    Params:
+        calls (int): Number of sequential calls for each variant
+        concurrent_calls (int): Number of agpt_response calls awaited together
+        latency (float): Fake server latency for the concurrency part
+    """
+    from openai import OpenAI
+    import gpt_functions
+
+    server, url = start_fake_server(FakeOpenAIHandler)
+    gpt_functions.configure_client(base_url=url)
+    params = gpt_functions._completion_params("Hello", 'gpt-4o-mini', 50, "text", 0.5, "you are a helpful assistant")
+
+    # Before: a new client (and connection pool) for every call
+    before = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client = OpenAI(api_key=gpt_functions.OPENAI_API_KEY, base_url=url)
+        client.chat.completions.create(**params)
+        before.append(time.perf_counter() - start)
+        client.close()
+
+    # After: the process-wide client from gpt_functions
+    gpt_functions.gpt_response("warm up")
+    after = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        gpt_functions.gpt_response("Hello", max_tokens=50)
+        after.append(time.perf_counter() - start)
+
+    # Several completions awaited at once with agpt_response
+    server.latency = latency
+    async def gather_calls():
+        return await asyncio.gather(*[gpt_functions.agpt_response("Hello") for _ in range(concurrent_calls)])
+    start = time.perf_counter()
+    asyncio.run(gather_calls())
+    gathered = time.perf_counter() - start
+
+    server.shutdown()
+    return {
+        "new_client_per_call": summarize(before),
+        "pooled_client": summarize(after),
+        "agpt_response_gather": {
+            "calls": concurrent_calls,
+            "server_latency_ms": latency * 1000,
+            "total_ms": round(gathered * 1000, 2)
+        }
+    }
+
+def benchmark_concurrent_search(topics=5, min_latency=0.2, max_latency=1.0):
+    """Time of the search stage run one query at a time versus concurrently
+
+    Every topic gets a different injected latency, the concurrent stage should take about as long as the slowest one.
+
+    Params:
+        topics (int): Number of topics/queries
+        min_latency (float): Latency of the fastest query
+        max_latency (float): Latency of the slowest query
+    """
+    import search_functions
+    import app_functions
+
+    step = (max_latency - min_latency) / max(topics - 1, 1)
+    # Slowest query first, so finishing order is the reverse of topic order
+    queries = {"queries": [{"topic": f"Topic {i + 1}", "query": f"query {i + 1}"} for i in range(topics)]}
+    query_latency = {query['query']: max_latency - i * step for i, query in enumerate(queries['queries'])}
+    server, url = start_fake_server(FakeSerpAPIHandler, query_latency=query_latency)
+    search_functions.SERP_API_URL = url + "/search"
+    search_functions.configure_search_cache(None)
+
+    timings = {}
+    for name, max_workers in [("sequential", 1), ("concurrent", topics)]:
+        start = time.perf_counter()
+        results = app_functions.get_search_results(queries, max_workers=max_workers)
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+        topic_positions = [results.index(f"Topic: {query['topic']}") for query in queries['queries']]
+        assert topic_positions == sorted(topic_positions), "Topics are out of order"
+
+    server.shutdown()
+    assert timings['concurrent'] < timings['sequential'] / 2, timings
+    return {
+        "topics": topics,
+        "slowest_query_ms": max_latency * 1000,
+        "sequential_ms": timings['sequential'],
+        "concurrent_ms": timings['concurrent'],
+    }
+
+def benchmark_llm_cache(prompts=6, latency=0.5):
+    """Time and upstream requests of a cold run versus an identical rerun with the completion cache
+
+    Params:
+        prompts (int): Number of different prompts in a run (a run of the app makes 4-6 calls)
+        latency (float): Fake server latency of a completion
+    """
+    import gpt_functions
+
+    server, url = start_fake_server(FakeOpenAIHandler, latency=latency)
+    gpt_functions.configure_client(base_url=url)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = gpt_functions.enable_llm_cache(cache_dir + "/llm_cache.sqlite")
+        runs = {}
+        for name in ["cold", "rerun"]:
+            requests_before = len(server.requests)
+            start = time.perf_counter()
+            for i in range(prompts):
+                gpt_functions.gpt_response(f"Prompt {i}")
+            runs[name] = {
+                "total_ms": round((time.perf_counter() - start) * 1000, 2),
+                "upstream_requests": len(server.requests) - requests_before
+            }
+        stats = cache.stats()
+        gpt_functions.disable_llm_cache()
+
+    server.shutdown()
+    return {**runs, "cache": stats}
+
+def benchmark_search_cache(sessions=10, latency=1.0):
+    """Upstream requests and time when several sessions search the same query at once, then again later
+
+    Params:
+        sessions (int): Number of concurrent sessions searching the same query
+        latency (float): Fake SerpAPI latency
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import search_functions
+
+    server, url = start_fake_server(FakeSerpAPIHandler, latency=latency)
+    search_functions.SERP_API_URL = url + "/search"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        search_functions.configure_search_cache(cache_dir + "/search_cache.sqlite")
+        # Small differences in case and spacing still share one cache entry
+        queries = [("Introduction to  machine learning textbook" if i % 2 else "introduction to machine learning textbook") for i in range(sessions)]
+
+        runs = {}
+        for name in ["concurrent_sessions", "later_sessions"]:
+            requests_before = len(server.requests)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=sessions) as executor:
+                list(executor.map(search_functions.search_google_scholar, queries))
+            runs[name] = {
+                "sessions": sessions,
+                "total_ms": round((time.perf_counter() - start) * 1000, 2),
+                "upstream_requests": len(server.requests) - requests_before
+            }
+        stats = search_functions.search_cache_stats()
+        search_functions.configure_search_cache(None)
+
+    server.shutdown()
+    return {**runs, "stats": stats}
+
+def benchmark_streaming(words=200, token_latency=0.01):
+    """Time to the first visible text of a completion with and without stream=True
+
+    Params:
+        words (int): Length of the fake completion
+        token_latency (float): Seconds per generated token
+    """
+    import gpt_functions
+
+    server, url = start_fake_server(FakeOpenAIHandler, token_latency=token_latency)
+    gpt_functions.configure_client(base_url=url)
+    server.content = " ".join(f"word{i}" for i in range(words))
+
+    # Non-streaming: nothing can be shown before the whole completion arrives
+    start = time.perf_counter()
+    gpt_functions.gpt_response("Hello", use_cache=False)
+    blocking = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first_token = None
+    chunks = []
+    for chunk in gpt_functions.gpt_response("Hello", use_cache=False, stream=True):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        chunks.append(chunk)
+    streamed = time.perf_counter() - start
+    assert "".join(chunks) == server.content
+
+    server.shutdown()
+    return {
+        "blocking": {"first_output_ms": round(blocking * 1000, 2), "total_ms": round(blocking * 1000, 2)},
+        "stream": {"first_output_ms": round(first_token * 1000, 2), "total_ms": round(streamed * 1000, 2)},
+    }
+
+def benchmark_outline(weeks=18, latency=0.5, token_latency=0.002):
+    """Latency and token use of generate_course_outline in single pass versus the two-call path
+
+    Params:
+        weeks (int): Weeks of the generated outline
+        latency (float): Fake server time before the first token
+        token_latency (float): Fake server seconds per completion token
+    """
+    import gpt_functions
+    import app_functions
+    from document_functions import validate_course_outline
+
+    server, url = start_fake_server(FakeOpenAIHandler, latency=latency, token_latency=token_latency)
+    gpt_functions.configure_client(base_url=url)
+    server.weeks = weeks
+    # The free-text outline of the two-call path is about as long as the JSON one
+    outline = fake_course_outline(weeks)
+    server.content = "\n".join(f"{a['week']} - {a['topic']}: {a['activity_description']} Output: {a['expected_output']}. Tools: {a['assessment_tools']}" for a in outline['activities'])
+
+    course_details = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+    learning_outcomes = "\n".join(f"Topic {i + 1}\nILO {i + 1}.1\nILO {i + 1}.2" for i in range(5))
+
+    results = {}
+    for name, single_pass in [("two_calls", False), ("single_pass", True)]:
+        usage_before = len(server.usage)
+        start = time.perf_counter()
+        course_outline = app_functions.generate_course_outline(course_details, learning_outcomes, weeks * 3, 3, model='gpt-4o', single_pass=single_pass)
+        elapsed = time.perf_counter() - start
+        validate_course_outline(json.loads(course_outline))
+
+        usage = server.usage[usage_before:]
+        results[name] = {
+            "calls": len(usage),
+            "total_ms": round(elapsed * 1000, 2),
+            "prompt_tokens": sum(u['prompt_tokens'] for u in usage),
+            "completion_tokens": sum(u['completion_tokens'] for u in usage),
+        }
+
+    server.shutdown()
+    return results
+
+def benchmark_pipeline(topics=5, llm_latency=0.5, min_search_latency=0.2, max_search_latency=1.5):
+    """Time of the serial stage chain versus run_outline_pipeline, which filters each topic as soon as its search returns
+
+    Params:
+        topics (int): Number of topics/queries
+        llm_latency (float): Fake OpenAI latency per completion
+        min_search_latency (float): Latency of the fastest search
+        max_search_latency (float): Latency of the slowest search
+    """
+    import gpt_functions
+    import search_functions
+    import app_functions
+    import pipeline_functions
+
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    openai_server.topics = topics
+    gpt_functions.configure_client(base_url=openai_url)
+    step = (max_search_latency - min_search_latency) / max(topics - 1, 1)
+    query_latency = {f"query {i + 1}": max_search_latency - i * step for i in range(topics)}
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, query_latency=query_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+
+    course_details = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+    with tempfile.TemporaryDirectory() as output_dir:
+        document_title = output_dir + "/Course_Outline.docx"
+
+        # Serial chain, as the front ends ran it before
+        start = time.perf_counter()
+        queries = app_functions.generate_queries(course_details)
+        total_search_results = app_functions.get_search_results(json.loads(queries))
+        learning_outcomes = app_functions.generate_learning_outcomes(course_details, total_search_results, model='gpt-4o')
+        course_outline = app_functions.generate_course_outline(course_details, learning_outcomes, model='gpt-4o')
+        app_functions.create_word_document_from_json(json.loads(course_outline), title=document_title)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = pipeline_functions.run_outline_pipeline(course_details, model='gpt-4o', document_title=document_title)
+        pipelined = time.perf_counter() - start
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return {
+        "serial_ms": round(serial * 1000, 2),
+        "pipeline_ms": round(pipelined * 1000, 2),
+        "pipeline_timings": results["timings"],
+    }
+
+def benchmark_batch_api(courses=20, batch_delay=0.5, batch_failures=3, batch_expirations=1):
+    """Catalog run through the Batch API stand-in: rounds, requests per round and time
+
+    Params:
+        courses (int): Number of courses in the catalog
+        batch_delay (float): Seconds before each fake batch job completes
+        batch_failures (int): Batch requests that fail and have to be resubmitted in a later round
+        batch_expirations (int): Batches that expire with half of their requests unanswered
+    """
+    import gpt_functions
+    import search_functions
+    import batch_api_functions
+
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler)
+    openai_server.batch_delay = batch_delay
+    openai_server.batch_failures = batch_failures
+    openai_server.batch_expirations = batch_expirations
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        catalog = [{**batch_api_functions.COURSE_DEFAULTS, "course_title": f"Course {i + 1}"} for i in range(courses)]
+        for course in catalog:
+            course['id'] = batch_api_functions.course_id(course)
+        report = batch_api_functions.run_catalog_batch(catalog, output_dir, concurrency=8, poll_interval=0.1)
+        assert report['done'] == courses, report
+
+    requests_per_round = [batch['requests'] for batch in openai_server.batches.values()]
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return {
+        "courses": courses,
+        "batch_rounds": report['batch_rounds'],
+        "requests_per_round": requests_per_round,
+        "chat_completion_calls": len(openai_server.usage),
+        "seconds": report['seconds'],
+    }
+
+def benchmark_compaction(topics=5, num_results=10, token_budget=1500):
+    """Prompt tokens of the search results before and after compaction
+
+    Params:
+        topics (int): Number of topics/queries
+        num_results (int): Results per search
+        token_budget (int): Token budget of the compacted results
+    """
+    import search_functions
+    import app_functions
+
+    server, url = start_fake_server(FakeSerpAPIHandler)
+    search_functions.SERP_API_URL = url + "/search"
+    search_functions.configure_search_cache(None)
+    queries = {"queries": [{"topic": f"Topic {i + 1}", "query": f"query {i + 1}"} for i in range(topics)]}
+
+    start = time.perf_counter()
+    text, stats = app_functions.get_search_results(queries, num_results, token_budget=token_budget, return_stats=True)
+    stats["compaction_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    assert app_functions.count_tokens(text) <= token_budget
+
+    server.shutdown()
+    return stats
+
+def benchmark_search_model(pages=200, num_results=20):
+    """Parse time and memory of SearchResult objects versus keeping the raw SerpAPI JSON of result pages
+
+    Params:
+        pages (int): Number of SerpAPI result pages (a run has one page per topic)
+        num_results (int): Results per page
+    """
+    import gc
+    import tracemalloc
+    import search_functions
+
+    server, url = start_fake_server(FakeSerpAPIHandler)
+    search_functions.SERP_API_URL = url + "/search"
+    raw_page = search_functions.serp_session.get(search_functions.SERP_API_URL, params={"q": "machine learning", "num": num_results}).text
+    server.shutdown()
+
+    def measure(function):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        kept = function()
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return elapsed, memory
+
+    raw_seconds, raw_memory = measure(lambda: [json.loads(raw_page) for _ in range(pages)])
+    parsed_seconds, parsed_memory = measure(lambda: [search_functions.parse_search_results(json.loads(raw_page)) for _ in range(pages)])
+    return {
+        "pages": pages,
+        "results_per_page": num_results,
+        "raw_json": {"ms_per_page": round(raw_seconds / pages * 1000, 3), "kb_per_page": round(raw_memory / pages / 1024, 2)},
+        "search_results": {"ms_per_page": round(parsed_seconds / pages * 1000, 3), "kb_per_page": round(parsed_memory / pages / 1024, 2)},
+    }
+
+def benchmark_key_pool(searches=30, concurrency=10, rate=10.0, burst=3, latency=0.05):
+    """Requests per key when one SerpAPI key is rate limited (429) and one is invalid (401)
+
+    The pool should waste one request per failing key (its circuit then opens), spread the rest over the
+    healthy keys, and keep every key under its token-bucket rate.
+
+    Params:
+        searches (int): Number of distinct searches
+        concurrency (int): Searches running at the same time
+        rate (float): Searches per second allowed per key
+        burst (int): Token bucket size of every key
+        latency (float): Seconds of every fake search
+    """
+    import search_functions
+
+    server, url = start_fake_server(FakeSerpAPIHandler, latency=latency)
+    search_functions.SERP_API_URL = url + "/search"
+    search_functions.configure_search_cache(None)
+    api_keys = ["key-1", "key-2", "key-3", "key-4"]
+    server.key_errors = {"key-1": 429, "key-2": 401}
+    search_functions.configure_serp_keys(api_keys, rate=rate, burst=burst)
+
+    start = time.perf_counter()
+    results = search_functions.search_google_scholar_many([f"query {i}" for i in range(searches)], max_workers=concurrency)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    failed = [result for result in results if isinstance(result, Exception)]
+    requests_per_key = {api_key: sum(1 for params in server.requests if params['api_key'] == api_key) for api_key in api_keys}
+    healthy_requests = requests_per_key["key-3"] + requests_per_key["key-4"]
+    assert not failed, failed
+    # Only the searches that took a failing key before its circuit opened paid for it
+    assert requests_per_key["key-1"] + requests_per_key["key-2"] <= 2 * concurrency, requests_per_key
+    return {
+        "searches": searches,
+        "failed": len(failed),
+        "seconds": round(elapsed, 3),
+        # Minimum time allowed by the token buckets of the two healthy keys
+        "rate_limited_min_seconds": round(max(0.0, (healthy_requests - 2 * burst) / (2 * rate)), 3),
+        "upstream_requests": len(server.requests),
+        "requests_per_key": requests_per_key,
+        # The previous loop always started with the first key: every search paid for the failing keys first
+        "serial_failover_requests": searches * 3,
+        "keys": search_functions.serp_key_pool.stats(),
+    }
+
+def benchmark_resilience(calls=300, concurrency=10, latency=0.05, error_rate=0.05, stall_rate=0.03, stall_seconds=5.0):
+    """Failures and tail latency of gpt_response() when the upstream returns errors and stalls
+
+    Compares a single attempt without timeout against retries with a per-attempt timeout, and retries with hedging.
+
+    Params:
+        calls (int): Completions per scenario
+        concurrency (int): Completions running at the same time
+        latency (float): Seconds of a normal completion
+        error_rate (float): Share of completions answered with 429 (with Retry-After) or 503
+        stall_rate (float): Share of completions that stall for stall_seconds
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import gpt_functions
+    import resilience_functions
+
+    server, url = start_fake_server(FakeOpenAIHandler, latency=latency)
+    server.error_rate, server.stall_rate, server.stall_seconds = error_rate, stall_rate, stall_seconds
+    gpt_functions.configure_client(base_url=url)
+    default_settings = dict(resilience_functions.RETRY_SETTINGS)
+    scenarios = {
+        "single_attempt": dict(max_attempts=1, request_timeout=300.0, hedge=False),
+        "retries": dict(max_attempts=4, base_delay=0.1, request_timeout=1.0, hedge=False),
+        "retries_hedged": dict(max_attempts=4, base_delay=0.1, request_timeout=1.0, hedge=True, hedge_min_samples=20),
+    }
+
+    def call(i):
+        start = time.perf_counter()
+        try:
+            gpt_functions.gpt_response(f"Prompt {i}", use_cache=False)
+        except Exception:
+            return None
+        return time.perf_counter() - start
+
+    results = {}
+    for name, settings in scenarios.items():
+        resilience_functions.configure_retries(**settings)
+        resilience_functions.latencies = resilience_functions.LatencyTracker()
+        server.faults = random.Random(0)
+        stats_before = resilience_functions.resilience_stats()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(call, range(calls)))
+        stats = resilience_functions.resilience_stats()
+        succeeded = [timing for timing in timings if timing is not None]
+        results[name] = {
+            "failed": len(timings) - len(succeeded),
+            **summarize(succeeded),
+            "max_ms": round(max(succeeded) * 1000, 2),
+            **{key: stats[key] - stats_before[key] for key in ("retries", "hedged", "hedge_wins")},
+        }
+
+    resilience_functions.configure_retries(**default_settings)
+    server.shutdown()
+    return results
+
+def benchmark_tracing(spans=20000, topics=5, llm_latency=0.2, search_latency=0.3):
+    """Per-stage trace summary of a pipeline run against the fake servers, and the overhead of a span
+
+    Params:
+        spans (int): Empty spans timed for the overhead
+        topics (int): Number of topics/queries of the pipeline run
+        llm_latency (float): Fake OpenAI latency per completion
+        search_latency (float): Fake SerpAPI latency per search
+    """
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+    import tracing_functions
+
+    start = time.perf_counter()
+    with tracing_functions.collect_spans():
+        for _ in range(spans):
+            with tracing_functions.span("empty"):
+                pass
+    overhead_us = (time.perf_counter() - start) / spans * 1e6
+
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    openai_server.topics = topics
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+
+    course_details = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+    with tempfile.TemporaryDirectory() as output_dir:
+        trace_path = output_dir + "/traces.jsonl"
+        tracing_functions.configure_tracing(trace_path, otel=True)
+        results = pipeline_functions.run_outline_pipeline(course_details, model='gpt-4o', document_title=output_dir + "/Course_Outline.docx")
+        tracing_functions.configure_tracing(None)
+        exported = list(tracing_functions.read_spans(trace_path))
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    assert len(exported) == len(results["spans"]), "Exported spans don't match the spans of the run"
+    return {
+        "span_overhead_us": round(overhead_us, 2),
+        "spans": len(results["spans"]),
+        "upstream_completions": len(openai_server.usage),
+        "summary": results["trace_summary"],
+    }
+
+def _append_runs(path, runs, worker):
+    import run_log_functions
+    for i in range(runs):
+        run_log_functions.append_run({"Model": "gpt-4o", "Execution Time": 60.0 + i % 60, "Worker": worker, "Run": i}, path)
+
+def _append_runs_threads(path, threads, runs, process):
+    writers = [threading.Thread(target=_append_runs, args=(path, runs, f"{process}-{i}")) for i in range(threads)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+def benchmark_run_log(existing=(1000, 10000), processes=4, threads=4, runs_per_writer=250, aggregate_runs=200000):
+    """Logging a run: rewriting the JSON array log versus appending to the JSONL log, lost runs under concurrent writers,
+    and streaming aggregation over a large log
+
+    Params:
+        existing (tuple): Sizes of the log (runs) at which logging one run is timed
+        processes (int): Processes appending at the same time
+        threads (int): Threads per process appending at the same time
+        runs_per_writer (int): Runs appended by every thread
+        aggregate_runs (int): Runs in the log that is aggregated
+    """
+    import multiprocessing
+    import run_log_functions
+
+    record = {"Course Details": {"Course Title": "Introduction to Machine Learning", "Course Description": "An introductory course. " * 20},
+              "Model": "gpt-4o", "Execution Time": 100.0, "Save Location": "course_outline_outputs/Course_Outline.docx", "Date": "2024-07-04 15:23:54"}
+    results = {"log_one_run_ms": {}}
+    with tempfile.TemporaryDirectory() as log_dir:
+        for size in existing:
+            json_path, jsonl_path = f"{log_dir}/logs_{size}.json", f"{log_dir}/logs_{size}.jsonl"
+            with open(json_path, 'w') as f:
+                json.dump([record] * size, f, indent=4)
+            start = time.perf_counter()
+            with open(json_path) as f:
+                logs = json.load(f)
+            logs.append(record)
+            with open(json_path, 'w') as f:
+                json.dump(logs, f, indent=4)
+            rewrite = time.perf_counter() - start
+
+            run_log_functions.import_json_logs(json_path, jsonl_path)
+            start = time.perf_counter()
+            run_log_functions.append_run(record, jsonl_path)
+            append = time.perf_counter() - start
+            results["log_one_run_ms"][size] = {"json_rewrite": round(rewrite * 1000, 3), "jsonl_append": round(append * 1000, 3)}
+
+        path = f"{log_dir}/concurrent.jsonl"
+        writers = [multiprocessing.Process(target=_append_runs_threads, args=(path, threads, runs_per_writer, i)) for i in range(processes)]
+        start = time.perf_counter()
+        for process in writers:
+            process.start()
+        for process in writers:
+            process.join()
+        elapsed = time.perf_counter() - start
+        logged = sum(1 for _ in run_log_functions.read_runs(path))
+        expected = processes * threads * runs_per_writer
+        results["concurrent_writers"] = {
+            "writers": processes * threads,
+            "expected_runs": expected,
+            "logged_runs": logged,
+            "appends_per_second": round(logged / elapsed),
+        }
+
+        path = f"{log_dir}/large.jsonl"
+        lines = [json.dumps({**record, "Execution Time": 60.0 + i % 120, "Date": f"2024-07-{1 + i % 28:02d} 10:00:00", "logged_at": time.time()}) + "\n" for i in range(aggregate_runs)]
+        run_log_functions._write_lines(path, lines)
+        del lines
+        start = time.perf_counter()
+        summary = run_log_functions.aggregate_runs(run_log_functions.read_runs(path))
+        elapsed = time.perf_counter() - start
+        results["aggregate"] = {"runs": summary["runs"], "seconds": round(elapsed, 3), "runs_per_second": round(summary["runs"] / elapsed),
+                                "execution_time": summary["execution_time"]}
+
+        path = f"{log_dir}/rotated.jsonl"
+        for i in range(50):
+            run_log_functions.append_run(record, path, max_bytes=4096)
+        results["rotation"] = {"files": len(run_log_functions.log_files(path)), "runs": sum(1 for _ in run_log_functions.read_runs(path))}
+    return results
+
+def docx_parts(document):
+    """Contents of every part of a .docx (path or buffer), to compare documents regardless of zip timestamps"""
+    import zipfile
+    with zipfile.ZipFile(document) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+def benchmark_document(rows=(18, 100, 500), repeats=5):
+    """Time to render outlines of 18, 100 and 500 activity rows with the python-docx renderer versus the fast one
+
+    Params:
+        rows (tuple): Activity rows of the outlines
+        repeats (int): Renders timed per outline and renderer
+    """
+    import warnings
+    import document_functions
+
+    # python-docx warns about style lookups by id on every render
+    warnings.simplefilter("ignore")
+    results = {}
+    for weeks in rows:
+        outline = fake_course_outline(weeks=weeks)
+        outline['activities'][0]['activity_description'] = "Lecture\tand discussion\nGroup work & <review> "
+        timings = {}
+        for name, fast in [("python_docx", False), ("fast", True)]:
+            document_functions.create_word_document_from_json(outline, streamlit=True, fast=fast)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                document = document_functions.create_word_document_from_json(outline, streamlit=True, fast=fast)
+            timings[name] = round((time.perf_counter() - start) / repeats * 1000, 2)
+            timings[name + "_parts"] = docx_parts(document)
+        identical = timings.pop("python_docx_parts") == timings.pop("fast_parts")
+        assert identical, f"The fast renderer changed the document of {weeks} rows"
+        results[f"{weeks}_rows"] = {**{f"{name}_ms": ms for name, ms in timings.items()}, "identical": identical}
+    return results
+
+def benchmark_export(documents=48, weeks=100, workers=(1, 2, 4)):
+    """Documents/second of export_documents_zip() for different numbers of worker processes
+
+    Params:
+        documents (int): Outlines exported
+        weeks (int): Activity rows of every outline
+        workers (tuple): Worker process counts to compare
+    """
+    import os
+    import zipfile
+    import warnings
+    import document_functions
+
+    warnings.simplefilter("ignore")
+    outline = fake_course_outline(weeks=weeks)
+
+    def outlines():
+        for i in range(documents):
+            yield f"Course_{i + 1}_Course_Outline", outline
+
+    results = {"cpus": os.cpu_count()}
+    with tempfile.TemporaryDirectory() as export_dir:
+        for max_workers in workers:
+            path = f"{export_dir}/export_{max_workers}.zip"
+            report = document_functions.export_documents_zip(outlines(), path, max_workers=max_workers)
+            with zipfile.ZipFile(path) as archive:
+                assert len(archive.namelist()) == documents, "Documents are missing from the export"
+            results[f"{max_workers}_workers"] = {key: report[key] for key in ("seconds", "documents_per_second")}
+    return results
+
+def benchmark_jobs(jobs=4, workers=2, llm_latency=0.3, search_latency=0.3, poll_interval=0.05):
+    """Time a Streamlit script run is blocked by submitting a job versus running the pipeline, plus reattaching
+
+    Params:
+        jobs (int): Courses submitted at once (different inputs)
+        workers (int): JOB_WORKERS of the job pool
+        llm_latency (float): Fake OpenAI latency per completion
+        search_latency (float): Fake SerpAPI latency per search
+        poll_interval (float): Seconds between two get_job() polls
+    """
+    import os
+    import gpt_functions
+    import search_functions
+    import jobs_functions
+
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+
+    with tempfile.TemporaryDirectory() as jobs_dir:
+        jobs_functions.JOBS_DIR = jobs_dir
+        jobs_functions.JOB_WORKERS = workers
+        jobs_functions._executor = None
+        inputs = [{"course_title": f"Course {i + 1}", "course_description": "An introductory course", "instructor_name": "Instructor",
+                   "credit_units": 3, "target_students": "Students", "total_hours": 54, "weekly_hours": 3,
+                   "citation_style": "APA", "model": "gpt-4o", "document_title": ""} for i in range(jobs)]
+
+        submit_timings = []
+        job_ids = []
+        for course in inputs:
+            start = time.perf_counter()
+            job_ids.append(jobs_functions.submit_job(course))
+            submit_timings.append(time.perf_counter() - start)
+
+        # A reloaded page (or a second click) with the same inputs reattaches instead of starting another job
+        reattached = [jobs_functions.submit_job(course) for course in inputs] == job_ids
+
+        poll_timings = []
+        max_running = 0
+        start = time.perf_counter()
+        while True:
+            poll_start = time.perf_counter()
+            states = [jobs_functions.get_job(job_id) for job_id in job_ids]
+            poll_timings.append((time.perf_counter() - poll_start) / len(job_ids))
+            max_running = max(max_running, sum(job['status'] == "running" for job in states))
+            if all(job['status'] in ("done", "failed") for job in states):
+                break
+            time.sleep(poll_interval)
+        elapsed = time.perf_counter() - start
+
+        # After a restart of the server the finished jobs are read back from JOBS_DIR
+        jobs_functions._jobs.clear()
+        reloaded = [jobs_functions.get_job(job_id) for job_id in job_ids]
+        documents = [jobs_functions.job_document(job) for job in reloaded]
+        jobs_started = len([name for name in os.listdir(jobs_dir) if name.endswith(".json")])
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return {
+        "submit": summarize(submit_timings),
+        "poll": summarize(poll_timings),
+        "jobs_ms": round(elapsed * 1000, 2),
+        "max_running": max_running,
+        "reattached": reattached,
+        "jobs_started": jobs_started,
+        "done": sum(job['status'] == "done" for job in reloaded),
+        "documents_after_restart": sum(document is not None for document in documents),
+    }
+
+def benchmark_cassette(llm_latency=0.3, search_latency=0.5):
+    """Pipeline run while recording a cassette, replayed without network (local overhead only) and with recorded timing
+
+    Params:
+        llm_latency (float): Fake OpenAI latency per completion while recording
+        search_latency (float): Fake SerpAPI latency per search while recording
+    """
+    import warnings
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+    import cassette_functions
+
+    warnings.simplefilter("ignore")
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+
+    course_details = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+    timings = {}
+    outlines = {}
+    with tempfile.TemporaryDirectory() as cassette_dir:
+        path = cassette_dir + "/pipeline.json"
+        for name, mode, timing in [("record", "record", False), ("replay", "replay", False), ("replay_timed", "replay", True)]:
+            requests_before = len(openai_server.requests) + len(serp_server.requests)
+            with cassette_functions.use_cassette(path, mode=mode, timing=timing) as cassette:
+                start = time.perf_counter()
+                results = pipeline_functions.run_outline_pipeline(course_details, model='gpt-4o', streamlit=True)
+                timings[name] = {"ms": round((time.perf_counter() - start) * 1000, 2),
+                                 "upstream_requests": len(openai_server.requests) + len(serp_server.requests) - requests_before,
+                                 "interactions": cassette.stats()["interactions"]}
+            outlines[name] = results["course_outline"]
+
+        # A changed prompt can't be answered from the cassette
+        with cassette_functions.use_cassette(path):
+            try:
+                pipeline_functions.run_outline_pipeline(course_details + "\nInstructor Name: Someone Else", model='gpt-4o', streamlit=True)
+                mismatch = None
+            except cassette_functions.CassetteMismatch as e:
+                mismatch = str(e).splitlines()[0]
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return {
+        **timings,
+        "identical_outlines": outlines["record"] == outlines["replay"] == outlines["replay_timed"],
+        "mismatch": mismatch,
+    }
+
+def benchmark_stage_memo(llm_latency=0.3, search_latency=0.5):
+    """Time and upstream calls of a regeneration after a small edit, without and with a StageMemo
+
+    Params:
+        llm_latency (float): Fake OpenAI latency per completion
+        search_latency (float): Fake SerpAPI latency per search
+    """
+    import warnings
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+
+    warnings.simplefilter("ignore")
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+
+    def course(weekly_hours=3, citation_style='APA', document_title="Course_Outline"):
+        details = pipeline_functions.format_course_details("Introduction to Machine Learning", "An introductory course.", "Instructor", 3, "Students", 54, weekly_hours)
+        return dict(course_details=details, weekly_hours=weekly_hours, citation_style=citation_style, document_title=document_title, model='gpt-4o', streamlit=True)
+
+    edits = {"first_run": course(), "weekly_hours": course(weekly_hours=2), "citation_style": course(citation_style='MLA'), "document_title": course(document_title="Renamed")}
+    results = {}
+    for memo in (None, pipeline_functions.StageMemo()):
+        runs = {}
+        for name, inputs in edits.items():
+            requests_before = len(openai_server.requests) + len(serp_server.requests)
+            start = time.perf_counter()
+            outcome = pipeline_functions.run_outline_pipeline(**inputs, memo=memo)
+            runs[name] = {"ms": round((time.perf_counter() - start) * 1000, 2),
+                          "upstream_requests": len(openai_server.requests) + len(serp_server.requests) - requests_before,
+                          "reused": outcome["reused"]}
+        results["memo" if memo else "no_memo"] = runs
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return results
+
+def benchmark_outline_fan_out(weeks=(18, 36, 72), latency=0.3, token_latency=0.002):
+    """Time of the single pass course outline versus the per-topic fan-out for growing course lengths
+
+    Params:
+        weeks (tuple): Course lengths in weeks (3 hours per week)
+        latency (float): Fake OpenAI latency per completion
+        token_latency (float): Fake OpenAI seconds per completion token, so long outputs take longer
+    """
+    import warnings
+    import gpt_functions
+    import app_functions
+
+    warnings.simplefilter("ignore")
+    server, url = start_fake_server(FakeOpenAIHandler, latency=latency, token_latency=token_latency)
+    gpt_functions.configure_client(base_url=url)
+    course_details = "Course Title: Introduction to Machine Learning"
+
+    results = {}
+    for course_weeks in weeks:
+        server.weeks = course_weeks
+        result = {}
+        for name, fan_out in [("single_pass", False), ("fan_out", True)]:
+            start = time.perf_counter()
+            try:
+                outline = json.loads(app_functions.generate_course_outline(course_details, "Learning outcomes", total_hours=course_weeks * 3, weekly_hours=3, model='gpt-4o', fan_out=fan_out))
+                weeks_ok = [activity['week'] for activity in outline['activities']] == [f"Week {week + 1}" for week in range(course_weeks)]
+                result[name] = {"ms": round((time.perf_counter() - start) * 1000, 2), "activities": len(outline['activities']), "weeks_in_order": weeks_ok}
+            except Exception as e:
+                result[name] = {"ms": round((time.perf_counter() - start) * 1000, 2), "error": f"{type(e).__name__}: {str(e)[:80]}"}
+        results[f"{course_weeks}_weeks"] = result
+
+    server.shutdown()
+    return results
+
+def benchmark_routing(weeks=(18, 36), llm_latency=0.3, token_latency=0.001, search_latency=0.3, model_speed=None):
+    """Time, cost and per-stage latency of the pipeline under every routing profile
+
+    Params:
+        weeks (tuple): Course lengths in weeks (3 hours per week)
+        llm_latency (float): Fake OpenAI latency per completion of a model at speed 1.0
+        token_latency (float): Fake OpenAI seconds per completion token of a model at speed 1.0
+        search_latency (float): Fake SerpAPI latency per search
+        model_speed (dict): Model -> speed of its fake completions, default has gpt-4o-mini twice as fast as the others
+    """
+    import warnings
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+    import routing_functions
+
+    warnings.simplefilter("ignore")
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency, token_latency=token_latency)
+    openai_server.model_speed = model_speed or {"gpt-4o-mini": 2.0}
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+    # Pipeline stage -> span of its LLM calls (references also include the searches)
+    stages = {"queries": "generate_queries", "references": "filter_references", "learning_outcomes": "generate_learning_outcomes", "course_outline": "generate_course_outline"}
+
+    results = {}
+    for course_weeks in weeks:
+        openai_server.weeks = course_weeks
+        details = pipeline_functions.format_course_details("Introduction to Machine Learning", "An introductory course.", "Instructor", 3, "Students", course_weeks * 3, 3)
+        for profile in routing_functions.ROUTING_PROFILES:
+            with routing_functions.use_profile(profile):
+                caps = {stage: routing_functions.route(stage, 'gpt-4o', weeks=course_weeks)['max_tokens'] for stage in ("queries", "learning_outcomes", "course_outline")}
+            start = time.perf_counter()
+            try:
+                outcome = pipeline_functions.run_outline_pipeline(details, total_hours=course_weeks * 3, weekly_hours=3, model='gpt-4o', streamlit=True, profile=profile)
+            except Exception as e:
+                results[f"{course_weeks}_weeks_{profile}"] = {"ms": round((time.perf_counter() - start) * 1000, 2), "error": f"{type(e).__name__}: {str(e)[:80]}"}
+                continue
+            summary = outcome["trace_summary"]
+            results[f"{course_weeks}_weeks_{profile}"] = {
+                "ms": round((time.perf_counter() - start) * 1000, 2),
+                "cost_usd": summary["run_outline_pipeline"]["cost_usd"],
+                "max_tokens": caps,
+                "stages": {stage: {"ms": round(outcome["timings"][stage]["seconds"] * 1000, 2), "cost_usd": summary[name]["cost_usd"]} for stage, name in stages.items()},
+            }
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return results
+
+def benchmark_reference_store(sizes=(10_000, 100_000, 1_000_000), queries=200, subjects=10, search_latency=0.3):
+    """Lookup latency of the local reference store for growing numbers of references, and the searches it saves
+
+    Params:
+        sizes (tuple): Numbers of stored references, filled with synthetic references (Zipf distributed words)
+        queries (int): Lookups timed per size, three title words of a random stored reference each
+        subjects (int): Subjects of the search part, each searched for 5 results, then by another course with other words for 3
+        search_latency (float): Fake SerpAPI latency per search
+    """
+    import os
+    import shutil
+    import warnings
+    import numpy as np
+    import search_functions
+    import reference_store_functions
+
+    warnings.simplefilter("ignore")
+    results = {}
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        folder = tempfile.mkdtemp()
+        store = reference_store_functions.ReferenceStore(folder, flush_docs=100_000)
+        start = time.perf_counter()
+        titles = []
+        for first in range(0, size, 50_000):
+            count = min(50_000, size - first)
+            words = rng.zipf(1.2, size=(count, 26)) % 50_000
+            years = rng.integers(1990, 2025, size=count)
+            references = [{
+                "title": f"Reference {first + i} " + " ".join(f"w{word}" for word in words[i, :6]),
+                "link": f"https://example.org/{first + i}",
+                "snippet": " ".join(f"w{word}" for word in words[i, 6:]),
+                "publication_summary": f"A Author - Publisher, {years[i]} - example.org",
+                "year": int(years[i]),
+                "citations": 0,
+            } for i in range(count)]
+            titles.extend(reference['title'].split()[2:] for reference in references[:queries])
+            store.add(references)
+        store.optimize()
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = reference_store_functions.ReferenceStore(folder)
+        open_ms = (time.perf_counter() - start) * 1000
+        lookups = [" ".join(rng.choice(titles[i], 3, replace=False)) for i in rng.choice(len(titles), queries)]
+        timings = []
+        matched = 0
+        for query in lookups:
+            start = time.perf_counter()
+            matched += bool(store.search(query, num_results=5, as_ylo=2000))
+            timings.append(time.perf_counter() - start)
+        disk_bytes = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(folder) for name in names)
+        results[f"{size}_references"] = {
+            "build_s": round(build_seconds, 2),
+            "open_ms": round(open_ms, 2),
+            "lookup": summarize(timings),
+            "matched": round(matched / queries, 3),
+            "disk_mb": round(disk_bytes / 1024 / 1024, 1),
+        }
+        del store
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # Courses searching the same subjects with other words, without and with the store
+    server, url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+    search_functions.SERP_API_URL = url + "/search"
+    search_functions.configure_search_cache(None)
+    # The fake hits of a subject published since 2020 are its 3 first ones
+    wordings = [(f"subject {i} textbook", 5) for i in range(subjects)] + [(f"textbook on subject {i}", 3) for i in range(subjects)]
+    folder = tempfile.mkdtemp()
+    for name, path in [("no_store", None), ("store", folder)]:
+        search_functions.configure_reference_store(path)
+        requests_before = len(server.requests)
+        start = time.perf_counter()
+        for query, num_results in wordings:
+            search_functions.search_google_scholar(query, num_results=num_results)
+        results[name] = {"searches": len(wordings), "upstream_requests": len(server.requests) - requests_before,
+                         "ms": round((time.perf_counter() - start) * 1000, 2)}
+    search_functions.configure_reference_store(None)
+    shutil.rmtree(folder, ignore_errors=True)
+    server.shutdown()
+    return results
+
+def benchmark_prerank(topics=8, llm_latency=0.3, search_latency=0.3):
+    """Agreement of the pre-ranking with the LLM reference filter, and the pipeline time and filter calls it saves
+
+    A course with mixed-quality hits (see fake_scholar_fixture()) is recorded in a cassette with prerank=False, the
+    LLM filter of the fake server keeping the suitable hits, and the pre-ranking is evaluated on it with
+    evaluate_ranking() as it would be on a cassette of real searches.
+
+    Params:
+        topics (int): Topics (and searches) of the course
+        llm_latency (float): Fake OpenAI latency per completion
+        search_latency (float): Fake SerpAPI latency per search
+    """
+    import warnings
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+    import ranking_functions
+    import cassette_functions
+    from compaction_functions import count_tokens as prompt_tokens
+
+    warnings.simplefilter("ignore")
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=llm_latency)
+    openai_server.topics = topics
+    openai_server.suitable_links = set()
+    gpt_functions.configure_client(base_url=openai_url)
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=search_latency)
+
+    def scholar_hits(query, num_results):
+        organic_results, suitable = fake_scholar_fixture(query, num_results)
+        openai_server.suitable_links.update(suitable)
+        return organic_results
+
+    serp_server.scholar_hits = scholar_hits
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+    course_details = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cassette_dir:
+        path = cassette_dir + "/fixture.json"
+        with cassette_functions.use_cassette(path, mode="record"):
+            pipeline_functions.run_outline_pipeline(course_details, model='gpt-4o', streamlit=True, prerank=False)
+        results["quality"] = ranking_functions.evaluate_ranking(path)
+
+    for name, prerank in [("llm_filter", False), ("prerank", True)]:
+        requests_before = len(openai_server.requests)
+        start = time.perf_counter()
+        outcome = pipeline_functions.run_outline_pipeline(course_details, model='gpt-4o', streamlit=True, prerank=prerank)
+        filter_calls = sum(1 for body in openai_server.requests[requests_before:] if "Filter out sources that aren't ideal" in body['messages'][-1]['content'])
+        results[name] = {
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+            "references_ms": round(outcome["timings"]["references"]["seconds"] * 1000, 2),
+            "filter_calls": filter_calls,
+            "skipped_filters": outcome["references"].get("skipped_filters", 0),
+            "search_results_tokens": prompt_tokens(outcome["references"]["total_search_results"]),
+            "references_tokens": prompt_tokens(outcome["references"]["filtered_search_results"]),
+        }
+
+    openai_server.shutdown()
+    serp_server.shutdown()
+    return results
+
+
+BENCHMARKS = {
+    "client_pool": benchmark_client_pool,
+    "concurrent_search": benchmark_concurrent_search,
+    "llm_cache": benchmark_llm_cache,
+    "search_cache": benchmark_search_cache,
+    "streaming": benchmark_streaming,
+    "outline": benchmark_outline,
+    "pipeline": benchmark_pipeline,
+    "batch_api": benchmark_batch_api,
+    "compaction": benchmark_compaction,
+    "search_model": benchmark_search_model,
+    "key_pool": benchmark_key_pool,
+    "resilience": benchmark_resilience,
+    "tracing": benchmark_tracing,
+    "run_log": benchmark_run_log,
+    "document": benchmark_document,
+    "export": benchmark_export,
+    "jobs": benchmark_jobs,
+    "cassette": benchmark_cassette,
+    "stage_memo": benchmark_stage_memo,
+    "outline_fan_out": benchmark_outline_fan_out,
+    "routing": benchmark_routing,
+    "reference_store": benchmark_reference_store,
+    "prerank": benchmark_prerank,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(name, json.dumps(BENCHMARKS[name](), indent=4))
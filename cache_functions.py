@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+def make_key(*parts):
+    """Content-addressed cache key: sha256 of the JSON encoded parts"""
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+class SQLiteCache:
+    """Persistent key-value cache backed by a SQLite file, with TTL and size-bounded LRU eviction
+
+    Values are stored as JSON, so anything json.dumps() accepts can be cached. The file is only created on first use,
+    so a cache made at import time doesn't write to disk.
+    Usage:
+        cache = SQLiteCache('.cache/completions.sqlite', ttl=7*24*3600, max_entries=10000)
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value)
+    """
+
+    def __init__(self, path, ttl=7*24*3600, max_entries=10000, table="cache"):
+        """
+        Params:
+            path (str): SQLite file, use ":memory:" for a cache that lives only in this process
+            ttl (float): Seconds an entry stays valid. None keeps entries until they are evicted
+            max_entries (int): Max number of entries, the least recently used are evicted first
+            table (str): Table name, so several caches can share one file
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        # Called with self._lock held
+        if self._conn is None:
+            if self.path != ":memory:" and os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key, default=None):
+        """Returns the cached value, or default if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Stores value under key and evicts the least recently used entries above max_entries"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            if self.max_entries is not None:
+                conn.execute(f"""DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+    def clear(self):
+        """Removes every entry and resets the counters"""
+        with self._lock:
+            self._connection().execute(f"DELETE FROM {self.table}")
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is None and (self.path == ":memory:" or not os.path.exists(self.path)):
+                return 0
+            return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+class SingleFlight:
+    """Deduplicates concurrent calls with the same key: the first caller runs the function,
+    callers arriving while it runs wait for and share its result (or exception)
+
+    Usage:
+        flight = SingleFlight()
+        results = flight.do(key, lambda: expensive_request(query))
+    """
+
+    def __init__(self):
+        self.shared = 0  # Calls answered by another caller's in-flight request
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return call.result()
+        try:
+            result = function()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -0,0 +1,166 @@
+"""Record/replay cassettes of the LLM and search traffic of a run
+
+Record the gpt_response()/agpt_response() and search_google_scholar() calls of a real run once:
+    with use_cassette("cassettes/ml_course.json", mode="record"):
+        run_outline_pipeline(course_details)
+then replay it offline, deterministically, as many times as needed:
+    with use_cassette("cassettes/ml_course.json"):                 # no network, no waiting
+        run_outline_pipeline(course_details)
+    with use_cassette("cassettes/ml_course.json", timing=True):    # sleeps the recorded duration of every call
+
+Requests are matched on the hash of everything that changes the answer (the same key as the caches), a request
+that isn't in the cassette raises CassetteMismatch with a diff against the closest recorded request. The caches
+are skipped while a cassette is in use, so a recording holds real upstream calls and their durations.
+Summary of a cassette:
+    python cassette_functions.py cassettes/ml_course.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import difflib
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class CassetteMismatch(LookupError):
+    """Raised when a replayed request isn't in the cassette"""
+
+class Cassette:
+    """Recorded calls, in the order they were made, answered by key when replaying
+
+    A request made several times is answered with its recordings in order, the last one is repeated after that.
+    """
+
+    def __init__(self, path, mode="replay", timing=False, speed=1.0):
+        """
+        Params:
+            path (str): JSON file of the cassette
+            mode (str): "record" calls the upstreams and saves every call, "replay" answers from the file
+            timing (bool): When replaying, sleep the recorded duration of every call
+            speed (float): Recorded durations are divided by speed (i.e. 2.0 replays twice as fast)
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}', use 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.speed = speed
+        self.interactions = []
+        self.played = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            with open(path, encoding='utf-8') as f:
+                self.interactions = json.load(f)['interactions']
+            for interaction in self.interactions:
+                self._queues.setdefault(interaction['key'], deque()).append(interaction)
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            cassette = {"version": 1, "recorded": time.time(), "interactions": list(self.interactions)}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cassette, f, indent=1, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def record(self, kind, key, request, response, seconds):
+        with self._lock:
+            self.interactions.append({"kind": kind, "key": key, "request": request, "response": response, "seconds": round(seconds, 4)})
+
+    def play(self, kind, key, request):
+        """Recorded interaction of a request, raises CassetteMismatch when there is none"""
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMismatch(self._mismatch_message(kind, key, request))
+            interaction = queue.popleft() if len(queue) > 1 else queue[0]
+            self.played += 1
+        return interaction
+
+    def delay(self, interaction):
+        """Seconds to sleep for a replayed interaction"""
+        return interaction['seconds'] / self.speed if self.timing else 0.0
+
+    def call(self, kind, key, request, function):
+        """Replays the response of a request, or calls function() and records its response when recording"""
+        if self.mode == "replay":
+            interaction = self.play(kind, key, request)
+            time.sleep(self.delay(interaction))
+            return interaction['response']
+        start = time.perf_counter()
+        response = function()
+        self.record(kind, key, request, response, time.perf_counter() - start)
+        return response
+
+    async def acall(self, kind, key, request, function):
+        """Async version of call(), function() returns a coroutine"""
+        if self.mode == "replay":
+            interaction = self.play(kind, key, request)
+            await asyncio.sleep(self.delay(interaction))
+            return interaction['response']
+        start = time.perf_counter()
+        response = await function()
+        self.record(kind, key, request, response, time.perf_counter() - start)
+        return response
+
+    def _mismatch_message(self, kind, key, request):
+        message = f"No {kind} request with key {key[:16]} was recorded in {self.path}"
+        recorded = [interaction['request'] for interaction in self.interactions if interaction['kind'] == kind]
+        if not recorded:
+            return message
+        # Show what differs from the closest recorded request of the same kind
+        text = json.dumps(request, indent=1, ensure_ascii=False, sort_keys=True).splitlines()
+        closest = max(recorded, key=lambda other: difflib.SequenceMatcher(None, text, json.dumps(other, indent=1, ensure_ascii=False, sort_keys=True).splitlines()).ratio())
+        closest_text = json.dumps(closest, indent=1, ensure_ascii=False, sort_keys=True).splitlines()
+        diff = list(difflib.unified_diff(closest_text, text, "recorded", "requested", n=1, lineterm=""))
+        if len(diff) > 40:
+            diff = diff[:40] + [f"... {len(diff) - 40} more lines"]
+        return message + ". Closest recorded request:\n" + "\n".join(diff)
+
+    def stats(self):
+        kinds = {}
+        for interaction in self.interactions:
+            total = kinds.setdefault(interaction['kind'], {"calls": 0, "seconds": 0.0})
+            total["calls"] += 1
+            total["seconds"] = round(total["seconds"] + interaction['seconds'], 4)
+        return {"mode": self.mode, "interactions": len(self.interactions), "played": self.played, "kinds": kinds}
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def active_cassette():
+    """The cassette in use, None outside of use_cassette()"""
+    return _cassette
+
+@contextmanager
+def use_cassette(path, mode="replay", timing=False, speed=1.0):
+    """Records or replays the LLM and search calls made inside the block, in every thread
+
+    Params: see Cassette. A recording is saved when the block exits, even if it raised.
+
+    Output:
+        cassette (Cassette): The cassette, i.e. cassette.stats()
+    """
+    global _cassette
+    cassette = Cassette(path, mode, timing, speed)
+    with _cassette_lock:
+        if _cassette is not None:
+            raise RuntimeError(f"The cassette {_cassette.path} is already in use")
+        _cassette = cassette
+    try:
+        yield cassette
+    finally:
+        with _cassette_lock:
+            _cassette = None
+        if mode == "record":
+            cassette.save()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python cassette_functions.py cassette.json")
+    print(json.dumps(Cassette(sys.argv[1]).stats(), indent=4))
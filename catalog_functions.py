@@ -0,0 +1,246 @@
+"""Headless batch generation of course outlines for a whole catalog
+
+Usage:
+    python catalog_functions.py courses.csv --output-dir catalog_outputs --concurrency 8
+
+Each row of the CSV/JSONL file is a course with the fields of the Streamlit form:
+    course_title, course_description, instructor_name, credit_units, target_students,
+    total_hours, weekly_hours, citation_style, model, document_title
+Only course_title is required. Finished stages are checkpointed per course, so an interrupted
+batch started again with the same arguments resumes without repeating paid API calls.
+With --batch-api the LLM calls go through the OpenAI Batch API instead, see batch_api_functions.py.
+With --export-zip all finished outlines are also rendered into a single ZIP file.
+With --reference-store searches are answered from the references found by earlier searches when enough of them match
+(see reference_store_functions.py), so a large catalog doesn't pay SerpAPI again for the same textbooks.
+With --profile the LLM calls are routed with a profile of routing_functions.py (i.e. "fast" for a cheap draft catalog).
+"""
+import os
+import re
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app_functions import *
+
+
+# Defaults for the optional columns, same as the Streamlit form
+COURSE_DEFAULTS = {
+    "course_description": None,
+    "instructor_name": "",
+    "credit_units": 3,
+    "target_students": "",
+    "total_hours": 54,
+    "weekly_hours": 3,
+    "citation_style": "APA",
+    "model": "gpt-4o",
+    "document_title": "",
+}
+
+# Stages of a course in order, each one is checkpointed once done
+CATALOG_STAGES = ["description", "queries", "search_results", "learning_outcomes", "course_outline", "document"]
+
+def read_courses(path):
+    """Reads course rows from a .csv or .jsonl file, filling in COURSE_DEFAULTS"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    courses = []
+    for i, row in enumerate(rows):
+        row = {key: value for key, value in row.items() if value not in (None, '')}
+        if 'course_title' not in row:
+            raise ValueError(f"Row {i + 1} of {path} has no course_title")
+        course = {**COURSE_DEFAULTS, **row}
+        for key in ['credit_units', 'total_hours', 'weekly_hours']:
+            course[key] = int(course[key])
+        course['id'] = course_id(course)
+        courses.append(course)
+    return courses
+
+def course_id(course):
+    """Stable id of a course row: slug of the title plus a hash of the row"""
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', course['course_title']).strip('_')[:60]
+    digest = hashlib.sha256(json.dumps({key: course[key] for key in sorted(course) if key != 'id'}, default=str).encode()).hexdigest()
+    return f"{slug}_{digest[:8]}"
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_checkpoint(path, checkpoint):
+    # Write to a temporary file first, so an interrupted write never leaves a broken checkpoint
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+def run_course(course, output_dir):
+    """Runs every stage of one course, skipping stages already in its checkpoint
+
+    Output:
+    record (dict): Manifest record of the course with the document path and stage timings
+    """
+    checkpoint_path = os.path.join(output_dir, "checkpoints", f"{course['id']}.json")
+    checkpoint = load_checkpoint(checkpoint_path)
+    timings = {}
+
+    def stage(name, function):
+        if name in checkpoint:
+            timings[name] = "checkpoint"
+            return checkpoint[name]
+        start = time.perf_counter()
+        with stage_deadline(name):
+            result = function()
+        timings[name] = round(time.perf_counter() - start, 3)
+        checkpoint[name] = result
+        save_checkpoint(checkpoint_path, checkpoint)
+        return result
+
+    start = time.perf_counter()
+    with collect_spans() as spans:
+        document_path = run_stages(course, output_dir, stage)
+    usage = usage_totals(spans)
+
+    return {
+        "id": course['id'],
+        "course_title": course['course_title'],
+        "status": "done",
+        "document": document_path,
+        "seconds": round(time.perf_counter() - start, 3),
+        "stages": timings,
+        # Tokens and cost of the calls made by this run (stages loaded from the checkpoint cost nothing)
+        **usage,
+    }
+
+def run_stages(course, output_dir, stage):
+    """Runs the stages of run_course() in order through stage(name, function), returning the document path"""
+    def queries():
+        return json.loads(generate_queries(course_details=course_details))
+
+    def document():
+        document_title = course['document_title'] or f"{course['id']}_Course_Outline"
+        return create_word_document_from_json(course_outline, title=os.path.join(output_dir, document_title))
+
+    description = stage("description", lambda: course['course_description'] or generate_description(course['course_title'], course['target_students']))
+    course_details = format_course_details(
+        course['course_title'], description, course['instructor_name'], course['credit_units'],
+        course['target_students'], course['total_hours'], course['weekly_hours']
+    )
+    queries = stage("queries", queries)
+    search_results = stage("search_results", lambda: get_search_results(queries))
+    learning_outcomes = stage("learning_outcomes", lambda: generate_learning_outcomes(
+        course_details=course_details,
+        total_search_results=search_results,
+        citation_style=course['citation_style'],
+        model=course['model']
+    ))
+    course_outline = stage("course_outline", lambda: json.loads(generate_course_outline(
+        course_details=course_details,
+        learning_outcomes=learning_outcomes,
+        total_hours=course['total_hours'],
+        weekly_hours=course['weekly_hours'],
+        model=course['model']
+    )))
+    return stage("document", document)
+
+def read_manifest(output_dir):
+    """Ids of the courses already done in the manifest of output_dir"""
+    manifest_path = os.path.join(output_dir, "manifest.jsonl")
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path, encoding='utf-8') as f:
+        return {record['id'] for record in map(json.loads, f) if record['status'] == 'done'}
+
+_manifest_lock = threading.Lock()
+
+def append_manifest(output_dir, record):
+    with _manifest_lock:
+        with open(os.path.join(output_dir, "manifest.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    print(f"[{record['status']}] {record['course_title']}")
+
+def failed_record(course, error):
+    print(f"Error generating outline for '{course['course_title']}': {error}")
+    return {"id": course['id'], "course_title": course['course_title'], "status": "failed", "error": str(error)}
+
+def catalog_report(courses, pending, records, elapsed, output_dir):
+    latencies = sorted(record['seconds'] for record in records if record['status'] == 'done')
+    return {
+        "courses": len(courses),
+        "skipped": len(courses) - len(pending),
+        "done": len(latencies),
+        "failed": len(records) - len(latencies),
+        "seconds": round(elapsed, 3),
+        "courses_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed else 0.0,
+        "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+        "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "manifest": os.path.join(output_dir, "manifest.jsonl"),
+    }
+
+def catalog_outlines(courses, output_dir):
+    """(document name, course outline) of every course whose outline is in its checkpoint, for export_documents_zip()"""
+    for course in courses:
+        checkpoint = load_checkpoint(os.path.join(output_dir, "checkpoints", f"{course['id']}.json"))
+        if 'course_outline' in checkpoint:
+            yield course['document_title'] or f"{course['id']}_Course_Outline", checkpoint['course_outline']
+
+def run_catalog(courses, output_dir="catalog_outputs", concurrency=4):
+    """Generates the outlines of every course with at most `concurrency` courses in progress at once
+
+    Finished courses are appended to manifest.jsonl in output_dir, courses already done in the manifest are skipped.
+
+    Output:
+    report (dict): Number of courses done/failed, throughput (courses/minute) and per-course latency
+    """
+    os.makedirs(os.path.join(output_dir, "checkpoints"), exist_ok=True)
+    done = read_manifest(output_dir)
+    pending = [course for course in courses if course['id'] not in done]
+
+    def run(course):
+        try:
+            record = run_course(course, output_dir)
+        except Exception as e:
+            record = failed_record(course, e)
+        append_manifest(output_dir, record)
+        return record
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        records = list(executor.map(run, pending))
+    return catalog_report(courses, pending, records, time.perf_counter() - start, output_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate course outlines for every course in a CSV/JSONL file")
+    parser.add_argument("courses", help="CSV or JSONL file of courses")
+    parser.add_argument("--output-dir", default="catalog_outputs", help="Folder for the documents, manifest and checkpoints")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max number of courses generated at the same time")
+    parser.add_argument("--batch-api", action="store_true", help="Send the LLM calls of every stage as one OpenAI Batch API job (cheaper, up to 24h per stage)")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between Batch API status checks")
+    parser.add_argument("--export-zip", help="Also render every finished outline into this ZIP file")
+    parser.add_argument("--export-workers", type=int, default=None, help="Processes rendering the ZIP export (default: number of CPUs)")
+    parser.add_argument("--profile", choices=list(ROUTING_PROFILES), default=None, help="Routing profile of the LLM calls (model, max_tokens and temperature per stage)")
+    parser.add_argument("--reference-store", nargs="?", const=".cache/references", default=None, help="Folder of the local reference store (default: .cache/references)")
+    args = parser.parse_args()
+
+    if args.reference_store:
+        configure_reference_store(args.reference_store)
+    if args.profile:
+        configure_routing(profile=args.profile)
+    courses = read_courses(args.courses)
+    if args.batch_api:
+        from batch_api_functions import run_catalog_batch
+        report = run_catalog_batch(courses, args.output_dir, args.concurrency, poll_interval=args.poll_interval)
+    else:
+        report = run_catalog(courses, args.output_dir, args.concurrency)
+    if args.export_zip:
+        report['export'] = export_documents_zip(catalog_outlines(courses, args.output_dir), args.export_zip, args.export_workers)
+    print(json.dumps(report, indent=4))
+    sys.exit(1 if report['failed'] else 0)
@@ -0,0 +1,155 @@
+import re
+import math
+import datetime
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+SEARCH_TOKEN_BUDGET = 3000  # Default token budget of the search results pasted into the prompts
+MAX_SNIPPET_TOKENS = 60     # Snippets longer than this are cut
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The encoding files are downloaded on first use, which fails without network access
+        print(f"Could not load the tokenizer for {model}, estimating token counts instead: {e}")
+        return None
+
+def count_tokens(text, model='gpt-4o'):
+    """Number of tokens of text for the model, counted with tiktoken (estimated as 4 characters per token without it)"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_tokens(text, max_tokens, model='gpt-4o'):
+    """Cuts text to at most max_tokens tokens, ending with '...' when it was cut"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text if len(text) <= max_tokens * 4 else text[:max_tokens * 4].rstrip() + "..."
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens]).rstrip() + "..."
+
+def hit_score(search_result, current_year=None):
+    """Priority of a SearchResult when trimming to the budget: half recency (last 10 years), half citations (log scale)"""
+    current_year = current_year or datetime.date.today().year
+    recency = 0.3 if search_result.year is None else max(0.0, 1 - (current_year - search_result.year) / 10)
+    citations = min(1.0, math.log1p(search_result.citations) / math.log1p(1000))
+    return 0.5 * recency + 0.5 * citations
+
+def _normalize_title(title):
+    return " ".join(re.sub(r'[^a-z0-9 ]', ' ', title.lower()).split())
+
+def _hit_keys(search_result):
+    return {search_result.link, _normalize_title(search_result.title)} - {''}
+
+def drop_repeated_references(texts):
+    """Drops the references of every text already listed in an earlier one (same link or title), in order
+
+    Reads the texts of compact_search_results(), TopicResults.to_prompt() and filter_references(): a reference starts
+    at a "Title:" line and ends before the next one, the lines before the first reference (the topic) are kept.
+
+    Output:
+    texts (list): The texts without their repeated references, "" for a text left without any
+    """
+    seen = set()
+    deduplicated = []
+    for text in texts:
+        head, references = [], []
+        for line in text.splitlines():
+            if re.search(r'\bTitle:', line):
+                references.append([line])
+            elif references:
+                references[-1].append(line)
+            else:
+                head.append(line)
+        kept = []
+        for reference in references:
+            block = "\n".join(reference)
+            title = re.search(r'Title:\s*"?(.*?)"?\s*(?:\||$)', reference[0])
+            link = re.search(r'Link:\s*"?([^"\s|]+)', block)
+            keys = {link.group(1) if link else '', _normalize_title(title.group(1)) if title else ''} - {''}
+            if keys & seen:
+                continue
+            seen.update(keys)
+            kept.append(block)
+        deduplicated.append("\n".join(head + kept) if kept else "")
+    return deduplicated
+
+def format_hit(search_result, max_snippet_tokens=MAX_SNIPPET_TOKENS, model='gpt-4o'):
+    """One compact line per SearchResult, without the indentation of SearchResult.to_prompt()"""
+    snippet = " ".join(search_result.snippet.split())
+    return (f"- Title: {' '.join(search_result.title.split())}"
+            f" | Link: {search_result.link}"
+            f" | Snippet: {truncate_tokens(snippet, max_snippet_tokens, model)}"
+            f" | Publication Summary: {search_result.publication_summary}")
+
+def compact_search_results(topic_results, token_budget=SEARCH_TOKEN_BUDGET, max_snippet_tokens=MAX_SNIPPET_TOKENS, model='gpt-4o', seen=None):
+    """Deduplicates, cleans and trims the search results of several topics to a token budget
+
+    Hits seen before (same link or title) are dropped, snippets are cut to max_snippet_tokens, and hits are added
+    in rounds (the best remaining hit of every topic per round, by hit_score()) while they fit in token_budget,
+    so every topic keeps its best hits. Topics and hits are written in their original order.
+
+    Params:
+    topic_results (list): TopicResults of the topics, i.e. from get_topic_results()
+    token_budget (int): Max tokens of the compacted text
+    max_snippet_tokens (int): Max tokens of a snippet
+    model (str): Model whose tokenizer counts the tokens
+    seen (set): Links/titles already used, shared between calls to deduplicate across them (i.e. one call per topic)
+
+    Output:
+    text (str): The compacted search results
+    stats (dict): Tokens and hits before/after compaction
+    """
+    seen = set() if seen is None else seen
+    stats = {"tokens_before": 0, "tokens_after": 0, "hits_before": 0, "hits_after": 0, "duplicates": 0}
+
+    topics = []
+    for topic_result in topic_results:
+        stats["tokens_before"] += count_tokens(topic_result.to_prompt(), model)
+        hits = []
+        for position, search_result in enumerate(topic_result.results):
+            stats["hits_before"] += 1
+            keys = _hit_keys(search_result)
+            if keys & seen:
+                stats["duplicates"] += 1
+                continue
+            seen.update(keys)
+            line = format_hit(search_result, max_snippet_tokens, model)
+            hits.append({"position": position, "line": line, "tokens": count_tokens(line, model) + 1, "score": hit_score(search_result)})
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        header = f"Topic: {topic_result.topic}"
+        topics.append({"header": header, "header_tokens": count_tokens(header, model) + 2, "hits": hits, "kept": []})
+
+    used = 0
+    for rank in range(max((len(topic["hits"]) for topic in topics), default=0)):
+        for topic in topics:
+            if rank >= len(topic["hits"]):
+                continue
+            hit = topic["hits"][rank]
+            cost = hit["tokens"] + (0 if topic["kept"] else topic["header_tokens"])
+            if used + cost <= token_budget:
+                topic["kept"].append(hit)
+                used += cost
+
+    blocks = []
+    for topic in topics:
+        if topic["kept"]:
+            lines = [hit["line"] for hit in sorted(topic["kept"], key=lambda hit: hit["position"])]
+            blocks.append("\n".join([topic["header"]] + lines))
+    text = "\n\n".join(blocks)
+
+    stats["hits_after"] = sum(len(topic["kept"]) for topic in topics)
+    stats["tokens_after"] = count_tokens(text, model) if text else 0
+    return text, stats
@@ -4,9 +4,18 @@ from docx.shared import Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_ALIGN_VERTICAL
 from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 from docx.enum.dml import MSO_THEME_COLOR_INDEX
 import docx
 from io import BytesIO
+from copy import deepcopy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+import zipfile
+import threading
+from tracing_functions import traced
 
 
 def add_hyperlink(paragraph, text, url):
@@ -74,8 +83,172 @@ def set_cell_border(cell, **kwargs):
                 if key in edge_data:
                     el.set(key, str(edge_data[key]))
 
-def create_word_document_from_json(json_data, title="Course_Outline.docx", streamlit=False):
-    doc = Document()
+# JSON schema of the course outline read by create_word_document_from_json()
+# (follows the structured output rules: every property required, no additional properties)
+COURSE_OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "course_title": {"type": "string"},
+        "course_description": {"type": "string"},
+        "instructor_name": {"type": "string"},
+        "credit_units": {"type": "string"},
+        "total_hours": {"type": "string"},
+        "weekly_hours": {"type": "string"},
+        "clos": {"type": "array", "items": {"type": "string"}},
+        "topics": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "topic": {"type": "string"},
+                    "ilos": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["topic", "ilos"],
+                "additionalProperties": False
+            }
+        },
+        "references": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "reference": {"type": "string"},
+                    "link": {"type": "string"}
+                },
+                "required": ["reference", "link"],
+                "additionalProperties": False
+            }
+        },
+        "activities": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "week": {"type": "string"},
+                    "topic": {"type": "string"},
+                    "activity_description": {"type": "string"},
+                    "expected_output": {"type": "string"},
+                    "assessment_tools": {"type": "string"}
+                },
+                "required": ["week", "topic", "activity_description", "expected_output", "assessment_tools"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["course_title", "course_description", "instructor_name", "credit_units", "total_hours",
+                 "weekly_hours", "clos", "topics", "references", "activities"],
+    "additionalProperties": False
+}
+
+_JSON_TYPES = {"object": dict, "array": list, "string": str, "integer": int}
+
+def validate_course_outline(json_data, schema=COURSE_OUTLINE_SCHEMA, path="outline"):
+    """Checks json_data against the course outline schema, raising ValueError at the first mismatch
+
+    Only the parts of JSON schema used by COURSE_OUTLINE_SCHEMA are supported (type, properties, required, items).
+    Values of the details table (credit_units, total_hours, ...) may also be numbers, as they are only formatted into text.
+    """
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(json_data, expected) and not (expected is str and isinstance(json_data, (int, float))):
+        raise ValueError(f"{path} should be of type {schema['type']}, got {type(json_data).__name__}")
+
+    if schema["type"] == "object":
+        for key in schema.get("required", []):
+            if key not in json_data:
+                raise ValueError(f"{path} is missing '{key}'")
+        for key, value in json_data.items():
+            if key in schema["properties"]:
+                validate_course_outline(value, schema["properties"][key], f"{path}.{key}")
+    elif schema["type"] == "array":
+        for i, item in enumerate(json_data):
+            validate_course_outline(item, schema["items"], f"{path}[{i}]")
+    return json_data
+
+# Keys of the activities in the order of the weekly activities table columns
+ACTIVITY_COLUMNS = ["week", "topic", "activity_description", "expected_output", "assessment_tools"]
+
+def add_activity_row(table, activity):
+    """Adds one row of the weekly activities table with python-docx"""
+    row_cells = table.add_row().cells
+    for cell, key in zip(row_cells, ACTIVITY_COLUMNS):
+        cell.text = activity[key]
+
+    for cell in row_cells:
+        set_cell_border(cell, top={"sz": 12, "val": "single"},
+                        bottom={"sz": 12, "val": "single"},
+                        start={"sz": 12, "val": "single"},
+                        end={"sz": 12, "val": "single"})
+        for paragraph in cell.paragraphs:
+            for run in paragraph.runs:
+                run.font.size = Pt(10)
+        if cell == row_cells[1]:
+            for paragraph in cell.paragraphs:
+                for run in paragraph.runs:
+                    run.font.bold = True
+
+# The base document and activity row template of the fast renderer, one per thread (lxml trees aren't thread-safe)
+_renderer = threading.local()
+
+def _base_document():
+    """Document() parsed once per thread with its style ids cached, every use gets a fresh copy of its original XML and relationships"""
+    state = getattr(_renderer, 'state', None)
+    if state is None:
+        part = Document().part
+        state = _renderer.state = {"part": part, "element": deepcopy(part.element), "rels": set(part.rels), "row": None}
+        # Looking up a style scans every style of the document, the ids never change for the base document
+        style_ids = {}
+        lookup = part.get_style_id
+
+        def get_style_id(style_or_name, style_type):
+            if not isinstance(style_or_name, str):
+                return lookup(style_or_name, style_type)
+            if (style_or_name, style_type) not in style_ids:
+                style_ids[style_or_name, style_type] = lookup(style_or_name, style_type)
+            return style_ids[style_or_name, style_type]
+        part.get_style_id = get_style_id
+
+    # The previous tree is dropped as a whole, which is much cheaper than removing its content
+    part = state["part"]
+    part._element = deepcopy(state["element"])
+    # Hyperlinks of the previous outline
+    for r_id in set(part.rels) - state["rels"]:
+        part.rels.pop(r_id)
+    return part.document
+
+def add_activity_rows_fast(table, activities):
+    """Adds the rows of the weekly activities table by copying a row template, same XML as add_activity_row()
+
+    The template is a row built once with add_activity_row() (borders, font size and bold already applied),
+    so every activity only costs a copy of the row and setting the text of its five runs.
+    """
+    state = _renderer.state
+    if state["row"] is None:
+        add_activity_row(table, {key: "" for key in ACTIVITY_COLUMNS})
+        state["row"] = table.rows[-1]._tr
+        table._tbl.remove(state["row"])
+
+    tbl = table._tbl
+    for activity in activities:
+        tr = deepcopy(state["row"])
+        for tc, key in zip(tr.iterchildren(qn('w:tc')), ACTIVITY_COLUMNS):
+            # Same text handling as cell.text (tabs and line breaks become w:tab and w:br)
+            tc.find(qn('w:p')).find(qn('w:r')).text = activity[key]
+        tbl.append(tr)
+
+@traced("document")
+def create_word_document_from_json(json_data, title="Course_Outline.docx", streamlit=False, fast=True):
+    """
+    Params:
+    json_data (dict): The course outline, see COURSE_OUTLINE_SCHEMA
+    title (str): File name of the word document
+    streamlit (bool): Return the document as a BytesIO buffer instead of saving it
+    fast (bool): Reuse the parsed base document and its style ids, and copy a row template for the activities,
+                 set to False for the original python-docx renderer (same output, slower for long outlines)
+
+    Output:
+    document (str or BytesIO): Path of the saved document, or the buffer if streamlit=True
+    """
+    doc = _base_document() if fast else Document()
     doc.add_heading('Course Outline', level=1)
 
     details_table = doc.add_table(rows=2, cols=2)
@@ -122,26 +295,11 @@ def create_word_document_from_json(json_data, title="Course_Outline.docx", strea
         else:
             hdr_cells[i].width = Inches(1.5)
 
-    for activity in json_data['activities']:
-        row_cells = table.add_row().cells
-        row_cells[0].text = activity['week']
-        row_cells[1].text = activity['topic']
-        row_cells[2].text = activity['activity_description']
-        row_cells[3].text = activity['expected_output']
-        row_cells[4].text = activity['assessment_tools']
-
-        for cell in row_cells:
-            set_cell_border(cell, top={"sz": 12, "val": "single"},
-                            bottom={"sz": 12, "val": "single"},
-                            start={"sz": 12, "val": "single"},
-                            end={"sz": 12, "val": "single"})
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(10)
-            if cell == row_cells[1]:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.bold = True
+    if fast:
+        add_activity_rows_fast(table, json_data['activities'])
+    else:
+        for activity in json_data['activities']:
+            add_activity_row(table, activity)
 
     if "references" in json_data:
         doc.add_heading('References', level=2)
@@ -163,3 +321,66 @@ def create_word_document_from_json(json_data, title="Course_Outline.docx", strea
         doc.save(title+'.docx')
         return title+'.docx'
 
+
+def _render_document(name, json_data):
+    # Runs in the worker processes of export_documents_zip()
+    return name, create_word_document_from_json(json_data, streamlit=True).getvalue()
+
+def _unique_name(name, used):
+    base, extension = os.path.splitext(name if name.endswith('.docx') else name + '.docx')
+    name, i = base + extension, 2
+    while name in used:
+        name, i = f"{base} ({i}){extension}", i + 1
+    used.add(name)
+    return name
+
+def export_documents_zip(outlines, destination, max_workers=None):
+    """Renders many course outlines in a process pool and writes the documents into one ZIP archive
+
+    Rendering is CPU-bound python-docx work that holds the GIL, so each worker process renders its own documents.
+    Documents are written to the archive in order as soon as they are ready and at most 2 * max_workers of them
+    are in memory at once, so the size of the export isn't limited by memory.
+
+    Params:
+    outlines (iterable): (file name, course outline JSON) pairs, i.e. from a generator reading checkpoints
+    destination (str or file): Path of the ZIP file, or a writable file object (i.e. BytesIO for st.download_button)
+    max_workers (int): Worker processes, defaults to the number of CPUs. 1 renders in this process
+
+    Output:
+    report (dict): Number of documents, bytes written, seconds and documents/second
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    documents = 0
+    size = 0
+    used = set()
+
+    # .docx files are already deflated, compressing them again would only cost time
+    with zipfile.ZipFile(destination, 'w', compression=zipfile.ZIP_STORED) as archive:
+        def write(name, content):
+            nonlocal documents, size
+            archive.writestr(_unique_name(name, used), content)
+            documents += 1
+            size += len(content)
+
+        if max_workers == 1:
+            for name, json_data in outlines:
+                write(*_render_document(name, json_data))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                pending = deque()
+                for name, json_data in outlines:
+                    pending.append(executor.submit(_render_document, name, json_data))
+                    if len(pending) >= 2 * max_workers:
+                        write(*pending.popleft().result())
+                while pending:
+                    write(*pending.popleft().result())
+
+    seconds = time.perf_counter() - start
+    return {
+        "documents": documents,
+        "bytes": size,
+        "workers": max_workers,
+        "seconds": round(seconds, 3),
+        "documents_per_second": round(documents / seconds, 2) if seconds else 0.0,
+    }
@@ -1,6 +1,25 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 import toml
 import streamlit as st
+import time
+import asyncio
+import threading
+import weakref
+import json
+import contextvars
+from contextlib import contextmanager
+from cache_functions import SQLiteCache, make_key
+from tracing_functions import span, start_span
+from cassette_functions import active_cassette
+from resilience_functions import (call_with_retries, acall_with_retries, hedged_call, ahedged_call, latency_key,
+                                  attempt_timeout, retry_delay, stage_deadline, configure_retries, resilience_stats,
+                                  DeadlineExceeded)
+
+try:
+    import httpx
+except ImportError:
+    # newer openai releases ship on the httpx2 fork
+    import httpx2 as httpx
 
 
 try:
@@ -9,26 +28,182 @@ try:
 except:
     OPENAI_API_KEY = st.secrets['OPENAI_API_KEY']
 
-def gpt_response(prompt, model = 'gpt-4o-mini',max_tokens = 4000,response_format = "text", temperature=0.5,system_message="you are a helpful assistant"):
-    """Standard function for generating a GPT response
+# Connection settings for the process-wide OpenAI clients (see configure_client())
+CLIENT_SETTINGS = {
+    "base_url": None,               # None uses OPENAI_BASE_URL or the official endpoint
+    "max_connections": 20,          # Max open connections in the pool
+    "max_keepalive_connections": 10,# Idle connections kept alive for reuse
+    "keepalive_expiry": 60.0,       # Seconds an idle connection is kept alive
+    "timeout": 300.0,               # Read/write timeout in seconds
+    "connect_timeout": 10.0,        # Connection timeout in seconds
+    "max_retries": 0,               # Retries done by the openai client itself, gpt_response() retries with call_with_retries()
+}
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+def configure_client(**settings):
+    """Update CLIENT_SETTINGS and drop the existing clients so the next call rebuilds them
 
     Params:
-        prompt (str): Your input prompt
-        model (str): GPT Model to use. Default is gpt-3.5-turbo-1106
-        max_tokens (str): Max number of tokens to generate. Default is 40000
-        response_format (str): Format for the output. Should be either "text" or "json_object". JSON object only availble for 1106 models (GPT-4 Turbo and GPT-3.5 Turbo 1106)
-        temperature (float): Randomness of the response.
-        system_message (str): Optional system message.
+        **settings: Any key of CLIENT_SETTINGS (i.e. base_url=..., max_connections=...)
+    """
+    global _client
+    unknown = set(settings) - set(CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {sorted(unknown)}")
+
+    with _client_lock:
+        CLIENT_SETTINGS.update(settings)
+        if _client is not None:
+            _client.close()
+        _client = None
+        _async_clients.clear()
+
+def _client_options():
+    timeout = httpx.Timeout(CLIENT_SETTINGS['timeout'], connect=CLIENT_SETTINGS['connect_timeout'])
+    limits = httpx.Limits(
+        max_connections=CLIENT_SETTINGS['max_connections'],
+        max_keepalive_connections=CLIENT_SETTINGS['max_keepalive_connections'],
+        keepalive_expiry=CLIENT_SETTINGS['keepalive_expiry']
+    )
+    return timeout, limits
+
+def get_client():
+    """Returns the process-wide OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                timeout, limits = _client_options()
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=CLIENT_SETTINGS['base_url'],
+                    timeout=timeout,
+                    max_retries=CLIENT_SETTINGS['max_retries'],
+                    http_client=DefaultHttpxClient(timeout=timeout, limits=limits)
+                )
+    return _client
+
+def get_async_client():
+    """Returns the AsyncOpenAI client of the running event loop
+
+    Async connections are bound to the loop that opened them, so one client is kept per loop
+    (i.e. each asyncio.run() gets its own pool, reused by every call made inside it).
+    """
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            timeout, limits = _client_options()
+            client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=CLIENT_SETTINGS['base_url'],
+                timeout=timeout,
+                max_retries=CLIENT_SETTINGS['max_retries'],
+                http_client=DefaultAsyncHttpxClient(timeout=timeout, limits=limits)
+            )
+            _async_clients[loop] = client
+    return client
+
+# Opt-in cache of completions, see enable_llm_cache()
+llm_cache = None
+
+def enable_llm_cache(path=".cache/llm_cache.sqlite", ttl=7*24*3600, max_entries=10000):
+    """Cache completions on disk, so identical calls are answered without going to the API
+
+    Entries are keyed on (model, system_message, prompt, temperature, response_format, max_tokens).
+    Single calls can skip the cache with gpt_response(..., use_cache=False).
+
+    Params:
+        path (str): SQLite file of the cache
+        ttl (float): Seconds a cached completion stays valid
+        max_entries (int): Max number of cached completions, least recently used are evicted first
 
     Output:
-        result (str): GPT response text
+        llm_cache (SQLiteCache): The cache, i.e. llm_cache.stats() for the hit/miss counters
     """
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    global llm_cache
+    llm_cache = SQLiteCache(path, ttl=ttl, max_entries=max_entries, table="completions")
+    return llm_cache
+
+def disable_llm_cache():
+    global llm_cache
+    llm_cache = None
+
+def _cache_key(params):
+    return make_key(
+        params['model'],
+        params['messages'][0]['content'],
+        params['messages'][1]['content'],
+        params['temperature'],
+        params['response_format'],
+        params['max_tokens']
+    )
+
+class PendingCompletion(BaseException):
+    """Raised by gpt_response() inside deferred_completions() when the answer to a request isn't available yet
+
+    Derives from BaseException so the `except Exception` blocks of the stage functions don't swallow it.
+    """
+    def __init__(self, key, params):
+        super().__init__(key)
+        self.key = key
+        self.params = params
+
+_deferred_answers = contextvars.ContextVar("deferred_answers", default=None)
+
+@contextmanager
+def deferred_completions(answers):
+    """Answer gpt_response() calls from a dict instead of the API, used to run stages through the Batch API
+
+    Inside the block, a call whose cache key (see request_key()) is in answers returns the stored text,
+    any other call raises PendingCompletion with the request, so it can be collected and submitted later.
+
+    Params:
+        answers (dict): Request key -> response text
+    """
+    token = _deferred_answers.set(answers)
+    try:
+        yield
+    finally:
+        _deferred_answers.reset(token)
+
+def completions_deferred():
+    """True inside deferred_completions(), i.e. while a stage runs through the Batch API"""
+    return _deferred_answers.get() is not None
+
+def request_key(params):
+    """Content-addressed key of a chat completion request, the same one used by the completion cache"""
+    return _cache_key(params)
+
+def _deferred_answer(params):
+    answers = _deferred_answers.get()
+    if answers is None:
+        return None
+    key = _cache_key(params)
+    if key in answers:
+        return answers[key]
+    raise PendingCompletion(key, params)
+
+def _cacheable(params, result):
+    # Don't keep broken JSON around, a rerun should get a fresh attempt
+    if result is None:
+        return False
+    if params['response_format']['type'] in ('json_object', 'json_schema'):
+        try:
+            json.loads(result)
+        except ValueError:
+            return False
+    return True
+
+def _completion_params(prompt, model, max_tokens, response_format, temperature, system_message):
+    return dict(
         temperature = temperature,
         model=model,
         max_tokens = max_tokens,
-        response_format={ "type": response_format },
+        response_format=response_format if isinstance(response_format, dict) else { "type": response_format },
         messages=[
             {"role": "system", "content": system_message},
             {
@@ -37,8 +212,196 @@ def gpt_response(prompt, model = 'gpt-4o-mini',max_tokens = 4000,response_format
             }
         ]
     )
-    result = response.choices[0].message.content
 
-    return result
+def json_schema_format(name, schema):
+    """response_format for structured outputs, so the response always follows the JSON schema
+
+    Structured outputs are only available for gpt-4o and gpt-4o-mini models (see STRUCTURED_OUTPUT_MODELS)
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": True}
+    }
+
+# Models that support json_schema response formats
+STRUCTURED_OUTPUT_MODELS = ('gpt-4o', 'gpt-4o-mini')
+
+def supports_structured_output(model):
+    return model.startswith(STRUCTURED_OUTPUT_MODELS)
+
+def gpt_response(prompt, model = 'gpt-4o-mini',max_tokens = 4000,response_format = "text", temperature=0.5,system_message="you are a helpful assistant", use_cache=True, stream=False):
+    """Standard function for generating a GPT response
+
+    Params:
+        prompt (str): Your input prompt
+        model (str): GPT Model to use. Default is gpt-4o-mini
+        max_tokens (str): Max number of tokens to generate. Default is 4000
+        response_format (str): Format for the output. Should be either "text" or "json_object". JSON object only availble for 1106 models (GPT-4 Turbo and GPT-3.5 Turbo 1106)
+            A full response_format dict can also be passed, i.e. json_schema_format() for structured outputs
+        temperature (float): Randomness of the response.
+        system_message (str): Optional system message.
+        use_cache (bool): Set to False to bypass the completion cache (only used when enable_llm_cache() was called)
+        stream (bool): Return a generator that yields the response text as it is generated (i.e. for st.write_stream)
+
+    Output:
+        result (str): GPT response text, or a generator of text chunks if stream=True
+    """
+    params = _completion_params(prompt, model, max_tokens, response_format, temperature, system_message)
+    cassette = active_cassette()
+    # Recordings hold real calls, so the cache is skipped while a cassette is in use
+    cache = llm_cache if use_cache and cassette is None else None
+    if stream:
+        # The span is started here, so the stream is a child of the caller's span (and counted in its stage's usage)
+        # even when the generator is consumed after the caller returned
+        return _gpt_response_stream(params, cache, start_span("gpt_response", "llm", stream=True, **_span_attributes(params)))
+    deferred = _deferred_answer(params)
+    if deferred is not None:
+        return deferred
+    with span("gpt_response", "llm", **_span_attributes(params)) as current:
+        if cache is not None:
+            key = _cache_key(params)
+            result = cache.get(key)
+            current.set(cache_hit=result is not None)
+            if result is not None:
+                return result
+
+        def request():
+            client = get_client()
+            # Every attempt has a timeout and transient errors are retried, see resilience_functions.py
+            response = call_with_retries(
+                lambda timeout: hedged_call(lambda timeout: client.chat.completions.create(timeout=timeout, **params), latency_key(params['model']), timeout),
+                name=f"gpt_response ({params['model']})"
+            )
+            current.record_usage(response.model, response.usage)
+            return response.choices[0].message.content
+
+        if cassette is not None:
+            current.set(cassette=cassette.mode)
+            result = _replayed_text(cassette.call("llm", _cache_key(params), cassette_request(params), request))
+        else:
+            result = request()
+
+        if cache is not None and _cacheable(params, result):
+            cache.set(key, result)
+        return result
+
+def cassette_request(params):
+    """The fields of a completion request stored in cassettes, see cassette_functions.py"""
+    return {
+        "model": params['model'],
+        "system_message": params['messages'][0]['content'],
+        "prompt": params['messages'][1]['content'],
+        "temperature": params['temperature'],
+        "response_format": params['response_format'],
+        "max_tokens": params['max_tokens'],
+    }
+
+def _replayed_text(response):
+    # Streamed calls are recorded as their list of chunks, which a non-streaming caller gets joined
+    return "".join(response) if isinstance(response, list) else response
+
+def _span_attributes(params):
+    return {"model": params['model'], "response_format": params['response_format']['type'], "max_tokens": params['max_tokens']}
+
+def _gpt_response_stream(params, cache, current):
+    # The generator may be consumed elsewhere, so its span isn't made the current one
+    cassette = active_cassette()
+    try:
+        if cassette is not None and cassette.mode == "replay":
+            # The recorded chunks are yielded one by one, spread over the recorded duration with timing=True
+            current.set(cassette="replay")
+            interaction = cassette.play("llm", _cache_key(params), cassette_request(params))
+            # A call recorded without streaming is replayed as one chunk
+            chunks = interaction['response'] if isinstance(interaction['response'], list) else [interaction['response']]
+            for chunk in chunks:
+                time.sleep(cassette.delay(interaction) / len(chunks))
+                yield chunk
+            current.end()
+            return
+
+        if cache is not None:
+            key = _cache_key(params)
+            result = cache.get(key)
+            current.set(cache_hit=result is not None)
+            if result is not None:
+                yield result
+                current.end()
+                return
+
+        client = get_client()
+        chunks = []
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                # include_usage adds a last chunk with the token usage of the stream
+                for chunk in client.chat.completions.create(stream=True, stream_options={"include_usage": True}, timeout=attempt_timeout(), **params):
+                    if chunk.usage is not None:
+                        current.record_usage(chunk.model, chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                break
+            except Exception as e:
+                # Text already shown can't be taken back, so only a stream that failed before its first chunk is retried
+                if chunks:
+                    raise
+                time.sleep(retry_delay(attempt, e, f"gpt_response stream ({params['model']})"))
+                attempt += 1
+        result = "".join(chunks)
+        if cassette is not None:
+            current.set(cassette="record")
+            cassette.record("llm", _cache_key(params), cassette_request(params), chunks, time.perf_counter() - start)
+
+        if cache is not None and _cacheable(params, result):
+            cache.set(key, result)
+    except GeneratorExit:
+        # The consumer stopped reading before the end of the stream
+        current.set(cancelled=True)
+        current.end()
+        raise
+    except BaseException as e:
+        current.end(e)
+        raise
+    current.end()
+
+async def agpt_response(prompt, model = 'gpt-4o-mini',max_tokens = 4000,response_format = "text", temperature=0.5,system_message="you are a helpful assistant", use_cache=True):
+    """Async version of gpt_response(), so several completions can be awaited at once
+
+    Usage:
+        outcomes, description = await asyncio.gather(
+            agpt_response(outcomes_prompt),
+            agpt_response(description_prompt)
+        )
+
+    Params and output are the same as gpt_response()
+    """
+    params = _completion_params(prompt, model, max_tokens, response_format, temperature, system_message)
+    cassette = active_cassette()
+    cache = llm_cache if use_cache and cassette is None else None
+    with span("agpt_response", "llm", **_span_attributes(params)) as current:
+        if cache is not None:
+            key = _cache_key(params)
+            result = cache.get(key)
+            current.set(cache_hit=result is not None)
+            if result is not None:
+                return result
+
+        async def request():
+            client = get_async_client()
+            response = await acall_with_retries(
+                lambda timeout: ahedged_call(lambda timeout: client.chat.completions.create(timeout=timeout, **params), latency_key(params['model']), timeout),
+                name=f"agpt_response ({params['model']})"
+            )
+            current.record_usage(response.model, response.usage)
+            return response.choices[0].message.content
 
+        if cassette is not None:
+            current.set(cassette=cassette.mode)
+            result = _replayed_text(await cassette.acall("llm", _cache_key(params), cassette_request(params), request))
+        else:
+            result = await request()
 
+        if cache is not None and _cacheable(params, result):
+            cache.set(key, result)
+        return result
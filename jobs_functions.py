@@ -0,0 +1,202 @@
+"""Background jobs running the outline pipeline outside of the Streamlit script run
+
+A job is submitted to a bounded pool of worker threads and the page polls it by id:
+    job_id = submit_job(course_inputs)
+    job = get_job(job_id)    # status, stage progress, streamed learning outcomes, results
+Every job is saved to JOBS_DIR/<job id>.json (and its document to <job id>.docx) as it progresses, so a
+reloaded page reattaches to the job from its id instead of starting it again, and finished results survive
+a restart of the server. Submitting the inputs of a job still running returns that job.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pipeline_functions import *
+
+
+JOBS_DIR = ".cache/jobs"        # Folder of the saved jobs and their documents
+JOB_WORKERS = 2                 # Jobs running at the same time, the others wait in the queue
+JOB_MAX_AGE = 7 * 24 * 3600     # Saved jobs older than this (seconds) are deleted
+JOB_POLL_INTERVAL = 1.0         # Seconds between two refreshes of a page waiting for a job
+
+# Inputs of a job, the fields of the Streamlit form
+JOB_INPUTS = ["course_title", "course_description", "instructor_name", "credit_units", "target_students",
+              "total_hours", "weekly_hours", "citation_style", "model", "profile", "document_title"]
+
+_jobs = {}              # Job id -> job of this process, queued or running
+_running_inputs = {}    # Key of the inputs -> id of the job queued or running for them
+_lock = threading.Lock()
+_executor = None
+
+def _job_path(job_id, extension=".json"):
+    return os.path.join(JOBS_DIR, f"{job_id}{extension}")
+
+def _save_job(job):
+    # Write to a temporary file first, so a page reading the job never sees half of it
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    path = _job_path(job['id'])
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, default=str)
+    os.replace(temp_path, path)
+
+def _load_job(job_id):
+    try:
+        with open(_job_path(job_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="outline-job")
+    return _executor
+
+def prune_jobs(max_age=JOB_MAX_AGE):
+    """Deletes the saved jobs (and documents) not updated for max_age seconds"""
+    if not os.path.isdir(JOBS_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        job_id = name.split(".")[0]
+        try:
+            if job_id not in _jobs and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+
+def submit_job(inputs, memo=None):
+    """Queues a course outline job, or returns the job already queued/running for the same inputs
+
+    Params:
+        inputs (dict): Fields of JOB_INPUTS (missing ones are None)
+        memo (StageMemo): Stage results of earlier runs of the session, see run_outline_pipeline()
+
+    Output:
+        job_id (str): Id of the job, for get_job()
+    """
+    inputs = {key: inputs.get(key) for key in JOB_INPUTS}
+    key = make_key("job", inputs)
+    with _lock:
+        if key in _running_inputs:
+            return _running_inputs[key]
+        job = {
+            "id": uuid.uuid4().hex[:16],
+            "inputs": inputs,
+            "status": "queued",
+            "stages": {},           # Stage -> "started", "done", "failed" or "reused"
+            "learning_outcomes": "",
+            "course_description": None,
+            "output_file_name": None,
+            "document": None,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "execution_time": None,
+            "reused": [],           # Stages answered from memo
+        }
+        _jobs[job['id']] = job
+        _running_inputs[key] = job['id']
+        _save_job(job)
+    prune_jobs()
+    _get_executor().submit(_run_job, job, key, memo)
+    return job['id']
+
+def get_job(job_id):
+    """Snapshot of a job (dict), None for unknown or pruned ids
+
+    A job saved as queued/running that this process doesn't run was cut short by a restart of the server,
+    it is returned as failed.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return {**job, "stages": dict(job['stages'])}
+    job = _load_job(job_id)
+    if job is not None and job['status'] in ("queued", "running"):
+        job.update(status="failed", error="The job was interrupted by a restart of the server")
+    return job
+
+def job_document(job):
+    """Bytes of the Word document of a finished job, None if there is none"""
+    if not job or not job.get('document'):
+        return None
+    try:
+        with open(job['document'], 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _update(job, save=True, **fields):
+    with _lock:
+        job.update(fields)
+        if save:
+            _save_job(job)
+
+def _run_job(job, key, memo):
+    inputs = job['inputs']
+    _update(job, status="running", started=time.time())
+
+    def on_event(stage, status, result):
+        # Per-topic work ("search[0]"...) isn't shown, only the stages of PIPELINE_STAGE_MESSAGES
+        if stage in PIPELINE_STAGE_MESSAGES:
+            with _lock:
+                job['stages'][stage] = status
+                if stage == "learning_outcomes" and status == "reused":
+                    job['learning_outcomes'] = result
+                _save_job(job)
+
+    def on_token(chunk):
+        # Streamed text is only kept in memory, the full text is saved once the stage is done
+        with _lock:
+            job['learning_outcomes'] += chunk
+
+    try:
+        course_description = inputs['course_description']
+        if not course_description:
+            on_event("description", "started", None)
+            with use_profile(inputs['profile']):
+                course_description = generate_description(inputs['course_title'], inputs['target_students'])
+            on_event("description", "done", course_description)
+            _update(job, course_description=course_description)
+
+        course_details = format_course_details(
+            inputs['course_title'], course_description, inputs['instructor_name'], inputs['credit_units'],
+            inputs['target_students'], inputs['total_hours'], inputs['weekly_hours'])
+        results = run_outline_pipeline(
+            course_details=course_details,
+            total_hours=inputs['total_hours'],
+            weekly_hours=inputs['weekly_hours'],
+            citation_style=inputs['citation_style'],
+            model=inputs['model'],
+            document_title=inputs['document_title'],
+            streamlit=True,
+            on_event=on_event,
+            on_token=on_token,
+            memo=memo,
+            profile=inputs['profile']
+        )
+
+        document_path = _job_path(job['id'], ".docx")
+        with open(document_path, 'wb') as f:
+            f.write(results['document'].getvalue())
+        document_title = inputs['document_title']
+        if not document_title:
+            document_title = f"{(inputs['course_title'] or '').replace(' ','_')}_{(inputs['instructor_name'] or '').replace(' ','_')}_Course_Outline"
+        _update(job, status="done", learning_outcomes=results['learning_outcomes'], document=document_path,
+                output_file_name=f"{document_title}.docx", reused=results['reused'], trace_summary=results['trace_summary'])
+    except Exception as e:
+        print(f"Job {job['id']} failed: {e}")
+        _update(job, status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        finished = time.time()
+        with _lock:
+            job.update(finished=finished, execution_time=finished - job['started'])
+            _save_job(job)
+            _jobs.pop(job['id'], None)
+            _running_inputs.pop(key, None)
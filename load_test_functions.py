@@ -0,0 +1,205 @@
+"""Load test of the outline pipeline against local fake upstreams
+
+Runs run_outline_pipeline() (queries -> searches -> filtering -> learning outcomes -> outline -> Word document)
+for many courses at 1, 10 and 100 concurrent courses against the fake OpenAI and SerpAPI servers of
+benchmark_functions.py, so no credits are spent. Latencies are drawn from seeded distributions and a share
+of the completions fail with 429/503, so every run replays the same workload.
+
+Usage:
+    python load_test_functions.py run --concurrency 1 10 100 --output load_test_results.json
+    python load_test_functions.py compare base_results.json load_test_results.json
+
+Every level runs in a fresh process, so its peak RSS is its own. The results file holds throughput, course
+latency, p50/p95/p99 per stage, retries, peak RSS, the settings and the git commit, to compare across commits.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS isn't reported
+    resource = None
+
+from benchmark_functions import FakeOpenAIHandler, FakeSerpAPIHandler, start_fake_server, summarize
+
+
+# Workload of a load test, see run_load_test()
+LOAD_TEST_SETTINGS = {
+    "concurrency": [1, 10, 100],                # Concurrent courses of every level
+    "rounds": 2,                                # Courses per level = concurrency * rounds
+    "llm_latency": ("lognormal", 0.3, 0.5),     # Seconds before a completion answers (see sample_latency())
+    "token_latency": 0.0005,                    # Seconds per completion token
+    "search_latency": ("lognormal", 0.5, 0.4),  # Seconds before a search answers
+    "error_rate": 0.02,                         # Share of completions answered with 429/503
+    "topics": 5,                                # Topics (and searches) per course
+    "weeks": 18,                                # Activity rows of every outline
+    "model": "gpt-4o",
+}
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, None where it isn't available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _stage_timings(results):
+    # Per-topic work ("search[0]", "search[1]"...) is summed up under one stage name
+    timings = {}
+    for name, timing in results['timings'].items():
+        if timing['status'] == "done":
+            timings.setdefault(name.split("[")[0], []).append(timing['seconds'])
+    return timings
+
+def run_level(openai_url, serp_url, concurrency, courses, model='gpt-4o'):
+    """Runs courses outlines with concurrency courses at a time against the fake servers (in its own process)
+
+    Output:
+        level (dict): Throughput, course latency, p50/p95/p99 per stage, failures, retries and peak RSS
+    """
+    import warnings
+    import gpt_functions
+    import search_functions
+    import pipeline_functions
+    import resilience_functions
+
+    warnings.simplefilter("ignore")
+    gpt_functions.configure_client(base_url=openai_url)
+    search_functions.SERP_API_URL = serp_url + "/search"
+    search_functions.configure_search_cache(None)
+    # Fake keys without the rate limit of real SerpAPI accounts
+    search_functions.configure_serp_keys([f"load-test-key-{i}" for i in range(4)], rate=1000.0, burst=1000)
+    stats_before = resilience_functions.resilience_stats()
+
+    def run_course(i):
+        course_details = pipeline_functions.format_course_details(
+            f"Load Test Course {i + 1}", "An introductory course.", "Instructor", 3, "Students", 54, 3)
+        start = time.perf_counter()
+        try:
+            results = pipeline_functions.run_outline_pipeline(course_details, model=model, streamlit=True)
+        except Exception as e:
+            return {"seconds": time.perf_counter() - start, "error": f"{type(e).__name__}: {e}"}
+        return {"seconds": time.perf_counter() - start, "stages": _stage_timings(results)}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(run_course, range(courses)))
+    elapsed = time.perf_counter() - start
+
+    done = [run for run in runs if "error" not in run]
+    stages = {}
+    for run in done:
+        for name, seconds in run['stages'].items():
+            stages.setdefault(name, []).extend(seconds)
+    stats_after = resilience_functions.resilience_stats()
+    return {
+        "concurrency": concurrency,
+        "courses": courses,
+        "done": len(done),
+        "failed": len(runs) - len(done),
+        "errors": sorted({run['error'] for run in runs if "error" in run})[:5],
+        "seconds": round(elapsed, 3),
+        "courses_per_minute": round(len(done) / elapsed * 60, 2),
+        "course": summarize([run['seconds'] for run in done]) if done else None,
+        "stages": {name: summarize(seconds) for name, seconds in stages.items()},
+        "retries": stats_after['retries'] - stats_before['retries'],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_load_test(**settings):
+    """Runs every concurrency level of LOAD_TEST_SETTINGS (updated with settings) in a fresh process
+
+    Output:
+        report (dict): Metadata (commit, machine, settings) and the results of every level, see run_level()
+    """
+    unknown = set(settings) - set(LOAD_TEST_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown load test settings: {sorted(unknown)}")
+    settings = {**LOAD_TEST_SETTINGS, **settings}
+
+    openai_server, openai_url = start_fake_server(FakeOpenAIHandler, latency=settings['llm_latency'], token_latency=settings['token_latency'])
+    openai_server.error_rate = settings['error_rate']
+    openai_server.topics = settings['topics']
+    openai_server.weeks = settings['weeks']
+    serp_server, serp_url = start_fake_server(FakeSerpAPIHandler, latency=settings['search_latency'])
+
+    levels = []
+    try:
+        for concurrency in settings['concurrency']:
+            # A fresh process per level, so peak RSS and the client pools start from scratch
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                level = executor.submit(run_level, openai_url, serp_url, concurrency, concurrency * settings['rounds'], settings['model']).result()
+            print(f"{concurrency} concurrent courses: {level['courses_per_minute']} courses/minute, {level['failed']} failed")
+            levels.append(level)
+    finally:
+        openai_server.shutdown()
+        serp_server.shutdown()
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "levels": levels,
+    }
+
+def compare_results(base, new):
+    """Relative change (new / base) of throughput, course p95 and stage p95 for every level in both reports"""
+    base_levels = {level['concurrency']: level for level in base['levels']}
+    comparison = {"base_commit": base.get('commit'), "new_commit": new.get('commit'), "levels": {}}
+    for level in new['levels']:
+        old = base_levels.get(level['concurrency'])
+        if old is None or not old['course'] or not level['course']:
+            continue
+        changes = {
+            "courses_per_minute": round(level['courses_per_minute'] / old['courses_per_minute'], 3),
+            "course_p95": round(level['course']['p95_ms'] / old['course']['p95_ms'], 3),
+        }
+        for name, stage in level['stages'].items():
+            if name in old['stages'] and old['stages'][name]['p95_ms']:
+                changes[f"{name}_p95"] = round(stage['p95_ms'] / old['stages'][name]['p95_ms'], 3)
+        comparison["levels"][level['concurrency']] = changes
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the outline pipeline against local fake upstreams")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the load test")
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=LOAD_TEST_SETTINGS['concurrency'], help="Concurrent courses of every level")
+    run_parser.add_argument("--rounds", type=int, default=LOAD_TEST_SETTINGS['rounds'], help="Courses per level = concurrency * rounds")
+    run_parser.add_argument("--error-rate", type=float, default=LOAD_TEST_SETTINGS['error_rate'], help="Share of completions failing with 429/503")
+    run_parser.add_argument("--output", default="load_test_results.json", help="JSON file of the results")
+    compare_parser = commands.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_load_test(concurrency=args.concurrency, rounds=args.rounds, error_rate=args.error_rate)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(json.dumps(report['levels'], indent=4))
+    else:
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.new, encoding='utf-8') as f:
+            new = json.load(f)
+        print(json.dumps(compare_results(base, new), indent=4))
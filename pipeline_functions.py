@@ -0,0 +1,348 @@
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from app_functions import *
+
+# Messages shown by the front ends while a stage is running and once it is done
+PIPELINE_STAGE_MESSAGES = {
+    "description": ("Generating Course Description...", "Course Description Generated"),
+    "queries": ("Generating Course Topics...", "Queries Generated"),
+    "references": ("Searching Online for Reference Materials...", "Search Results Generated"),
+    "learning_outcomes": ("Generating Learning Outcomes...", "Learning Outcomes Generated"),
+    "course_outline": ("Generating Course Outline...", "Course Outline Generated"),
+    "document": ("Creating Word Document...", "Word Document Created"),
+}
+
+# SQLite file keeping the stage results of the front ends' StageMemo on disk as well, None keeps them per session only
+STAGE_MEMO_PATH = None
+
+
+class StageMemo:
+    """Results of pipeline stages keyed on the inputs each stage depends on, so an edit only reruns the stages it affects
+
+    Kept in memory (i.e. one per Streamlit session), optionally backed by a SQLite file shared by every session.
+    Usage:
+        memo = StageMemo()
+        run_outline_pipeline(course_details, weekly_hours=3, memo=memo)
+        run_outline_pipeline(course_details, weekly_hours=2, memo=memo)  # only the outline and document are rerun
+    """
+
+    def __init__(self, path=None, max_entries=50, ttl=7*24*3600):
+        """
+        Params:
+            path (str): SQLite file also keeping the results on disk, None keeps them in memory only
+            max_entries (int): Max results kept in memory, least recently used are dropped first
+            ttl (float): Seconds a result stays valid on disk
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = SQLiteCache(path, ttl=ttl, max_entries=max_entries * 100, table="stage_results") if path else None
+
+    def get(self, key):
+        """The stored result (a fresh copy, so callers may modify it), None if there is none"""
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(encoded)
+        value = self._disk.get(key) if self._disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, json.dumps(value))
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, json.dumps(value))
+        if self._disk is not None:
+            self._disk.set(key, value)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _store(self, key, encoded):
+        self._entries[key] = encoded
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+class Pipeline:
+    """Runs stages as a dependency graph of asyncio tasks and records the timing of every stage
+
+    A stage starts as soon as the stages it depends on are done, and gets their results as keyword arguments.
+    Usage:
+        pipeline = Pipeline()
+        pipeline.add_stage("queries", get_queries)
+        pipeline.add_stage("outline", get_outline, depends_on=["queries"])  # called as get_outline(queries=...)
+        results = asyncio.run(pipeline.run())
+        print(pipeline.timings)
+    """
+
+    def __init__(self, on_event=None, memo=None):
+        """
+        Params:
+            on_event (function): Called as on_event(stage, status, result) when a stage is "started", "done", "failed"
+                                 or "reused" (answered from memo). Runs in the thread of the event loop, so it can
+                                 safely update the Streamlit page
+            memo (StageMemo): Reuse the results of stages whose inputs didn't change since an earlier run
+        """
+        self.stages = {}
+        self.timings = {}
+        self.reused = []
+        self.on_event = on_event
+        self.memo = memo
+        self._start = None
+
+    def add_stage(self, name, function, depends_on=(), memo_key=None, memoize=bool):
+        """
+        Params:
+            name (str): Name of the stage
+            function (function): Async function (or regular function, which runs in a worker thread)
+            depends_on (list): Names of the stages whose results are passed to function
+            memo_key (function): Called with the same arguments as function, returns everything else the result
+                                 depends on (JSON encodable). Stages without one are always run
+            memoize (function): Called with the result, only results for which it returns True are kept in memo
+        """
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self.stages[name] = (function, list(depends_on), memo_key, memoize)
+
+    async def timed(self, name, function, *args, **kwargs):
+        """Runs one unit of work as a timed stage, also usable inside a stage for per-topic work"""
+        if self._start is None:
+            self._start = time.perf_counter()
+        self._emit(name, "started", None)
+        start = time.perf_counter()
+        try:
+            # Per-topic work ("search[0]", "search[1]"...) shares one span name in the trace summary
+            with span(name.split("[")[0], "stage", pipeline_stage=name):
+                if asyncio.iscoroutinefunction(function):
+                    result = await function(*args, **kwargs)
+                else:
+                    result = await asyncio.to_thread(function, *args, **kwargs)
+        except Exception as e:
+            self._record(name, start, "failed")
+            self._emit(name, "failed", e)
+            raise
+        self._record(name, start, "done")
+        self._emit(name, "done", result)
+        return result
+
+    async def run(self):
+        """Runs every stage, returning a dict of stage name -> result"""
+        self._start = time.perf_counter()
+        tasks = {}
+
+        async def run_stage(name):
+            function, depends_on, memo_key, memoize = self.stages[name]
+            inputs = {dependency: await tasks[dependency] for dependency in depends_on}
+            if self.memo is None or memo_key is None:
+                return await self.timed(name, function, **inputs)
+            key = make_key("stage", name, memo_key(**inputs), inputs)
+            result = self.memo.get(key)
+            if result is not None:
+                self._record(name, time.perf_counter(), "reused")
+                self.reused.append(name)
+                self._emit(name, "reused", result)
+                return result
+            result = await self.timed(name, function, **inputs)
+            if memoize(result):
+                self.memo.set(key, result)
+            return result
+
+        # Stages only depend on stages added before them, so every task exists by the time it is awaited
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return dict(zip(tasks, results))
+
+    def _record(self, name, start, status):
+        end = time.perf_counter()
+        self.timings[name] = {
+            "status": status,
+            "start": round(start - self._start, 3),
+            "seconds": round(end - start, 3)
+        }
+
+    def _emit(self, name, status, result):
+        if self.on_event is not None:
+            self.on_event(name, status, result)
+
+def course_details_without_hours(course_details):
+    """The course details without the hours lines of format_course_details()"""
+    return "\n".join(line for line in course_details.splitlines() if not re.match(r'\s*(Total Hours|Class Hours per Week):', line))
+
+# Run the whole course outline workflow, overlapping per-topic work
+def run_outline_pipeline(course_details, total_hours=54, weekly_hours=3, citation_style='APA', model='gpt-3.5-turbo',
+                         document_title="Course_Outline.docx", streamlit=False, num_results=5, token_budget=SEARCH_TOKEN_BUDGET,
+                         on_event=None, on_token=None, memo=None, profile=None, prerank=True):
+    """
+    Stages: queries -> (search -> pre-rank -> filter) per topic -> learning outcomes -> outline -> document
+    The references of each topic are filtered as soon as its search returned. References already found for an earlier
+    topic are dropped once every topic is filtered.
+
+    Params:
+    course_details (str): The course details inputted by user
+    document_title (str): Title of the word document
+    streamlit (bool): Return the word document as a BytesIO buffer instead of saving it to a file
+    num_results (int): Number of search results per topic
+    token_budget (int): Token budget of the search results of all topics, split evenly between topics (None keeps every result)
+    on_event (function): Called as on_event(stage, status, result), see Pipeline
+    on_token (function): Called with every chunk of the learning outcomes as it is generated
+    memo (StageMemo): Reuse the stages whose inputs didn't change since an earlier run with the same memo (i.e. only the
+                      outline and document are regenerated when only the hours changed)
+    profile (str): Routing profile of the LLM calls (see routing_functions.py), None keeps the current one
+    prerank (bool): Keep only the best hits of every topic by prerank_topic(), and skip the LLM filter of the topics
+                    whose kept hits all look suitable (see ranking_functions.py)
+    Other params are the same as the app_functions stages
+
+    Output:
+    results (dict): Results of every stage (queries, references, learning_outcomes, course_outline, document), their timings,
+                    the stages reused from memo, the spans of the run (see tracing_functions.py) and their per-stage summary
+    """
+    loop = None
+    pipeline = Pipeline(on_event=on_event, memo=memo)
+    # Only the outline depends on the hours, the stages before it are keyed on the other course details
+    course_content = course_details_without_hours(course_details)
+    search_slots = None
+    with use_profile(profile):
+        routes = ROUTING_PROFILES[current_profile()]
+
+    def queries():
+        with stage_deadline("queries"):
+            return json.loads(generate_queries(course_details=course_details))
+
+    async def references(queries):
+        topics = queries.get('queries', [])
+        token_stats = []
+        skipped_filters = 0
+
+        async def topic_references(i, query):
+            nonlocal skipped_filters
+            confident = False
+            try:
+                async with search_slots:
+                    results = await pipeline.timed(f"search[{i}]", search_google_scholar, query['query'], num_results)
+            except Exception as e:
+                print(f"Error fetching results for query '{query['query']}': {e}")
+                results = None
+            # The prompt of a topic only depends on its own search, so it is the same whichever search returned first
+            # (keeping it stable for the completion cache and cassettes)
+            try:
+                if results is None:
+                    return None
+                if prerank:
+                    topic_results, confident = prerank_topic(TopicResults(query['topic'], query['query'], results))
+                    results = topic_results.results
+                search_results = format_search_results(query['topic'], results)
+                if token_budget is not None:
+                    topic_results = TopicResults(query['topic'], query['query'], results)
+                    search_results, stats = compact_search_results([topic_results], token_budget // len(topics))
+                    token_stats.append(stats)
+            except Exception as e:
+                print(f"Error fetching results for query '{query['query']}': {e}")
+                return None
+            if not search_results:
+                # No hits: nothing to filter, but the search didn't fail
+                return "", ""
+            if confident:
+                # The kept hits already are the references the filter would keep
+                skipped_filters += 1
+                return search_results, search_results
+            filtered = await pipeline.timed(f"filter[{i}]", filter_references, course_details, search_results, model)
+            return search_results, filtered
+
+        # The tasks (and the threads they start) inherit the deadline of the stage
+        with stage_deadline("references"):
+            topics = await asyncio.gather(*[topic_references(i, query) for i, query in enumerate(topics)])
+        # Failed topics are None
+        failed_topics = sum(1 for topic in topics if topic is None)
+        topics = [topic for topic in topics if topic is not None]
+        # References are kept for the first topic that found them
+        total_search_results = drop_repeated_references([search_results for search_results, _ in topics])
+        filtered_search_results = drop_repeated_references([filtered for _, filtered in topics])
+        return {
+            "total_search_results": "\n\n".join(search_results for search_results in total_search_results if search_results),
+            "filtered_search_results": "\n\n".join(filtered for filtered in filtered_search_results if filtered),
+            "token_stats": {key: sum(stats[key] for stats in token_stats) for key in token_stats[0]} if token_stats else None,
+            "failed_topics": failed_topics,
+            "skipped_filters": skipped_filters
+        }
+
+    def learning_outcomes(references):
+        chunks = []
+        with stage_deadline("learning_outcomes"):
+            for chunk in generate_learning_outcomes(
+                course_details=course_details,
+                total_search_results=references['total_search_results'],
+                citation_style=citation_style,
+                model=model,
+                stream=True,
+                filtered_search_results=references['filtered_search_results']
+            ):
+                chunks.append(chunk)
+                if on_token is not None:
+                    # Hand the chunk to the event loop thread, where the page can be updated
+                    loop.call_soon_threadsafe(on_token, chunk)
+        return "".join(chunks)
+
+    def course_outline(learning_outcomes):
+        with stage_deadline("course_outline"):
+            course_outline = generate_course_outline(
+                course_details=course_details,
+                learning_outcomes=learning_outcomes,
+                total_hours=total_hours,
+                weekly_hours=weekly_hours,
+                model=model
+            )
+        return json.loads(course_outline)
+
+    def document(course_outline):
+        return create_word_document_from_json(course_outline, title=document_title, streamlit=streamlit)
+
+    # The keys list what each stage depends on besides the results of the stages before it
+    # and the routes of its LLM calls
+    pipeline.add_stage("queries", queries, memo_key=lambda: (course_content, routes['queries']))
+    pipeline.add_stage("references", references, depends_on=["queries"],
+                       memo_key=lambda queries: (course_content, model, num_results, token_budget, routes['filter'],
+                                                 prerank and RANKING_SETTINGS),
+                       # A topic whose search failed should be searched again on the next run
+                       memoize=lambda references: not references['failed_topics'])
+    pipeline.add_stage("learning_outcomes", learning_outcomes, depends_on=["references"],
+                       memo_key=lambda references: (course_content, citation_style, model, routes['learning_outcomes']))
+    pipeline.add_stage("course_outline", course_outline, depends_on=["learning_outcomes"],
+                       memo_key=lambda learning_outcomes: (course_details, total_hours, weekly_hours, model,
+                                                           routes['course_outline'], routes['course_plan'], routes['activities']))
+    # Rendering the document takes milliseconds, it is always redone (i.e. for a new title)
+    pipeline.add_stage("document", document, depends_on=["course_outline"])
+
+    async def run():
+        nonlocal loop, search_slots
+        loop = asyncio.get_running_loop()
+        search_slots = asyncio.Semaphore(SEARCH_MAX_WORKERS)
+        return await pipeline.run()
+
+    with collect_spans() as spans, use_profile(profile):
+        with span("run_outline_pipeline", "run", model=model, profile=current_profile()):
+            results = asyncio.run(run())
+    results["timings"] = pipeline.timings
+    results["reused"] = pipeline.reused
+    results["spans"] = [finished.to_dict() for finished in spans]
+    results["trace_summary"] = summarize_spans(spans)
+    return results
@@ -0,0 +1,180 @@
+"""Deterministic pre-ranking of the Google Scholar hits of a topic, before (or instead of) the LLM reference filter
+
+Every hit is scored from its year (relative to as_ylo), citation count, book/journal signals in its publication
+summary and the overlap of its title and snippet with the topic. Only the top_k hits of a topic are kept, and when
+they all score at least confident_score the LLM filter call of the topic is skipped:
+    topic_results, confident = prerank_topic(TopicResults(topic, query, results))
+
+Agreement with the LLM filter is measured on a cassette recorded with prerank=False (see cassette_functions.py),
+where the references the LLM kept from every search are the labels:
+    python ranking_functions.py cassettes/ml_course.json
+"""
+import re
+import sys
+import json
+import math
+import datetime
+from dataclasses import dataclass, field
+from search_functions import SearchResult, TopicResults
+from reference_store_functions import tokenize
+
+
+RANKING_SETTINGS = {
+    "top_k": 3,                 # Hits kept per topic
+    "min_score": 0.4,           # Hits scoring less are dropped even when there is room (unless every hit does)
+    "confident_score": 0.6,     # The LLM filter of a topic is skipped when every kept hit scores at least this
+    "weights": {"recency": 0.2, "citations": 0.15, "source": 0.3, "overlap": 0.35},
+}
+
+# Signals in the publication summary (and title) of a hit, checked in this order
+UNSUITABLE_SIGNALS = ["thesis", "dissertation", "proquest", "researchgate", "academia.edu", "ssrn", "slideshare",
+                      "lecture notes", "blog", "preprint", "arxiv"]
+BOOK_SIGNALS = ["books.google", "textbook", "handbook", "edition", "press", "springer", "wiley", "elsevier", "pearson",
+                "mcgraw", "routledge", "cengage", "o'reilly", "crc", "sage", "taylor & francis"]
+JOURNAL_SIGNALS = ["journal", "proceedings", "transactions", "ieee", "acm", "review", "quarterly", "jstor", "tandfonline"]
+# Query words that say what kind of source is wanted, not what it is about
+GENERIC_QUERY_WORDS = {"textbook", "textbooks", "book", "books", "reference", "references", "academic", "journal",
+                       "journals", "introduction", "introductory", "resources", "material", "materials"}
+
+def configure_ranking(**settings):
+    """Update RANKING_SETTINGS
+
+    Params:
+        **settings: Any key of RANKING_SETTINGS (i.e. top_k=5)
+    """
+    unknown = set(settings) - set(RANKING_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown ranking settings: {sorted(unknown)}")
+    RANKING_SETTINGS.update(settings)
+
+@dataclass(slots=True)
+class RankedHit:
+    """A SearchResult with its pre-ranking score, and the features it was computed from"""
+    result: SearchResult
+    score: float
+    features: dict = field(default_factory=dict)
+
+def source_score(search_result):
+    """1.0 for books, 0.7 for journals, 0.3 when unknown, 0.0 for theses, preprints, slides..."""
+    text = f"{search_result.publication_summary} {search_result.title}".lower()
+    if any(signal in text for signal in UNSUITABLE_SIGNALS):
+        return 0.0
+    if any(signal in text for signal in BOOK_SIGNALS):
+        return 1.0
+    if any(signal in text for signal in JOURNAL_SIGNALS):
+        return 0.7
+    return 0.3
+
+def recency_score(search_result, as_ylo=2020, current_year=None):
+    """0.5 for a hit published in as_ylo up to 1.0 for this year, 0.0 before as_ylo, 0.3 when the year is unknown"""
+    current_year = current_year or datetime.date.today().year
+    if search_result.year is None:
+        return 0.3
+    if search_result.year < as_ylo:
+        return 0.0
+    return min(1.0, 0.5 + 0.5 * (search_result.year - as_ylo) / max(1, current_year - as_ylo))
+
+def overlap_score(search_result, topic_terms):
+    """Share of the topic terms found in the title or snippet of the hit (0.5 when there are none)"""
+    if not topic_terms:
+        return 0.5
+    terms = set(tokenize(search_result.title)) | set(tokenize(search_result.snippet))
+    return len(topic_terms & terms) / len(topic_terms)
+
+def rank_hits(topic, query, results, as_ylo=2020, current_year=None):
+    """Scores every hit of a topic, best first
+
+    Params:
+        topic (str): Topic of the search
+        query (str): Query of the search
+        results (list): SearchResult list of the search
+        as_ylo (int): Year the search started from
+
+    Output:
+        ranked (list): RankedHit list, best score first (ties keep the Google Scholar order)
+    """
+    weights = RANKING_SETTINGS['weights']
+    topic_terms = set(tokenize(f"{topic} {query}")) - GENERIC_QUERY_WORDS
+    ranked = []
+    for search_result in results:
+        features = {
+            "recency": recency_score(search_result, as_ylo, current_year),
+            "citations": min(1.0, math.log1p(search_result.citations) / math.log1p(1000)),
+            "source": source_score(search_result),
+            "overlap": overlap_score(search_result, topic_terms),
+        }
+        score = sum(weights[name] * value for name, value in features.items()) / sum(weights.values())
+        ranked.append(RankedHit(search_result, round(score, 4), features))
+    return sorted(ranked, key=lambda hit: hit.score, reverse=True)
+
+def prerank_topic(topic_results, as_ylo=2020, current_year=None):
+    """Keeps the top_k hits of a topic scoring at least min_score
+
+    Output:
+        topic_results (TopicResults): The topic with only its kept hits, best first
+        confident (bool): Every kept hit scores at least confident_score, the LLM filter can be skipped
+    """
+    ranked = rank_hits(topic_results.topic, topic_results.query, topic_results.results, as_ylo, current_year)
+    kept = [hit for hit in ranked if hit.score >= RANKING_SETTINGS['min_score']][:RANKING_SETTINGS['top_k']]
+    confident = bool(kept) and all(hit.score >= RANKING_SETTINGS['confident_score'] for hit in kept)
+    if not kept:
+        # Nothing looks suitable: the LLM filter gets the best hits and decides
+        kept = ranked[:RANKING_SETTINGS['top_k']]
+    return TopicResults(topic_results.topic, topic_results.query, [hit.result for hit in kept]), confident
+
+def _normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+def evaluate_ranking(cassette_path, as_ylo=None):
+    """Agreement of the pre-ranking with the LLM filter on the searches of a cassette recorded with prerank=False
+
+    A hit is labelled suitable when the LLM filter kept it (its link or title is in the filter response). Only the hits
+    shown to the filter count, so hits dropped as duplicates of another topic are left out.
+
+    Output:
+        evaluation (dict): Topics, hits, hits kept by the LLM and the pre-ranking, precision/recall of the pre-ranking
+                           against the LLM, and the topics whose filter would have been skipped with their precision
+    """
+    with open(cassette_path, encoding='utf-8') as f:
+        interactions = json.load(f)['interactions']
+    filters = [interaction for interaction in interactions
+               if interaction['kind'] == "llm" and "Filter out sources that aren't ideal" in interaction['request']['prompt']]
+    totals = {"topics": 0, "hits": 0, "llm_kept": 0, "prerank_kept": 0, "both_kept": 0,
+              "confident_topics": 0, "confident_kept": 0, "confident_both_kept": 0}
+    for search in (interaction for interaction in interactions if interaction['kind'] == "search"):
+        hits = [SearchResult(**hit) for hit in search['response']]
+        # The filter call of this topic is the one whose prompt shows the most of its hits
+        shown_counts = [sum(1 for hit in hits if hit.link and hit.link in interaction['request']['prompt']) for interaction in filters]
+        if not hits or not any(shown_counts):
+            continue
+        matching = filters[shown_counts.index(max(shown_counts))]
+        prompt = matching['request']['prompt']
+        response = matching['response'] if isinstance(matching['response'], str) else "".join(matching['response'])
+        topic = re.search(r"Topic: (.*)", prompt)
+        shown = [hit for hit in hits if hit.link and hit.link in prompt]
+        llm_kept = {hit.link for hit in shown if hit.link in response or (hit.title and _normalize(hit.title) in _normalize(response))}
+        kept, confident = prerank_topic(TopicResults(topic.group(1).strip() if topic else "", search['request']['query'], shown),
+                                        as_ylo or search['request'].get('as_ylo') or 2020)
+        prerank_kept = {hit.link for hit in kept.results}
+
+        totals["topics"] += 1
+        totals["hits"] += len(shown)
+        totals["llm_kept"] += len(llm_kept)
+        totals["prerank_kept"] += len(prerank_kept)
+        totals["both_kept"] += len(llm_kept & prerank_kept)
+        if confident:
+            totals["confident_topics"] += 1
+            totals["confident_kept"] += len(prerank_kept)
+            totals["confident_both_kept"] += len(llm_kept & prerank_kept)
+
+    return {
+        **totals,
+        "precision": round(totals["both_kept"] / totals["prerank_kept"], 3) if totals["prerank_kept"] else None,
+        "recall": round(totals["both_kept"] / totals["llm_kept"], 3) if totals["llm_kept"] else None,
+        "confident_precision": round(totals["confident_both_kept"] / totals["confident_kept"], 3) if totals["confident_kept"] else None,
+    }
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python ranking_functions.py cassette.json")
+    print(json.dumps(evaluate_ranking(sys.argv[1]), indent=4))
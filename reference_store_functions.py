@@ -0,0 +1,325 @@
+"""Local store of the Google Scholar hits retrieved so far, searched with BM25 before going to SerpAPI
+
+Every hit returned by search_google_scholar() is kept (title, link, snippet, publication summary, year, citations)
+and indexed, so a query for a textbook another outline already found is answered without a SerpAPI credit:
+    configure_reference_store(".cache/references")   # see search_functions.py
+    search_google_scholar("introduction to machine learning textbook", 5)
+
+Layout of the store folder:
+    references.sqlite   The references, one row each, deduplicated on their normalized title
+    manifest.json       Segments of the index and the id of the last reference written to one
+    segments/<name>/    One immutable segment: a term x document CSR matrix of term frequencies (indptr, indices,
+                        data), the length, year and reference id of its documents (.npy) and its terms (terms.json)
+Segments are memory mapped, so a query only reads the postings of its own terms from disk. New references are
+searchable at once from an in-memory segment, written to disk every REFERENCE_FLUSH_DOCS references. Segments are
+merged once there are more than REFERENCE_MAX_SEGMENTS of them. One process should write to a store at a time.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import threading
+import numpy as np
+from scipy import sparse
+
+
+REFERENCE_FLUSH_DOCS = 5000     # New references kept in memory before they are written as a segment
+REFERENCE_MAX_SEGMENTS = 16     # Segments are merged into one above this
+REFERENCE_MIN_COVERAGE = 0.7    # Share of the query (weighted by idf) a reference must match to be a good match
+REFERENCE_TITLE_WEIGHT = 2      # Title words count this many times in the term frequencies
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "its", "of",
+             "on", "or", "that", "the", "this", "to", "with", "n", "na"}
+
+_SEGMENT_ARRAYS = ["indptr", "indices", "data", "lengths", "years", "ids"]
+
+def tokenize(text):
+    """Lowercase words and numbers of text, without stopwords and one-letter words"""
+    return [word for word in re.findall(r"[a-z0-9]+", (text or "").lower()) if (len(word) > 1 or word.isdigit()) and word not in STOPWORDS]
+
+def reference_key(reference):
+    """Key a reference is deduplicated on: its normalized title, or its link for untitled ones"""
+    title = " ".join(re.findall(r"[a-z0-9]+", (reference.get('title') or "").lower()))
+    return title or reference.get('link') or None
+
+def _document_tokens(reference):
+    return (tokenize(reference.get('title')) * REFERENCE_TITLE_WEIGHT
+            + tokenize(reference.get('snippet')) + tokenize(reference.get('publication_summary')))
+
+def build_segment(ids, token_lists, years):
+    """Index of documents as a segment (dict of arrays and "terms")
+
+    Params:
+        ids (list): Reference id of every document
+        token_lists (list): Tokens of every document, see tokenize()
+        years (list): Publication year of every document (None when unknown)
+    """
+    vocabulary = {}
+    rows = []
+    for tokens in token_lists:
+        rows.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+    columns = np.repeat(np.arange(len(token_lists), dtype=np.int32), [len(tokens) for tokens in token_lists])
+    # Every occurrence is one entry, converting to CSR sums the duplicates into term frequencies
+    matrix = sparse.coo_matrix((np.ones(len(rows), dtype=np.float32), (np.array(rows, dtype=np.int32), columns)),
+                               shape=(len(vocabulary), len(token_lists))).tocsr()
+    matrix.sort_indices()
+    lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.float32)
+    return {
+        "indptr": matrix.indptr.astype(np.int64),
+        "indices": matrix.indices.astype(np.int32),
+        "data": matrix.data.astype(np.float32),
+        "lengths": lengths,
+        "total_length": float(np.sum(lengths)),
+        "years": np.array([year or 0 for year in years], dtype=np.int16),
+        "ids": np.array(ids, dtype=np.int64),
+        "terms": {term: row for term, row in vocabulary.items()},
+    }
+
+def merge_segments(segments):
+    """One segment holding the documents of every segment, in order"""
+    vocabulary = {}
+    rows, columns, data = [], [], []
+    offset = 0
+    for segment in segments:
+        terms = sorted(segment['terms'], key=segment['terms'].get)
+        remap = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in terms], dtype=np.int32)
+        rows.append(np.repeat(remap, np.diff(segment['indptr'])))
+        columns.append(np.asarray(segment['indices']) + offset)
+        data.append(np.asarray(segment['data']))
+        offset += len(segment['ids'])
+    matrix = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))),
+                               shape=(len(vocabulary), offset))
+    matrix.sort_indices()
+    return {
+        "indptr": matrix.indptr.astype(np.int64),
+        "indices": matrix.indices.astype(np.int32),
+        "data": matrix.data.astype(np.float32),
+        "lengths": np.concatenate([segment['lengths'] for segment in segments]),
+        "years": np.concatenate([segment['years'] for segment in segments]),
+        "ids": np.concatenate([segment['ids'] for segment in segments]),
+        "terms": vocabulary,
+    }
+
+def _postings(segment, row):
+    start, end = segment['indptr'][row], segment['indptr'][row + 1]
+    return segment['indices'][start:end], segment['data'][start:end]
+
+class ReferenceStore:
+    """References on disk with an inverted index, searched with vectorized BM25
+
+    Usage:
+        store = ReferenceStore(".cache/references")
+        store.add([asdict(result) for result in results])
+        matches = store.search("machine learning textbook", num_results=5, as_ylo=2020)
+    """
+
+    def __init__(self, path=".cache/references", flush_docs=REFERENCE_FLUSH_DOCS, max_segments=REFERENCE_MAX_SEGMENTS):
+        """
+        Params:
+            path (str): Folder of the store
+            flush_docs (int): New references kept in memory before they are written as a segment
+            max_segments (int): Segments are merged into one above this
+        """
+        self.path = path
+        self.flush_docs = flush_docs
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "references.sqlite"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS refs (
+            id INTEGER PRIMARY KEY,
+            key TEXT UNIQUE NOT NULL,
+            title TEXT, link TEXT, snippet TEXT, publication_summary TEXT, year INTEGER, citations INTEGER,
+            added REAL NOT NULL
+        )""")
+        self._manifest = self._read_manifest()
+        self._segments = [self._load_segment(name) for name in self._manifest['segments']]
+        # References added since the last segment was written, indexed in memory until the next flush
+        self._pending = {"ids": [], "tokens": [], "years": []}
+        self._pending_segment = None
+        rows = self._conn.execute("SELECT id, title, snippet, publication_summary, year FROM refs WHERE id > ? ORDER BY id",
+                                  (self._manifest['indexed'],)).fetchall()
+        for id, title, snippet, publication_summary, year in rows:
+            self._append_pending(id, {"title": title, "snippet": snippet, "publication_summary": publication_summary}, year)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, "manifest.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "indexed": 0}
+
+    def _write_manifest(self):
+        path = os.path.join(self.path, "manifest.json")
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _load_segment(self, name):
+        folder = os.path.join(self.path, "segments", name)
+        segment = {array: np.load(os.path.join(folder, f"{array}.npy"), mmap_mode='r') for array in _SEGMENT_ARRAYS}
+        with open(os.path.join(folder, "terms.json"), encoding='utf-8') as f:
+            segment['terms'] = json.load(f)
+        segment['name'] = name
+        segment['total_length'] = float(np.sum(segment['lengths']))
+        return segment
+
+    def _save_segment(self, segment):
+        name = f"{int(segment['ids'][0])}-{int(segment['ids'][-1])}-{time.time_ns()}"
+        folder = os.path.join(self.path, "segments", name)
+        os.makedirs(folder + ".tmp")
+        for array in _SEGMENT_ARRAYS:
+            np.save(os.path.join(folder + ".tmp", f"{array}.npy"), segment[array])
+        with open(os.path.join(folder + ".tmp", "terms.json"), 'w', encoding='utf-8') as f:
+            json.dump(segment['terms'], f)
+        os.replace(folder + ".tmp", folder)
+        return self._load_segment(name)
+
+    def _append_pending(self, id, reference, year):
+        self._pending['ids'].append(id)
+        self._pending['tokens'].append(_document_tokens(reference))
+        self._pending['years'].append(year)
+        self._pending_segment = None
+
+    def add(self, references):
+        """Stores and indexes the references not in the store yet
+
+        Params:
+            references (list): Dicts with the fields of SearchResult (title, link, snippet, publication_summary, year, citations)
+
+        Output:
+            added (int): Number of new references
+        """
+        now = time.time()
+        added = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for reference in references:
+                key = reference_key(reference)
+                if key is None:
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO refs (key, title, link, snippet, publication_summary, year, citations, added) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, reference.get('title'), reference.get('link'), reference.get('snippet'), reference.get('publication_summary'),
+                     reference.get('year'), reference.get('citations') or 0, now))
+                if cursor.rowcount:
+                    self._append_pending(cursor.lastrowid, reference, reference.get('year'))
+                    added += 1
+            self._conn.execute("COMMIT")
+            if len(self._pending['ids']) >= self.flush_docs:
+                self._flush()
+        return added
+
+    def flush(self):
+        """Writes the references indexed in memory as a segment"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending['ids']:
+            return
+        segment = self._save_segment(build_segment(self._pending['ids'], self._pending['tokens'], self._pending['years']))
+        self._segments.append(segment)
+        self._manifest = {"segments": [s['name'] for s in self._segments], "indexed": int(segment['ids'][-1])}
+        self._pending = {"ids": [], "tokens": [], "years": []}
+        self._pending_segment = None
+        if len(self._segments) > self.max_segments:
+            self._optimize()
+        else:
+            self._write_manifest()
+
+    def optimize(self):
+        """Writes the pending references and merges every segment into one (i.e. after a bulk import)"""
+        with self._lock:
+            self._flush()
+            self._optimize()
+
+    def _optimize(self):
+        if len(self._segments) < 2:
+            return
+        old = [segment['name'] for segment in self._segments]
+        self._segments = [self._save_segment(merge_segments(self._segments))]
+        self._manifest['segments'] = [self._segments[0]['name']]
+        self._write_manifest()
+        for name in old:
+            shutil.rmtree(os.path.join(self.path, "segments", name), ignore_errors=True)
+
+    def _searchable_segments(self):
+        with self._lock:
+            if self._pending['ids'] and self._pending_segment is None:
+                self._pending_segment = build_segment(self._pending['ids'], self._pending['tokens'], self._pending['years'])
+            return self._segments + ([self._pending_segment] if self._pending['ids'] else [])
+
+    def search(self, query, num_results=5, as_ylo=None, min_coverage=REFERENCE_MIN_COVERAGE):
+        """Best BM25 matches of a query that match at least min_coverage of it
+
+        Params:
+            query (str): The search query
+            num_results (int): Max number of references to return
+            as_ylo (int): Only references published this year or later, like Google Scholar (references without a year are skipped)
+            min_coverage (float): Share of the idf of the query terms a reference must contain, 1.0 requires every term
+
+        Output:
+            matches (list): Dicts of the references (SearchResult fields) with their "score" and "coverage", best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        segments = self._searchable_segments()
+        if not terms or not segments:
+            return []
+        documents = sum(len(segment['ids']) for segment in segments)
+        average_length = sum(segment['total_length'] for segment in segments) / documents
+        rows = [[segment['terms'].get(term) for term in terms] for segment in segments]
+        # Document frequency of every term over all segments, the length of its postings
+        frequencies = np.zeros(len(terms))
+        for segment, segment_rows in zip(segments, rows):
+            for i, row in enumerate(segment_rows):
+                if row is not None:
+                    frequencies[i] += segment['indptr'][row + 1] - segment['indptr'][row]
+        # Terms missing from the store get the highest idf, so a query about something new isn't answered locally
+        idf = np.log1p((documents - frequencies + 0.5) / (frequencies + 0.5))
+        total_idf = float(np.sum(idf))
+
+        candidates = []
+        for segment, segment_rows in zip(segments, rows):
+            postings = [(i, *_postings(segment, row)) for i, row in enumerate(segment_rows) if row is not None]
+            if not postings:
+                continue
+            documents_of = np.concatenate([indices for _, indices, _ in postings])
+            frequency = np.concatenate([data for _, _, data in postings])
+            term_idf = np.concatenate([np.full(len(indices), idf[i]) for i, indices, _ in postings])
+            lengths = segment['lengths'][documents_of]
+            weights = term_idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length))
+            scores = np.bincount(documents_of, weights=weights, minlength=len(segment['ids']))
+            coverage = np.bincount(documents_of, weights=term_idf, minlength=len(segment['ids'])) / total_idf
+            good = coverage >= min_coverage - 1e-9
+            if as_ylo:
+                good &= np.asarray(segment['years']) >= as_ylo
+            good = np.flatnonzero(good)
+            if len(good) > num_results:
+                good = good[np.argpartition(-scores[good], num_results - 1)[:num_results]]
+            candidates.extend((float(scores[i]), float(coverage[i]), int(segment['ids'][i])) for i in good)
+
+        candidates = sorted(candidates, reverse=True)[:num_results]
+        if not candidates:
+            return []
+        with self._lock:
+            placeholders = ",".join("?" * len(candidates))
+            rows = self._conn.execute(f"SELECT id, title, link, snippet, publication_summary, year, citations FROM refs WHERE id IN ({placeholders})",
+                                      [id for _, _, id in candidates]).fetchall()
+        references = {row[0]: dict(zip(["title", "link", "snippet", "publication_summary", "year", "citations"], row[1:])) for row in rows}
+        return [{**references[id], "score": round(score, 4), "coverage": round(coverage, 4)} for score, coverage, id in candidates if id in references]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending['ids'])
+            segments = len(self._segments)
+        return {"references": len(self), "segments": segments, "pending": pending}
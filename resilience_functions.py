@@ -0,0 +1,282 @@
+"""Timeouts, retries with backoff and hedged requests for the LLM calls
+
+Every gpt_response() attempt gets a timeout, transient errors (429, 5xx, timeouts, dropped connections)
+are retried with jittered exponential backoff, and all of it stays within the deadline of the running stage:
+    with stage_deadline("course_outline"):
+        course_outline = generate_course_outline(...)
+
+With hedging on (configure_retries(hedge=True)), an attempt slower than the recorded p95 latency of its
+stage gets a duplicate request and the first answer wins.
+"""
+import time
+import random
+import asyncio
+import threading
+import contextvars
+import email.utils
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import openai
+
+
+RETRY_SETTINGS = {
+    "max_attempts": 4,          # Attempts per call, including the first one
+    "base_delay": 1.0,          # Max backoff before the 2nd attempt in seconds, doubles for every following attempt
+    "max_delay": 30.0,          # Max backoff in seconds
+    "request_timeout": 120.0,   # Seconds a single attempt may take (cut to what is left of the stage deadline)
+    "hedge": False,             # Send a duplicate request when an attempt is slower than hedge_quantile
+    "hedge_quantile": 0.95,     # Latency quantile of the stage after which the duplicate is sent
+    "hedge_min_samples": 20,    # Latencies recorded for a stage before it is hedged
+}
+
+# Seconds a stage may take in total, retries included
+STAGE_DEADLINES = {
+    "description": 120,
+    "queries": 120,
+    "references": 300,
+    "search_results": 300,
+    "learning_outcomes": 300,
+    "course_outline": 600,
+}
+
+def configure_retries(**settings):
+    """Update RETRY_SETTINGS
+
+    Params:
+        **settings: Any key of RETRY_SETTINGS (i.e. max_attempts=..., hedge=True)
+    """
+    unknown = set(settings) - set(RETRY_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown retry settings: {sorted(unknown)}")
+    RETRY_SETTINGS.update(settings)
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage runs out of time before its call could be (re)tried"""
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+_stage = contextvars.ContextVar("stage", default=None)
+
+@contextmanager
+def deadline(seconds, stage=None):
+    """Calls inside the block must finish within seconds (a nested deadline can't extend the outer one)
+
+    Params:
+        seconds (float): Time allowed for the block
+        stage (str): Name of the stage, latencies are tracked per stage for hedging
+    """
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    deadline_token = _deadline.set(end if current is None else min(current, end))
+    stage_token = _stage.set(stage or _stage.get())
+    try:
+        yield
+    finally:
+        _stage.reset(stage_token)
+        _deadline.reset(deadline_token)
+
+def stage_deadline(stage):
+    """deadline() of a stage from STAGE_DEADLINES, no deadline for stages not in it"""
+    seconds = STAGE_DEADLINES.get(stage)
+    return deadline(seconds, stage) if seconds is not None else nullcontext()
+
+def time_left():
+    """Seconds left before the current deadline, None outside of a deadline"""
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+def attempt_timeout():
+    """Timeout of the next attempt: request_timeout, cut to the time left of the deadline"""
+    left = time_left()
+    if left is None:
+        return RETRY_SETTINGS['request_timeout']
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline of stage '{_stage.get()}' exceeded")
+    return min(RETRY_SETTINGS['request_timeout'], left)
+
+_stats = {"attempts": 0, "retries": 0, "hedged": 0, "hedge_wins": 0, "deadline_exceeded": 0}
+_stats_lock = threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def resilience_stats():
+    """Counters of attempts, retries, hedged requests (and how often the duplicate won) and missed deadlines"""
+    with _stats_lock:
+        return dict(_stats)
+
+def is_retryable(error):
+    if isinstance(error, openai.APIStatusError):
+        # Out of credits is a 429 as well, but waiting doesn't help
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return False
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return isinstance(error, (openai.APITimeoutError, openai.APIConnectionError))
+
+def retry_after(error):
+    """Seconds asked for by the Retry-After (or retry-after-ms) header of an error response"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers['retry-after-ms']) / 1000
+    except (KeyError, TypeError, ValueError):
+        pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # A malformed header falls back to the exponential backoff
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+def retry_delay(attempt, error, name="call"):
+    """Seconds to wait before retrying after error (Retry-After, else full-jitter exponential backoff)
+
+    Re-raises error when it can't be retried: not transient, out of attempts, or the wait would pass the deadline.
+    """
+    if attempt + 1 >= RETRY_SETTINGS['max_attempts'] or not is_retryable(error):
+        raise error
+    delay = retry_after(error)
+    if delay is None:
+        delay = random.uniform(0, min(RETRY_SETTINGS['max_delay'], RETRY_SETTINGS['base_delay'] * 2 ** attempt))
+    left = time_left()
+    if left is not None and delay >= left:
+        _count("deadline_exceeded")
+        raise DeadlineExceeded(f"Deadline of stage '{_stage.get()}' exceeded while retrying {name}: {error}") from error
+    _count("retries")
+    print(f"{name} failed ({error}), retrying in {delay:.2f}s (attempt {attempt + 2}/{RETRY_SETTINGS['max_attempts']})")
+    return delay
+
+def call_with_retries(function, name="call"):
+    """Calls function(timeout) until it succeeds, retrying transient errors
+
+    Params:
+        function (function): Called with the timeout of the attempt in seconds
+        name (str): Shown in the retry logs
+    """
+    attempt = 0
+    while True:
+        timeout = attempt_timeout()
+        try:
+            return function(timeout)
+        except Exception as e:
+            time.sleep(retry_delay(attempt, e, name))
+            attempt += 1
+
+async def acall_with_retries(function, name="call"):
+    """Async version of call_with_retries(), function(timeout) returns a coroutine"""
+    attempt = 0
+    while True:
+        timeout = attempt_timeout()
+        try:
+            return await function(timeout)
+        except Exception as e:
+            await asyncio.sleep(retry_delay(attempt, e, name))
+            attempt += 1
+
+class LatencyTracker:
+    """Recent latencies of successful calls per key, to know when a request is slower than usual"""
+
+    def __init__(self, size=200):
+        self.size = size
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def quantile(self, key, q):
+        """Latency quantile q of key, None until hedge_min_samples latencies were recorded"""
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < RETRY_SETTINGS['hedge_min_samples']:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+latencies = LatencyTracker()
+
+# Threads running hedged requests, only used while hedging is on
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+def _hedge_threshold(key):
+    if not RETRY_SETTINGS['hedge']:
+        return None
+    return latencies.quantile(key, RETRY_SETTINGS['hedge_quantile'])
+
+def latency_key(model):
+    """Latencies are tracked per stage and model"""
+    return (_stage.get(), model)
+
+def hedged_call(function, key, timeout):
+    """Calls function(timeout), sending a duplicate call when the first one is slower than the hedge threshold of key
+
+    The first successful answer is returned, the slower call keeps running in the background and is ignored.
+    """
+    threshold = _hedge_threshold(key)
+    _count("attempts")
+    start = time.perf_counter()
+    if threshold is None:
+        result = function(timeout)
+        latencies.record(key, time.perf_counter() - start)
+        return result
+
+    # Threads don't inherit the deadline and stage, so the calls run in a copy of this context
+    context = contextvars.copy_context()
+    first = _hedge_executor.submit(context.copy().run, function, timeout)
+    done, pending = wait({first}, timeout=threshold)
+    if not done:
+        _count("hedged")
+        pending.add(_hedge_executor.submit(context.copy().run, function, max(0.0, timeout - threshold)))
+    while True:
+        if not done:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                latencies.record(key, time.perf_counter() - start)
+                if future is not first:
+                    _count("hedge_wins")
+                return future.result()
+        if not pending:
+            raise next(iter(done)).exception()
+        done = set()
+
+async def ahedged_call(function, key, timeout):
+    """Async version of hedged_call(), the slower request is cancelled"""
+    threshold = _hedge_threshold(key)
+    _count("attempts")
+    start = time.perf_counter()
+    if threshold is None:
+        result = await function(timeout)
+        latencies.record(key, time.perf_counter() - start)
+        return result
+
+    first = asyncio.ensure_future(function(timeout))
+    done, pending = await asyncio.wait({first}, timeout=threshold)
+    if not done:
+        _count("hedged")
+        pending.add(asyncio.ensure_future(function(max(0.0, timeout - threshold))))
+    try:
+        while True:
+            if not done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    latencies.record(key, time.perf_counter() - start)
+                    if task is not first:
+                        _count("hedge_wins")
+                    return task.result()
+            if not pending:
+                raise next(iter(done)).exception()
+            done = set()
+    finally:
+        for task in pending:
+            task.cancel()
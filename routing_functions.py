@@ -0,0 +1,133 @@
+"""Per-stage model, max_tokens and temperature of the LLM calls
+
+A routing profile maps every stage to the model, output token cap and temperature of its calls:
+    with use_profile("fast"):
+        run_outline_pipeline(course_details)
+"default" keeps the model chosen by the caller for every stage, "fast", "balanced" and "quality" trade cost and
+latency for output quality. Caps of the stages writing the weekly activities grow with the number of weeks.
+Per-stage latency, tokens and cost of a run are in its trace summary (see tracing_functions.py), and
+    python benchmark_functions.py routing
+compares the profiles against the fake upstreams.
+"""
+import contextvars
+from contextlib import contextmanager
+
+
+# Stage -> route. model None uses the model passed by the caller (i.e. the sidebar choice).
+# max_tokens is the output cap, plus tokens_per_week for every week the call writes activities for.
+ROUTING_PROFILES = {
+    # The model of the caller everywhere, as before profiles existed
+    "default": {
+        "queries": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "filter": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "description": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "learning_outcomes": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "course_outline": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "course_plan": {"model": None, "max_tokens": 4000, "temperature": 0.5},
+        "activities": {"model": None, "max_tokens": 300, "tokens_per_week": 250, "temperature": 0.5},
+    },
+    # The small model everywhere, with caps close to the expected output size
+    "fast": {
+        "queries": {"model": "gpt-4o-mini", "max_tokens": 600, "temperature": 0.3},
+        "filter": {"model": "gpt-4o-mini", "max_tokens": 1200, "temperature": 0.0},
+        "description": {"model": "gpt-4o-mini", "max_tokens": 300, "temperature": 0.7},
+        "learning_outcomes": {"model": "gpt-4o-mini", "max_tokens": 2000, "temperature": 0.5},
+        "course_outline": {"model": "gpt-4o-mini", "max_tokens": 1500, "tokens_per_week": 150, "temperature": 0.5},
+        "course_plan": {"model": "gpt-4o-mini", "max_tokens": 2000, "temperature": 0.5},
+        "activities": {"model": "gpt-4o-mini", "max_tokens": 200, "tokens_per_week": 200, "temperature": 0.5},
+    },
+    # The small model for the extraction-like stages, the caller's model for the outcomes and the outline
+    "balanced": {
+        "queries": {"model": "gpt-4o-mini", "max_tokens": 800, "temperature": 0.3},
+        "filter": {"model": "gpt-4o-mini", "max_tokens": 1500, "temperature": 0.0},
+        "description": {"model": "gpt-4o-mini", "max_tokens": 300, "temperature": 0.7},
+        "learning_outcomes": {"model": None, "max_tokens": 2500, "temperature": 0.5},
+        "course_outline": {"model": None, "max_tokens": 2000, "tokens_per_week": 200, "temperature": 0.5},
+        "course_plan": {"model": None, "max_tokens": 2500, "temperature": 0.5},
+        "activities": {"model": None, "max_tokens": 300, "tokens_per_week": 250, "temperature": 0.5},
+    },
+    # The large model everywhere, with room to spare
+    "quality": {
+        "queries": {"model": "gpt-4o", "max_tokens": 1000, "temperature": 0.3},
+        "filter": {"model": "gpt-4o", "max_tokens": 2000, "temperature": 0.0},
+        "description": {"model": "gpt-4o", "max_tokens": 400, "temperature": 0.7},
+        "learning_outcomes": {"model": "gpt-4o", "max_tokens": 4000, "temperature": 0.5},
+        "course_outline": {"model": "gpt-4o", "max_tokens": 2500, "tokens_per_week": 250, "temperature": 0.5},
+        "course_plan": {"model": "gpt-4o", "max_tokens": 3000, "temperature": 0.5},
+        "activities": {"model": "gpt-4o", "max_tokens": 400, "tokens_per_week": 300, "temperature": 0.5},
+    },
+}
+
+# Max output tokens of the models, matched on the longest model prefix
+MODEL_MAX_OUTPUT_TOKENS = {
+    "gpt-4o-mini": 16384,
+    "gpt-4o": 16384,
+    "gpt-4-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 4096,
+}
+
+ROUTING_SETTINGS = {
+    "profile": "default",   # Profile used outside of use_profile()
+}
+
+def configure_routing(**settings):
+    """Update ROUTING_SETTINGS
+
+    Params:
+        **settings: Any key of ROUTING_SETTINGS (i.e. profile="fast")
+    """
+    unknown = set(settings) - set(ROUTING_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown routing settings: {sorted(unknown)}")
+    if settings.get('profile') not in (None, *ROUTING_PROFILES):
+        raise ValueError(f"Unknown routing profile '{settings['profile']}', use one of {list(ROUTING_PROFILES)}")
+    ROUTING_SETTINGS.update(settings)
+
+_profile = contextvars.ContextVar("routing_profile", default=None)
+
+@contextmanager
+def use_profile(profile):
+    """Routes the calls made inside the block (and its threads and tasks) with a profile of ROUTING_PROFILES
+
+    Params:
+        profile (str): Name of the profile, None keeps the current one
+    """
+    if profile is not None and profile not in ROUTING_PROFILES:
+        raise ValueError(f"Unknown routing profile '{profile}', use one of {list(ROUTING_PROFILES)}")
+    token = _profile.set(profile or _profile.get())
+    try:
+        yield
+    finally:
+        _profile.reset(token)
+
+def current_profile():
+    """Name of the profile routing the calls of this context"""
+    return _profile.get() or ROUTING_SETTINGS['profile'] or "default"
+
+def max_output_tokens(model):
+    prefixes = [prefix for prefix in MODEL_MAX_OUTPUT_TOKENS if model and model.startswith(prefix)]
+    return MODEL_MAX_OUTPUT_TOKENS[max(prefixes, key=len)] if prefixes else None
+
+def route(stage, model, weeks=0, input_tokens=None):
+    """Model, max_tokens and temperature of a call of stage under the current profile, as gpt_response() keywords
+
+    Params:
+        stage (str): Key of the profile (queries, filter, description, learning_outcomes, course_outline, course_plan, activities)
+        model (str): Model passed by the caller, used by stages whose route has no model
+        weeks (int): Weeks of activities written by the call, for caps that grow with the course length
+        input_tokens (int): Tokens of the text the call only selects from (i.e. the references it filters), the cap
+                            doesn't go much over it. Not used by the "default" profile, which keeps the caps of before
+    """
+    profile = current_profile()
+    stage_route = ROUTING_PROFILES[profile][stage]
+    routed_model = stage_route['model'] or model
+    max_tokens = stage_route['max_tokens'] + stage_route.get('tokens_per_week', 0) * weeks
+    if input_tokens is not None and profile != "default":
+        max_tokens = min(max_tokens, int(input_tokens * 1.2) + 200)
+    model_max = max_output_tokens(routed_model)
+    return {
+        "model": routed_model,
+        "max_tokens": min(max_tokens, model_max) if model_max else max_tokens,
+        "temperature": stage_route['temperature'],
+    }
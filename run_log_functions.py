@@ -0,0 +1,205 @@
+"""Append-only log of the generated course outlines
+
+One JSON record per line, appended with a single write under a file lock, so concurrent Streamlit sessions
+(and processes) never lose each other's runs and logging a run doesn't depend on the size of the log.
+The log is rotated to output_logs.jsonl.<timestamp> once it is too big or too old; read_runs() streams
+the rotated files and the current one in order.
+
+Usage:
+    python run_log_functions.py summary                    # aggregate every logged run
+    python run_log_functions.py import output_logs.json    # one-time import of the old JSON array log
+"""
+import os
+import sys
+import glob
+import json
+import time
+import datetime
+import threading
+from array import array
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the process-wide lock still serializes the sessions of one Streamlit server
+    fcntl = None
+
+
+RUN_LOG_PATH = "output_logs.jsonl"
+RUN_LOG_MAX_BYTES = 50 * 1024 * 1024   # Rotate once the log is bigger than this
+RUN_LOG_MAX_AGE = 30 * 24 * 3600       # Rotate once the first run of the log is older than this (seconds)
+
+_lock = threading.Lock()
+
+@contextmanager
+def _locked(path):
+    """Exclusive lock of the log shared by threads and processes (through path.lock)"""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path + ".lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _first_logged_at(path):
+    with open(path, encoding='utf-8') as f:
+        try:
+            return json.loads(f.readline()).get('logged_at')
+        except ValueError:
+            return None
+
+def _rotate_if_needed(path, max_bytes, max_age, now):
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return
+    if size == 0:
+        return
+    first_logged_at = _first_logged_at(path)
+    if size < max_bytes and (first_logged_at is None or now - first_logged_at < max_age):
+        return
+    suffix = datetime.datetime.fromtimestamp(now).strftime("%Y%m%d-%H%M%S-%f")
+    os.replace(path, f"{path}.{suffix}")
+
+def _write_lines(path, lines):
+    # O_APPEND makes every write land at the end of the file, even if another process wrote in between
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, "".join(lines).encode('utf-8'))
+    finally:
+        os.close(fd)
+
+def append_run(record, path=RUN_LOG_PATH, max_bytes=RUN_LOG_MAX_BYTES, max_age=RUN_LOG_MAX_AGE):
+    """Appends one run to the log, rotating it first if it is too big or too old
+
+    Params:
+        record (dict): Details of the run, i.e. the log_details of app.py
+        path (str): JSONL file of the log
+        max_bytes (int): Size after which the log is rotated
+        max_age (float): Seconds after the first run of the log after which it is rotated
+    """
+    now = time.time()
+    line = json.dumps({**record, "logged_at": now}, default=str) + "\n"
+    with _locked(path):
+        _rotate_if_needed(path, max_bytes, max_age, now)
+        _write_lines(path, [line])
+
+def log_files(path=RUN_LOG_PATH):
+    """Rotated logs oldest first, then the current log"""
+    rotated = sorted(file for file in glob.glob(glob.escape(path) + ".*") if not file.endswith(".lock"))
+    return rotated + ([path] if os.path.exists(path) else [])
+
+def read_runs(path=RUN_LOG_PATH):
+    """Streams every logged run, oldest first, one record at a time
+
+    A line cut short by a crash in the middle of a write is skipped.
+    """
+    for file in log_files(path):
+        with open(file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def _quantile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+def aggregate_runs(runs):
+    """Totals over any number of runs, reading them one at a time
+
+    Params:
+        runs (iterable): Run records, i.e. read_runs()
+
+    Output:
+        summary (dict): Number of runs, runs per model and date, execution time mean/p50/p95/max, total cost,
+                        and runs, mean execution time and mean cost per routing profile
+    """
+    # Execution times are kept as packed doubles (8 bytes per run) for exact quantiles
+    execution_times = array('d')
+    models = {}
+    profiles = {}
+    days = {}
+    cost = 0.0
+    count = 0
+    for run in runs:
+        count += 1
+        models[run.get('Model')] = models.get(run.get('Model'), 0) + 1
+        day = str(run.get('Date', ''))[:10]
+        days[day] = days.get(day, 0) + 1
+        if isinstance(run.get('Execution Time'), (int, float)):
+            execution_times.append(run['Execution Time'])
+        stages = run.get('Stages') or {}
+        run_cost = stages.get('run_outline_pipeline', {}).get('cost_usd', 0.0)
+        cost += run_cost
+        # Runs logged before routing profiles existed used the model of the run everywhere, as "default" does
+        profile = profiles.setdefault(run.get('Profile') or "default", {"runs": 0, "seconds": 0.0, "cost_usd": 0.0})
+        profile["runs"] += 1
+        profile["cost_usd"] += run_cost
+        if isinstance(run.get('Execution Time'), (int, float)):
+            profile["seconds"] += run['Execution Time']
+
+    execution_times = sorted(execution_times)
+    return {
+        "runs": count,
+        "models": models,
+        "runs_per_day": days,
+        "execution_time": {
+            "mean": round(sum(execution_times) / len(execution_times), 3) if execution_times else None,
+            "p50": _quantile(execution_times, 0.5),
+            "p95": _quantile(execution_times, 0.95),
+            "max": execution_times[-1] if execution_times else None,
+        },
+        "cost_usd": round(cost, 6),
+        "profiles": {
+            name: {
+                "runs": profile["runs"],
+                "execution_time_mean": round(profile["seconds"] / profile["runs"], 3),
+                "cost_usd_mean": round(profile["cost_usd"] / profile["runs"], 6),
+            }
+            for name, profile in profiles.items()
+        },
+    }
+
+def import_json_logs(json_path="output_logs.json", path=RUN_LOG_PATH):
+    """One-time import of the old log, a JSON array rewritten on every run
+
+    The runs are appended in their original order and the old file is renamed to <json_path>.imported,
+    so calling this again does nothing.
+
+    Output:
+        imported (int): Number of runs imported
+    """
+    if not os.path.exists(json_path):
+        return 0
+    with _locked(path):
+        # Another session may have imported it while this one waited for the lock
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, encoding='utf-8') as f:
+            runs = json.load(f)
+        lines = []
+        for run in runs:
+            try:
+                logged_at = datetime.datetime.strptime(run['Date'], "%Y-%m-%d %H:%M:%S").timestamp()
+            except (KeyError, TypeError, ValueError):
+                logged_at = None
+            lines.append(json.dumps({**run, "logged_at": logged_at}, default=str) + "\n")
+        if lines:
+            _write_lines(path, lines)
+        os.replace(json_path, json_path + ".imported")
+    return len(runs)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "summary":
+        print(json.dumps(aggregate_runs(read_runs(sys.argv[2] if len(sys.argv) > 2 else RUN_LOG_PATH)), indent=4))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "import":
+        imported = import_json_logs(*sys.argv[2:3])
+        print(f"Imported {imported} runs into {RUN_LOG_PATH}")
+    else:
+        sys.exit(__doc__)
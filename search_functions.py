@@ -1,5 +1,16 @@
 # research project
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from cache_functions import SQLiteCache, SingleFlight, make_key
+from tracing_functions import span
+from cassette_functions import active_cassette
+from reference_store_functions import ReferenceStore, REFERENCE_MIN_COVERAGE, reference_key
+import threading
+import contextvars
+import time
+import re
+from dataclasses import dataclass, field, asdict
 from gpt_functions import *
 import streamlit as st
 
@@ -10,28 +21,409 @@ except:
                  st.secrets['SERP_API_KEY_2'],
                  st.secrets['SERP_API_KEY_3']]
 
+SERP_API_URL = "https://serpapi.com/search"
+SEARCH_MAX_WORKERS = 5  # Max number of searches running at the same time
+SEARCH_TIMEOUT = 30     # Seconds to wait for a single SerpAPI response
+
+SERP_KEY_RATE = 1.0       # Searches per second allowed per key
+SERP_KEY_BURST = 5        # Searches a key can start at once after being idle
+SERP_KEY_COOLDOWN = 60    # Seconds a rate-limited key is skipped (doubles on every consecutive 429)
+SERP_KEY_MAX_COOLDOWN = 3600  # Seconds a rejected (401) or exhausted key is skipped
+SERP_QUOTA_REFRESH = 200  # Searches between two reads of the searches left of every key (None never reads them)
+SERP_KEY_RESERVE = 10     # Keys with this many searches left or fewer are only used when no other key is healthy
+
+# Shared session so searches reuse pooled keep-alive connections
+serp_session = requests.Session()
+serp_session.mount("https://", HTTPAdapter(pool_maxsize=SEARCH_MAX_WORKERS))
+serp_session.mount("http://", HTTPAdapter(pool_maxsize=SEARCH_MAX_WORKERS))
+
+@dataclass(slots=True)
+class SearchResult:
+    """A Google Scholar hit, keeping only the fields used downstream"""
+    title: str
+    link: str
+    snippet: str = 'N/A'
+    publication_summary: str = 'N/A'
+    year: int | None = None  # Publication year, from the publication summary
+    citations: int = 0       # "Cited by" count
+
+    @classmethod
+    def from_serpapi(cls, hit):
+        """Parses one entry of the organic_results of a SerpAPI google_scholar response"""
+        summary = hit.get('publication_info', {}).get('summary', 'N/A')
+        years = re.findall(r'\b(?:19|20)\d{2}\b', summary)
+        return cls(
+            title=hit.get('title', ''),
+            link=hit.get('link', ''),
+            snippet=hit.get('snippet', 'N/A'),
+            publication_summary=summary,
+            year=int(years[-1]) if years else None,
+            citations=hit.get('inline_links', {}).get('cited_by', {}).get('total', 0) or 0
+        )
+
+    def to_prompt(self):
+        return f"""
+                Title: {self.title}
+                Link: {self.link}
+                Snippet: {self.snippet}
+                Publication Summary: {self.publication_summary}
+                """
+
+@dataclass(slots=True)
+class TopicResults:
+    """The search results of one topic from generate_queries()"""
+    topic: str
+    query: str
+    results: list = field(default_factory=list)  # SearchResult list
+
+    def to_prompt(self):
+        return f"Topic: {self.topic}\nResults:\n" + "".join(result.to_prompt() for result in self.results)
+
+class SerpKey:
+    """State of one SerpAPI key: token bucket, remaining searches and circuit breaker"""
+
+    def __init__(self, api_key, name, rate=SERP_KEY_RATE, burst=SERP_KEY_BURST):
+        self.api_key = api_key
+        self.name = name            # Shown in logs instead of the key itself
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.searches_left = None   # Unknown until refresh_quota() or an "out of searches" error
+        self.open_until = 0.0       # Circuit breaker: the key is skipped until then
+        self.failures = 0           # Consecutive 429/401 responses
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0           # 429/401 responses
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def healthy(self, now):
+        if self.searches_left == 0 or now < self.open_until:
+            return False
+        # Half-open circuit: a key that failed before gets one trial request at a time
+        return self.failures == 0 or self.in_flight == 0
+
+class SerpKeyPool:
+    """Spreads searches over several SerpAPI keys
+
+    Every key has its own token bucket (rate searches/second, up to burst at once). A search takes the healthy key
+    with the fewest searches in flight and the most tokens left, waiting for a token only when every healthy key is
+    out of them. 429 (rate limited / out of searches) and 401 (invalid key) responses open the key's circuit breaker,
+    so following searches go straight to the other keys instead of retrying the failing one first.
+    The searches left of every key are read before the first search and every refresh_every searches after that
+    (see refresh_quota()), keys close to the end of their quota are kept for when no other key is healthy.
+    """
+
+    def __init__(self, api_keys, rate=SERP_KEY_RATE, burst=SERP_KEY_BURST, cooldown=SERP_KEY_COOLDOWN, max_cooldown=SERP_KEY_MAX_COOLDOWN,
+                 refresh_every=SERP_QUOTA_REFRESH, reserve=SERP_KEY_RESERVE):
+        self.keys = [SerpKey(api_key, f"#{i + 1}", rate, burst) for i, api_key in enumerate(api_keys)]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.refresh_every = refresh_every
+        self.reserve = reserve
+        self.searches_since_refresh = None  # None until the quota was first read
+        self._refreshing = False
+        self._condition = threading.Condition()
+
+    def _refresh_if_due(self):
+        with self._condition:
+            due = (self.refresh_every is not None and not self._refreshing
+                   and (self.searches_since_refresh is None or self.searches_since_refresh >= self.refresh_every))
+            if not due:
+                return
+            self._refreshing = True
+            self.searches_since_refresh = 0
+        try:
+            self.refresh_quota()
+        finally:
+            with self._condition:
+                self._refreshing = False
+
+    def in_reserve(self, key):
+        return key.searches_left is not None and key.searches_left <= self.reserve
+
+    def acquire(self, exclude=(), timeout=None):
+        """Takes a token from the best key not in exclude
+
+        Output:
+        key (SerpKey): The key to search with, give it back with release(). None when no key is healthy or timeout passed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._refresh_if_due()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [key for key in self.keys if key not in exclude and key.healthy(now)]
+                if not candidates:
+                    return None
+                # Keys about to run out of searches wait while another key can search
+                candidates = [key for key in candidates if not self.in_reserve(key)] or candidates
+                for key in candidates:
+                    key.refill(now)
+                ready = [key for key in candidates if key.tokens >= 1]
+                if ready:
+                    key = min(ready, key=lambda key: (key.in_flight, -key.tokens))
+                    key.tokens -= 1
+                    key.in_flight += 1
+                    key.requests += 1
+                    self.searches_since_refresh = (self.searches_since_refresh or 0) + 1
+                    return key
+                wait = min((1 - key.tokens) / key.rate for key in candidates)
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait, deadline - now)
+                self._condition.wait(wait)
+
+    def release(self, key, response=None):
+        """Gives a key back, updating its quota and circuit breaker from the response (None when the request failed)"""
+        with self._condition:
+            key.in_flight -= 1
+            status = response.status_code if response is not None else None
+            if status == 200:
+                key.failures = 0
+                if key.searches_left is not None:
+                    key.searches_left = max(0, key.searches_left - 1)
+            elif status in (401, 429):
+                key.failures += 1
+                key.rejected += 1
+                if status == 401:
+                    cooldown = self.max_cooldown
+                elif "run out of searches" in response.text:
+                    key.searches_left = 0
+                    cooldown = self.max_cooldown
+                else:
+                    cooldown = _retry_after(response) or self.cooldown * 2 ** (key.failures - 1)
+                key.open_until = time.monotonic() + min(cooldown, self.max_cooldown)
+            self._condition.notify_all()
+
+    def refresh_quota(self, session=None, timeout=SEARCH_TIMEOUT):
+        """Reads the searches left of every key from the SerpAPI Account API, which does not use up searches"""
+        session = session or serp_session
+        # The Account API is next to the search endpoint (https://serpapi.com/account.json)
+        account_url = SERP_API_URL.rsplit("/", 1)[0] + "/account.json"
+        for key in self.keys:
+            try:
+                response = session.get(account_url, params={"api_key": key.api_key}, timeout=timeout)
+                response.raise_for_status()
+                account = response.json()
+            except Exception as e:
+                print(f"Could not read the quota of SerpAPI key {key.name}: {e}")
+                continue
+            searches_left = account.get('total_searches_left', account.get('plan_searches_left'))
+            if searches_left is None:
+                continue
+            with self._condition:
+                key.searches_left = searches_left
+                if key.searches_left:
+                    key.open_until = 0.0
+                    key.failures = 0
+                self._condition.notify_all()
+
+    def stats(self):
+        """Requests, rejections, remaining searches and circuit state of every key"""
+        with self._condition:
+            now = time.monotonic()
+            return {key.name: {
+                "requests": key.requests,
+                "rejected": key.rejected,
+                "in_flight": key.in_flight,
+                "searches_left": key.searches_left,
+                "circuit": "closed" if key.failures == 0 else ("open" if now < key.open_until else "half-open"),
+            } for key in self.keys}
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+serp_key_pool = SerpKeyPool(SERP_KEYS)
+
+def configure_serp_keys(api_keys=None, rate=SERP_KEY_RATE, burst=SERP_KEY_BURST, cooldown=SERP_KEY_COOLDOWN, max_cooldown=SERP_KEY_MAX_COOLDOWN,
+                        refresh_every=SERP_QUOTA_REFRESH, reserve=SERP_KEY_RESERVE):
+    """Replace the SerpAPI key pool, whose quota is read before its first search
+
+    Params:
+        api_keys (list): SerpAPI keys, defaults to SERP_KEYS
+        rate (float): Searches per second allowed per key
+        burst (int): Searches a key can start at once after being idle
+        cooldown (float): Seconds a rate-limited key is skipped when the 429 has no Retry-After header
+        max_cooldown (float): Seconds a rejected (401) or exhausted key is skipped
+        refresh_every (int): Searches between two reads of the searches left of every key, None never reads them
+        reserve (int): Keys with this many searches left or fewer are only used when no other key is healthy
+    """
+    global serp_key_pool
+    serp_key_pool = SerpKeyPool(api_keys or SERP_KEYS, rate, burst, cooldown, max_cooldown, refresh_every, reserve)
+
+def parse_search_results(response):
+    """Parses a SerpAPI google_scholar response into a list of SearchResult"""
+    return [SearchResult.from_serpapi(hit) for hit in response.get('organic_results', [])]
+
+# Cache of search results shared by every session, see configure_search_cache()
+search_cache = SQLiteCache(".cache/search_cache.sqlite", ttl=7*24*3600, max_entries=5000, table="search_results")
+search_flight = SingleFlight()
+_search_stats = {"upstream_requests": 0, "upstream_seconds": 0.0, "saved_seconds": 0.0, "local_answers": 0}
+_search_stats_lock = threading.Lock()
+
+def configure_search_cache(path=".cache/search_cache.sqlite", ttl=7*24*3600, max_entries=5000):
+    """Replace the search cache. path=None disables caching (concurrent identical searches are still deduplicated)
+
+    Params:
+        path (str): SQLite file of the cache, ":memory:" keeps it in this process only
+        ttl (float): Seconds a cached search stays valid
+        max_entries (int): Max number of cached searches, least recently used are evicted first
+    """
+    global search_cache
+    search_cache = SQLiteCache(path, ttl=ttl, max_entries=max_entries, table="search_results") if path else None
+
+# Opt-in local index of every hit retrieved so far, see configure_reference_store()
+reference_store = None
+reference_min_coverage = REFERENCE_MIN_COVERAGE
+reference_language = "en"
+
+def configure_reference_store(path=".cache/references", min_coverage=None, language="en"):
+    """Answer searches from the references retrieved by earlier searches when enough of them match (path=None disables it)
+
+    A search is answered from the store alone when it has num_results good matches (see ReferenceStore.search()),
+    otherwise Google Scholar is searched and its hits fill the places after the local matches. Every hit returned
+    by Google Scholar is added to the store. When Google Scholar fails, the local matches found are returned.
+
+    Params:
+        path (str): Folder of the store
+        min_coverage (float): Share of the query a stored reference must match, default REFERENCE_MIN_COVERAGE
+        language (str): Language of the searches the store answers and keeps, searches in other languages skip it
+    """
+    global reference_store, reference_min_coverage, reference_language
+    reference_store = ReferenceStore(path) if path else None
+    reference_min_coverage = min_coverage if min_coverage is not None else REFERENCE_MIN_COVERAGE
+    reference_language = language
+
+def search_cache_stats():
+    """Cache, deduplication and reference store counters, with the SerpAPI credits and seconds they saved"""
+    stats = search_cache.stats() if search_cache is not None else {"hits": 0, "misses": 0}
+    with _search_stats_lock:
+        stats.update(_search_stats)
+    stats["deduplicated"] = search_flight.shared
+    stats["saved_credits"] = stats["hits"] + search_flight.shared + stats["local_answers"]
+    return stats
+
+def _search_cache_key(query, num_results, language, as_ylo):
+    normalized_query = " ".join(query.lower().split())
+    return make_key(normalized_query, as_ylo, language, num_results)
+
 # Input search queries to search in Google Scholar
-def search_google_scholar(query, num_results=3,language = 'en',as_ylo = 2020):
+def search_google_scholar(query, num_results=3,language = 'en',as_ylo = 2020, timeout=SEARCH_TIMEOUT, use_cache=True):
     """
     Params:
     query (str): The search query
     num_results (int): Number of results to return
     language (str): Two-letter code for desired language (i.e. "en" for English, "tl" for Tagalog/Filipino)
     as_ylo (int): The year of the last publication to be returned
+    timeout (float): Seconds to wait for the SerpAPI response
+    use_cache (bool): Set to False to skip the search cache and the reference store
+
+    Output:
+    results (list): The hits as SearchResult objects
     """
-    for api_key in SERP_KEYS:
+    with span("search_google_scholar", "search", query=query, num_results=num_results) as current:
+        cassette = active_cassette()
+        if cassette is not None:
+            # Recordings hold real searches, so the cache is skipped while a cassette is in use
+            current.set(cassette=cassette.mode)
+            request = {"query": query, "num_results": num_results, "language": language, "as_ylo": as_ylo}
+            results = cassette.call("search", _search_cache_key(query, num_results, language, as_ylo), request, lambda: [
+                asdict(result) for result in _search_google_scholar(query, num_results, language, as_ylo, timeout, False, current)
+            ])
+            results = [SearchResult(**result) for result in results]
+        elif use_cache and reference_store is not None and language == reference_language:
+            results = _search_with_reference_store(query, num_results, language, as_ylo, timeout, current)
+        else:
+            results = _search_google_scholar(query, num_results, language, as_ylo, timeout, use_cache, current)
+        current.set(results=len(results))
+        return results
+
+def _search_with_reference_store(query, num_results, language, as_ylo, timeout, current):
+    store = reference_store
+    local = [SearchResult(**{field: match[field] for field in SearchResult.__slots__})
+             for match in store.search(query, num_results, as_ylo, reference_min_coverage)]
+    current.set(local_results=len(local))
+    if len(local) >= num_results:
+        with _search_stats_lock:
+            _search_stats["local_answers"] += 1
+        return local
+    # Not enough good local matches: Google Scholar fills the places after them
+    try:
+        results = _search_google_scholar(query, num_results, language, as_ylo, timeout, True, current)
+    except Exception as e:
+        if not local:
+            raise
+        print(f"Error searching for '{query}', returning its {len(local)} local matches: {e}")
+        current.set(degraded=True)
+        return local
+    store.add([asdict(result) for result in results])
+    seen = {reference_key(asdict(result)) for result in local}
+    return local + [result for result in results if reference_key(asdict(result)) not in seen][:num_results - len(local)]
+
+def _search_google_scholar(query, num_results, language, as_ylo, timeout, use_cache, current):
+    key = _search_cache_key(query, num_results, language, as_ylo)
+    cache = search_cache if use_cache else None
+    if cache is not None:
+        cached = cache.get(key)
+        current.set(cache_hit=cached is not None)
+        if cached is not None:
+            with _search_stats_lock:
+                _search_stats["saved_seconds"] += cached['seconds']
+            return [SearchResult(**result) for result in cached['results']]
+
+    def search():
+        # Only the caller that sends the request gets upstream=True, deduplicated callers share its results
+        current.set(upstream=True)
+        start = time.perf_counter()
+        response = _search_google_scholar_upstream(query, num_results, language, as_ylo, timeout)
+        seconds = time.perf_counter() - start
+        with _search_stats_lock:
+            _search_stats["upstream_requests"] += 1
+            _search_stats["upstream_seconds"] += seconds
+        if response is None:
+            raise RuntimeError(f"No SerpAPI key could search for '{query}'")
+        results = parse_search_results(response)
+        if cache is not None and 'error' not in response:
+            cache.set(key, {"results": [asdict(result) for result in results], "seconds": seconds})
+        return results
+
+    # Identical searches running at the same time share one upstream request
+    return search_flight.do(key, search)
+
+def _search_google_scholar_upstream(query, num_results, language, as_ylo, timeout):
+    # Every key is tried at most once, the pool hands out the healthiest one first
+    tried = set()
+    while True:
+        key = serp_key_pool.acquire(exclude=tried, timeout=timeout)
+        if key is None:
+            return None
+        tried.add(key)
+
         # Set up the search parameters
         params = {
             "engine": "google_scholar",
             "q": query,  # Your search query
-            "api_key": api_key,
+            "api_key": key.api_key,
             "as_ylo": as_ylo,
             "hl":language,
             'num': num_results
         }
 
         # Make the API request
-        response = requests.get("https://serpapi.com/search", params=params)
+        try:
+            response = serp_session.get(SERP_API_URL, params=params, timeout=timeout)
+        except Exception:
+            serp_key_pool.release(key)
+            raise
+        serp_key_pool.release(key, response)
 
         # Check if the request was successful
         if response.status_code == 200:
@@ -39,7 +431,29 @@ def search_google_scholar(query, num_results=3,language = 'en',as_ylo = 2020):
             results = response.json()
             return results
         else:
-            print(f"Failed to retrieve data for API KEY {i}:", response.status_code)
-            i+=1
+            print(f"Failed to retrieve data for API KEY {key.name}:", response.status_code)
+
+# Run several Google Scholar searches at the same time
+def search_google_scholar_many(queries, num_results=3, language='en', as_ylo=2020, max_workers=SEARCH_MAX_WORKERS, timeout=SEARCH_TIMEOUT):
+    """
+    Params:
+    queries (list): The search queries
+    max_workers (int): Max number of searches running at the same time
+    timeout (float): Seconds to wait for each SerpAPI response
+    Other params are the same as search_google_scholar()
 
+    Output:
+    results (list): One SearchResult list per query in the same order as queries. Failed searches return the exception instead
+    """
+    def search(query):
+        try:
+            return search_google_scholar(query, num_results, language, as_ylo, timeout=timeout)
+        except Exception as e:
+            return e
 
+    if not queries:
+        return []
+    # Each search runs in a copy of this context, so its span is a child of the current one
+    contexts = [contextvars.copy_context() for _ in queries]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        return list(executor.map(lambda context, query: context.run(search, query), contexts, queries))
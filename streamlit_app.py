@@ -1,5 +1,5 @@
 import streamlit as st
-from app_functions import *
+from jobs_functions import *
 import os
 import json
 import time
@@ -18,6 +18,12 @@ if 'default_description' not in st.session_state:
     st.session_state.default_description = None
 if 'doc_buffer' not in st.session_state:
     st.session_state.doc_buffer = None
+if 'stage_memo' not in st.session_state:
+    # Results of the stages of earlier runs, so an edit only reruns the stages it affects
+    st.session_state.stage_memo = StageMemo(STAGE_MEMO_PATH)
+if 'job_id' not in st.session_state:
+    # A reloaded page starts a new session, the id in the URL reattaches it to its job
+    st.session_state.job_id = st.query_params.get("job")
 
 # Logo
 left_co, cent_co,last_co = st.columns(3)
@@ -53,71 +59,66 @@ with st.sidebar:
     with st.expander("PROCESS INPUTS", True):
         citation_style = st.selectbox("Citation Style", ["APA", "MLA", "Chicago", "Harvard"])
         model = st.selectbox('Choose gpt model',['gpt-4o','gpt-4-turbo','gpt-3.5-turbo'])
+        profile = st.selectbox('Model profile', list(ROUTING_PROFILES), help="'default' uses the chosen model for every stage, the others route each stage to its own model and token cap")
         document_title = st.text_input("Output Title",placeholder='Course_Outline.docx')
     st.write("*This app was designed on Streamlit by Jun Albert S. Pardillo (2024).*")
 
 if st.button("GENERATE COURSE OUTLINE",use_container_width=True):
-    
-    if course_title and course_description is None:
-        st.session_state.default_description = generate_description(course_title,target_students)
- 
-    # Combing the course details into a single string
-    course_details = f"""Course Title: {course_title}
-    Course Description: {course_description}
-    Instructor Name: {instructor_name}
-    Credit Units: {credit_units}
-    Target Students: {target_students}
-    Total Hours: {total_hours}
-    Class Hours per Week: {weekly_hours}"""
-
-    st.session_state.start_time = time.time()
-
-    with st.spinner("Generating Search Queries..."):
-        # Genereate topics and search queries
-        queries =  generate_queries(course_details=course_details)
-    st.success("Queries Generated")
-
-    with st.spinner("Searching Online for Reference Materials..."):
-        # Get Search Results from Google Scholar
-        total_search_results = get_search_results(json.loads(queries))
-    st.success("Search Results Generated")
-
-    with st.spinner("Generating Learning Outcomes..."):
-        # Get Learning Outcomes from GPT-4
-        st.session_state.learning_outcomes = generate_learning_outcomes(
-            course_details=course_details, 
-            total_search_results=total_search_results, 
-            citation_style=citation_style,
-            model=model
-        )
-
-    if st.session_state.learning_outcomes:
-        st.success("Learning Outcomes Generated")
-    else:
-        st.error("Learning Outcomes failed")
-    learning_outcomes = st.session_state.learning_outcomes
-
-
-    with st.spinner("Generating Course Outline..."):
-        # Generate Course Outline
-        course_outline = generate_course_outline(
-            course_details=course_details, 
-            learning_outcomes=learning_outcomes, 
-            total_hours=total_hours, 
-            weekly_hours=weekly_hours,
-            model=model
-        ) 
-        course_outline_json = json.loads(course_outline)
+    # The pipeline runs as a background job, this script run only submits it
+    st.session_state.job_id = submit_job({
+        "course_title": course_title,
+        "course_description": course_description,
+        "instructor_name": instructor_name,
+        "credit_units": credit_units,
+        "target_students": target_students,
+        "total_hours": total_hours,
+        "weekly_hours": weekly_hours,
+        "citation_style": citation_style,
+        "model": model,
+        "profile": profile,
+        "document_title": document_title
+    }, memo=st.session_state.stage_memo)
+    st.query_params["job"] = st.session_state.job_id
+    st.session_state.output_file_name = None
 
-    # Create word document from course outline json
-    st.session_state.doc_buffer = create_word_document_from_json(course_outline_json, title=document_title, streamlit=True)
-    
-    if document_title == '':
-        document_title = f"{course_title.replace(' ','_')}_{instructor_name.replace(' ','_')}_Course_Outline"
-    st.session_state.output_file_name = f"{document_title}.docx"
-    end_time = time.time()
-    st.session_state.execution_time = end_time - st.session_state.start_time
-    st.session_state.start_time = None
+# Follow the job of this session, or of the page before it was reloaded
+if st.session_state.job_id:
+    job = get_job(st.session_state.job_id)
+    if job is None:
+        st.warning("The course outline job could not be found, please generate it again")
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+    elif job["status"] in ("queued", "running"):
+        # Stage progress and the learning outcomes so far, refreshed every JOB_POLL_INTERVAL seconds
+        running = [stage for stage, status in job["stages"].items() if status == "started"]
+        label = PIPELINE_STAGE_MESSAGES[running[-1]][0] if running else "Waiting for a free worker..."
+        with st.status(label, expanded=True):
+            for stage, status in job["stages"].items():
+                if status == "done":
+                    st.write(PIPELINE_STAGE_MESSAGES[stage][1])
+                elif status == "reused":
+                    st.write(f"{PIPELINE_STAGE_MESSAGES[stage][1]} (reused from the previous run)")
+        if job["learning_outcomes"]:
+            st.subheader("Learning Outcomes")
+            st.write(job["learning_outcomes"])
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+    elif job["status"] == "failed":
+        st.error(f"Course outline generation failed: {job['error']}")
+        # A reload shouldn't reattach to the failed job and show the error again
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+    elif st.session_state.get("loaded_job_id") != job["id"]:
+        st.session_state.loaded_job_id = job["id"]
+        st.session_state.learning_outcomes = job["learning_outcomes"]
+        if not st.session_state.learning_outcomes:
+            st.error("Learning Outcomes failed")
+        if job["course_description"]:
+            st.session_state.default_description = job["course_description"]
+        st.session_state.doc_buffer = job_document(job)
+        st.session_state.output_file_name = job["output_file_name"]
+        st.session_state.execution_time = job["execution_time"]
+        st.session_state.reused_stages = job["reused"]
 
 
 # Once process is finished, provide output
@@ -129,6 +130,9 @@ if st.session_state.output_file_name:
     mins = round((st.session_state.execution_time // 60),0)
     secs = round((st.session_state.execution_time % 60),0)
     st.write(f"Execution Time: {int(mins)} minutes and {int(secs)} seconds")
+    if st.session_state.get("reused_stages"):
+        reused = ", ".join(PIPELINE_STAGE_MESSAGES[stage][1] for stage in st.session_state.reused_stages)
+        st.caption(f"Reused from the previous run (inputs unchanged): {reused}")
     btn = st.download_button(
         label="Download Course Outline",
         data=st.session_state.doc_buffer,
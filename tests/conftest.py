@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The modules are at the root of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The modules read their keys from api_keys.toml in the working directory when they are imported, so the tests run
+# in a folder with test keys (never the real ones, and the caches they write stay out of the repository)
+TEST_KEYS = 'OPENAI_API_KEY = "test"\nSERP_API_KEY = "test-1"\nSERP_API_KEY_2 = "test-2"\nSERP_API_KEY_3 = "test-3"\n'
+os.chdir(tempfile.mkdtemp(prefix="curriculumgpt-tests-"))
+with open("api_keys.toml", "w") as f:
+    f.write(TEST_KEYS)
+
+import gpt_functions
+import search_functions
+from benchmark_functions import start_fake_server, FakeOpenAIHandler, FakeSerpAPIHandler
+
+
+@pytest.fixture
+def fake_openai():
+    """Fake OpenAI server of benchmark_functions.py answering the gpt_response() calls"""
+    server, url = start_fake_server(FakeOpenAIHandler)
+    gpt_functions.configure_client(base_url=url)
+    yield server
+    gpt_functions.configure_client(base_url=None)
+    server.shutdown()
+
+@pytest.fixture
+def fake_serpapi(monkeypatch):
+    """Fake SerpAPI server of benchmark_functions.py answering the searches, with the search cache off"""
+    server, url = start_fake_server(FakeSerpAPIHandler)
+    monkeypatch.setattr(search_functions, "SERP_API_URL", url + "/search")
+    monkeypatch.setattr(search_functions, "search_cache", None)
+    yield server
+    server.shutdown()
@@ -0,0 +1,64 @@
+import re
+import json
+import pytest
+import app_functions
+
+
+TOPIC = {"topic": "Neural networks", "ilos": ["Train a neural network"]}
+
+def activities_response(first_week, count):
+    return json.dumps({"activities": [
+        {"week": f"Week {first_week + i}", "topic": TOPIC['topic'], "activity_description": "Lab",
+         "expected_output": "Notebook", "assessment_tools": "Rubric"}
+        for i in range(count)
+    ]})
+
+def fake_gpt_response(monkeypatch, counts):
+    """Answers the calls of generate_topic_activities() with counts[i] activities on the i-th call"""
+    calls = []
+
+    def gpt_response(prompt, use_cache=True, **params):
+        calls.append(use_cache)
+        return activities_response(7, counts[len(calls) - 1])
+
+    monkeypatch.setattr(app_functions, "gpt_response", gpt_response)
+    return calls
+
+def test_topic_activities_have_one_row_per_week(monkeypatch):
+    fake_gpt_response(monkeypatch, [6])
+    activities = app_functions.generate_topic_activities("details", "outcomes", TOPIC, 7, 12)
+    assert [activity['week'] for activity in activities] == [f"Week {week}" for week in range(7, 13)]
+
+def test_topic_activities_missing_a_week_are_generated_again(monkeypatch):
+    calls = fake_gpt_response(monkeypatch, [5, 6])
+    activities = app_functions.generate_topic_activities("details", "outcomes", TOPIC, 7, 12)
+    assert len(activities) == 6
+    # The retry doesn't get the short answer back from the cache
+    assert calls == [True, False]
+
+def test_topic_activities_with_the_wrong_count_raise(monkeypatch):
+    calls = fake_gpt_response(monkeypatch, [5, 7, 5])
+    with pytest.raises(ValueError, match="5 activities for its 6 weeks"):
+        app_functions.generate_topic_activities("details", "outcomes", TOPIC, 7, 12)
+    assert len(calls) == app_functions.ACTIVITY_ATTEMPTS
+
+def course_plan(weeks):
+    topics = [{"topic": f"Topic {i + 1}", "ilos": ["ILO"]} for i in range(len(weeks))]
+    for topic, topic_weeks in zip(topics, weeks):
+        if topic_weeks is not None:
+            topic['weeks'] = topic_weeks
+    return json.dumps({"course_title": "ML", "course_description": "ML", "instructor_name": "", "credit_units": 3,
+                       "total_hours": 72, "weekly_hours": 3, "clos": ["CLO"], "topics": topics, "references": []})
+
+@pytest.mark.parametrize("weeks", [["3", "1"], [3, None], ["three", 1], [0, -2], [2.0, "1"]])
+def test_fan_out_accepts_weeks_that_arent_integers(monkeypatch, weeks):
+    def gpt_response(prompt, use_cache=True, **params):
+        if "Plan the weeks" in prompt:
+            return course_plan(weeks)
+        first_week, last_week = map(int, re.search(r"Week (\d+) to Week (\d+)", prompt).groups())
+        return activities_response(first_week, last_week - first_week + 1)
+
+    monkeypatch.setattr(app_functions, "gpt_response", gpt_response)
+    outline = json.loads(app_functions.generate_course_outline_fan_out("details", "outcomes", 72, 3, model='gpt-4-turbo'))
+    assert [activity['week'] for activity in outline['activities']] == [f"Week {week}" for week in range(1, 25)]
+    assert all('weeks' not in topic for topic in outline['topics'])
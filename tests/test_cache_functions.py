@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+from cache_functions import SQLiteCache
+from conftest import TEST_KEYS
+
+
+def test_cache_file_is_created_on_first_use(tmp_path):
+    path = tmp_path / "cache" / "search_cache.sqlite"
+    cache = SQLiteCache(str(path), table="search_results")
+    assert not path.exists()
+    assert len(cache) == 0 and cache.stats()["entries"] == 0
+    assert not path.exists()
+
+    cache.set("key", {"results": []})
+    assert path.exists()
+    assert cache.get("key") == {"results": []}
+    assert len(SQLiteCache(str(path), table="search_results")) == 1
+
+def test_importing_the_search_module_writes_nothing(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # The keys are read from api_keys.toml in the working directory
+    (tmp_path / "api_keys.toml").write_text(TEST_KEYS)
+    subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {root!r}); import search_functions"],
+                   cwd=tmp_path, check=True, capture_output=True)
+    assert not (tmp_path / ".cache").exists()
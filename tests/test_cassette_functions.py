@@ -0,0 +1,32 @@
+import asyncio
+from cassette_functions import use_cassette
+from gpt_functions import gpt_response, agpt_response
+
+
+def test_streamed_recording_replays_as_text(fake_openai, tmp_path):
+    path = str(tmp_path / "cassette.json")
+    with use_cassette(path, mode="record"):
+        streamed = "".join(gpt_response("Hello", stream=True))
+
+    with use_cassette(path) as cassette:
+        assert gpt_response("Hello") == streamed
+        assert asyncio.run(agpt_response("Hello")) == streamed
+        assert cassette.played == 2
+
+def test_text_recording_replays_as_a_stream(fake_openai, tmp_path):
+    path = str(tmp_path / "cassette.json")
+    with use_cassette(path, mode="record"):
+        text = gpt_response("Hello")
+
+    with use_cassette(path):
+        assert list(gpt_response("Hello", stream=True)) == [text]
+
+def test_replay_makes_no_requests(fake_openai, tmp_path):
+    path = str(tmp_path / "cassette.json")
+    with use_cassette(path, mode="record"):
+        text = gpt_response("Hello")
+    requests = len(fake_openai.requests)
+
+    with use_cassette(path):
+        assert gpt_response("Hello") == text
+    assert len(fake_openai.requests) == requests
@@ -0,0 +1,22 @@
+import os
+import json
+import pytest
+import catalog_functions
+from catalog_functions import COURSE_DEFAULTS, course_id, run_catalog
+
+
+def test_manifest_totals_count_every_llm_call_once(fake_openai, fake_serpapi, tmp_path):
+    course = {**COURSE_DEFAULTS, "course_title": "Introduction to Machine Learning"}
+    course['id'] = course_id(course)
+
+    report = run_catalog([course], str(tmp_path))
+    assert report['done'] == 1
+    with open(os.path.join(tmp_path, "manifest.jsonl"), encoding='utf-8') as f:
+        [record] = map(json.loads, f)
+    assert len(fake_openai.usage) > 1
+    assert record['prompt_tokens'] == sum(usage['prompt_tokens'] for usage in fake_openai.usage)
+    assert record['completion_tokens'] == sum(usage['completion_tokens'] for usage in fake_openai.usage)
+    assert record['cost_usd'] == pytest.approx(sum(
+        catalog_functions.estimate_cost(body['model'], usage['prompt_tokens'], usage['completion_tokens'])
+        for body, usage in zip(fake_openai.requests, fake_openai.usage)
+    ), abs=1e-6)
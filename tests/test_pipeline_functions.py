@@ -0,0 +1,50 @@
+import re
+
+from pipeline_functions import run_outline_pipeline, StageMemo
+
+
+COURSE_DETAILS = "Course Title: Introduction to Machine Learning\nTotal Hours: 54\nClass Hours per Week: 3"
+
+def same_hits(query, num_results):
+    # Every topic's search returns the same hits, so all topics after the first one only have duplicates
+    return [{"position": i, "title": f"Machine learning handbook {i + 1}", "link": f"https://example.org/{i + 1}",
+             "snippet": "A handbook of machine learning.", "publication_info": {"summary": "A Author - 2024 - books.google.com"},
+             "inline_links": {"cited_by": {"total": 500}}}
+            for i in range(num_results)]
+
+def filter_prompts(server):
+    return [body['messages'][-1]['content'] for body in server.requests
+            if "Filter out sources that aren't ideal" in body['messages'][-1]['content']]
+
+def test_topics_with_only_duplicate_hits_are_skipped_not_failed(fake_openai, fake_serpapi):
+    fake_openai.topics = 3
+    fake_serpapi.scholar_hits = same_hits
+    memo = StageMemo()
+
+    outcome = run_outline_pipeline(COURSE_DETAILS, model='gpt-4o', streamlit=True, memo=memo)
+    assert outcome['references']['failed_topics'] == 0
+    assert "https://example.org/1" in outcome['references']['filtered_search_results']
+    assert all("Link:" in prompt for prompt in filter_prompts(fake_openai))
+
+    # The topics weren't counted as failed, so the references are reused
+    assert "references" in run_outline_pipeline(COURSE_DETAILS, model='gpt-4o', streamlit=True, memo=memo)['reused']
+
+def test_duplicate_hits_are_dropped_when_merging_topics(fake_openai, fake_serpapi):
+    fake_openai.topics = 3
+    fake_openai.suitable_links = {"https://example.org/1", "https://example.org/2"}
+    fake_serpapi.scholar_hits = same_hits
+
+    outcome = run_outline_pipeline(COURSE_DETAILS, model='gpt-4o', streamlit=True, prerank=False)
+    assert outcome['references']['failed_topics'] == 0
+    assert len(filter_prompts(fake_openai)) == 3
+    for key in ("total_search_results", "filtered_search_results"):
+        assert outcome['references'][key].count("https://example.org/1") == 1
+        assert outcome['references'][key].count("https://example.org/2") == 1
+
+def test_a_slow_search_doesnt_hold_back_the_other_filters(fake_openai, fake_serpapi):
+    fake_openai.topics = 3
+    fake_serpapi.query_latency = {"query 1": 0.5}
+
+    run_outline_pipeline(COURSE_DETAILS, model='gpt-4o', streamlit=True, prerank=False)
+    topics = [re.search(r"Topic \d", prompt).group(0) for prompt in filter_prompts(fake_openai)]
+    assert topics[-1] == "Topic 1"
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+import openai
+import pytest
+import resilience_functions
+
+
+def rate_limit_error(headers):
+    # Only the fields read by is_retryable() and retry_after(), without building an HTTP response
+    error = openai.RateLimitError.__new__(openai.RateLimitError)
+    error.status_code = 429
+    error.code = None
+    error.response = SimpleNamespace(headers=headers)
+    return error
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"retry-after": "2"}, 2.0),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+    ({"retry-after": "garbage"}, None),
+    ({}, None),
+])
+def test_retry_after(headers, expected):
+    assert resilience_functions.retry_after(rate_limit_error(headers)) == expected
+
+def test_malformed_retry_after_uses_the_backoff(monkeypatch):
+    monkeypatch.setitem(resilience_functions.RETRY_SETTINGS, "base_delay", 0.5)
+    delay = resilience_functions.retry_delay(0, rate_limit_error({"retry-after": "garbage"}))
+    assert 0 <= delay <= 0.5
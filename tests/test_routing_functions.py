@@ -0,0 +1,20 @@
+import pytest
+from routing_functions import route, use_profile
+
+
+def test_default_profile_keeps_the_callers_model_and_caps():
+    assert route("filter", "gpt-4", input_tokens=100) == {"model": "gpt-4", "max_tokens": 4000, "temperature": 0.5}
+
+def test_other_profiles_cap_the_filter_to_its_input():
+    with use_profile("fast"):
+        assert route("filter", "gpt-4", input_tokens=100)['max_tokens'] == 320
+
+def test_caps_grow_with_the_weeks_up_to_the_model_limit():
+    with use_profile("quality"):
+        assert route("activities", None, weeks=4)['max_tokens'] == 400 + 4 * 300
+        assert route("course_outline", None, weeks=1000)['max_tokens'] == 16384
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        with use_profile("cheapest"):
+            pass
@@ -0,0 +1,147 @@
+import time
+from types import SimpleNamespace
+import pytest
+import search_functions
+from search_functions import SerpKeyPool, search_google_scholar, search_google_scholar_many
+from reference_store_functions import ReferenceStore
+
+
+@pytest.fixture
+def key_pool(monkeypatch):
+    """Pool of two keys, k1 and k2, fast enough not to wait for tokens and without a reserve of searches"""
+    pool = SerpKeyPool(["k1", "k2"], rate=100, burst=100, cooldown=0.2, max_cooldown=60, reserve=0)
+    monkeypatch.setattr(search_functions, "serp_key_pool", pool)
+    return pool
+
+def used_keys(server):
+    return [params['api_key'] for params in server.requests]
+
+def test_concurrent_searches_keep_the_order_of_the_queries(fake_serpapi, key_pool):
+    queries = [f"query {i}" for i in range(8)]
+    # The first queries answer last
+    fake_serpapi.query_latency = {query: 0.05 * (len(queries) - i) for i, query in enumerate(queries)}
+
+    start = time.perf_counter()
+    results = search_google_scholar_many(queries, num_results=3, max_workers=8)
+    # Run at the same time: about as long as the slowest search, not the sum of them
+    assert time.perf_counter() - start < sum(fake_serpapi.query_latency.values()) / 2
+    assert [search_results[0].title for search_results in results] == [f"{query} result 1" for query in queries]
+
+def test_failed_searches_keep_their_place(fake_serpapi, key_pool):
+    def scholar_hits(query, num_results):
+        if query == "query 1":
+            raise RuntimeError("Fake SerpAPI failure")
+        return [{"title": f"{query} result 1", "link": f"https://example.org/{query}"}]
+
+    fake_serpapi.scholar_hits = scholar_hits
+    results = search_google_scholar_many(["query 0", "query 1", "query 2"], num_results=3)
+    assert results[0][0].title == "query 0 result 1"
+    assert isinstance(results[1], Exception)
+    assert results[2][0].title == "query 2 result 1"
+
+@pytest.mark.parametrize("status", [401, 429])
+def test_search_fails_over_to_the_next_key(fake_serpapi, key_pool, status):
+    fake_serpapi.key_errors = {"k1": status}
+    results = search_google_scholar("query 0", num_results=3)
+    assert len(results) == 3
+    assert used_keys(fake_serpapi) == ["k1", "k2"]
+    assert key_pool.stats()["#1"]["circuit"] == "open"
+
+    # The failing key is skipped by the following searches
+    search_google_scholar("query 1", num_results=3)
+    assert used_keys(fake_serpapi) == ["k1", "k2", "k2"]
+
+def test_exhausted_key_is_taken_out_of_use(fake_serpapi, key_pool):
+    key_pool.keys[0].searches_left = 1
+    for i in range(4):
+        search_google_scholar(f"query {i}", num_results=3)
+    assert key_pool.stats()["#1"]["searches_left"] == 0
+    assert used_keys(fake_serpapi) == ["k1", "k2", "k2", "k2"]
+
+def test_quota_is_read_before_the_first_search(fake_serpapi, key_pool):
+    fake_serpapi.searches_left = {"k1": 0, "k2": 50}
+    search_google_scholar("query 0", num_results=3)
+    assert [params['api_key'] for params in fake_serpapi.account_requests] == ["k1", "k2"]
+    # k1 had no searches left, so it was never tried
+    assert used_keys(fake_serpapi) == ["k2"]
+    assert key_pool.stats()["#2"]["searches_left"] == 49
+
+def test_key_with_few_searches_left_is_avoided_before_it_errors(fake_serpapi, monkeypatch):
+    pool = SerpKeyPool(["k1", "k2"], rate=100, burst=100, refresh_every=5, reserve=3)
+    monkeypatch.setattr(search_functions, "serp_key_pool", pool)
+    # k1 would be picked first, but is about to run out
+    fake_serpapi.searches_left = {"k1": 2, "k2": 1000}
+    for i in range(3):
+        search_google_scholar(f"query {i}", num_results=3)
+    assert used_keys(fake_serpapi) == ["k2", "k2", "k2"]
+
+    # k2 runs out after 2 more searches, the refresh after the 5th search finds it out and k1 takes over
+    fake_serpapi.searches_left["k2"] = 2
+    for i in range(3, 7):
+        search_google_scholar(f"query {i}", num_results=3)
+    assert used_keys(fake_serpapi) == ["k2"] * 5 + ["k1", "k1"]
+    assert len(fake_serpapi.account_requests) == 4
+
+def test_key_out_of_searches_is_taken_out_of_use(fake_serpapi, key_pool):
+    # SerpAPI answers 429 "Your account has run out of searches."
+    fake_serpapi.key_errors = {"k1": 429}
+    search_google_scholar("query 0", num_results=3)
+    assert key_pool.stats()["#1"]["searches_left"] == 0
+    assert key_pool.keys[0].open_until - time.monotonic() > 30
+
+def test_circuit_opens_then_half_opens():
+    pool = SerpKeyPool(["k1"], rate=100, burst=100, cooldown=0.2, refresh_every=None)
+    rate_limited = SimpleNamespace(status_code=429, text="Too many requests", headers={})
+
+    key = pool.acquire()
+    pool.release(key, rate_limited)
+    assert pool.stats()["#1"]["circuit"] == "open"
+    assert pool.acquire(timeout=0) is None
+
+    time.sleep(0.25)
+    assert pool.stats()["#1"]["circuit"] == "half-open"
+    # One trial request at a time while half-open
+    trial = pool.acquire(timeout=0)
+    assert trial is key
+    assert pool.acquire(timeout=0) is None
+
+    # A failed trial opens the circuit again, for twice the cooldown
+    pool.release(trial, rate_limited)
+    assert pool.stats()["#1"]["circuit"] == "open"
+    assert 0.3 < key.open_until - time.monotonic() <= 0.4
+
+    key.open_until = 0.0
+    pool.release(pool.acquire(), SimpleNamespace(status_code=200, text="", headers={}))
+    assert pool.stats()["#1"]["circuit"] == "closed"
+
+def test_circuit_uses_retry_after():
+    pool = SerpKeyPool(["k1"], rate=100, burst=100, cooldown=0.2, refresh_every=None)
+    pool.release(pool.acquire(), SimpleNamespace(status_code=429, text="Too many requests", headers={"Retry-After": "5"}))
+    assert 4.5 < pool.keys[0].open_until - time.monotonic() <= 5
+
+@pytest.fixture
+def reference_store(monkeypatch, tmp_path):
+    store = ReferenceStore(str(tmp_path / "references"))
+    monkeypatch.setattr(search_functions, "reference_store", store)
+    return store
+
+def test_local_matches_are_returned_when_the_search_fails(fake_serpapi, key_pool, reference_store):
+    first = search_google_scholar("machine learning", num_results=3)
+    fake_serpapi.key_errors = {"k1": 401, "k2": 401}
+
+    # Not enough local matches for 5 results, Google Scholar is asked for more and fails
+    results = search_google_scholar("machine learning", num_results=5)
+    assert 0 < len(results) < 5
+    assert {result.link for result in results} <= {result.link for result in first}
+
+    with pytest.raises(RuntimeError):
+        search_google_scholar("organic chemistry", num_results=5)
+
+def test_searches_in_another_language_skip_the_store(fake_serpapi, key_pool, reference_store):
+    search_google_scholar("machine learning", num_results=3)
+    requests = len(fake_serpapi.requests)
+    search_google_scholar("machine learning", num_results=2, language='tl')
+    assert len(fake_serpapi.requests) == requests + 1
+    # Answered from the store in its own language
+    search_google_scholar("machine learning", num_results=2)
+    assert len(fake_serpapi.requests) == requests + 1
@@ -0,0 +1,309 @@
+"""Per-stage tracing of a run: durations, token usage, estimated cost and cache hits
+
+Spans are opened around gpt_response(), search_google_scholar(), the app_functions stages and
+create_word_document_from_json(), and nest through threads and asyncio tasks (they live in a context variable).
+    with collect_spans() as spans:
+        run_outline_pipeline(course_details)
+    print(summarize_spans(spans))
+
+configure_tracing(path) also appends every finished span to a JSONL file, either as plain records or as
+OpenTelemetry (OTLP/JSON) records that a collector can ingest. Summary of a file:
+    python tracing_functions.py .cache/traces.jsonl
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+
+# USD per 1M prompt / completion tokens, matched on the longest model prefix
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Names of the span attributes in OpenTelemetry records (GenAI semantic conventions where there is one)
+OTEL_ATTRIBUTES = {
+    "model": "gen_ai.request.model",
+    "prompt_tokens": "gen_ai.usage.input_tokens",
+    "completion_tokens": "gen_ai.usage.output_tokens",
+}
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of a completion from MODEL_PRICES, None for unknown models"""
+    prefixes = [prefix for prefix in MODEL_PRICES if model and model.startswith(prefix)]
+    if not prefixes:
+        return None
+    prompt_price, completion_price = MODEL_PRICES[max(prefixes, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+class Span:
+    """One timed unit of work. Attributes hold the model, tokens, cost, cache hit... of the work"""
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start", "seconds", "status", "error", "attributes", "_start")
+
+    def __init__(self, name, kind, parent=None, **attributes):
+        self.name = name
+        self.kind = kind              # "run", "stage", "llm", "search" or "document"
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.seconds = None
+        self.status = "ok"
+        self.error = None
+        self.attributes = attributes
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_usage(self, model, usage):
+        """Stores the tokens of a response.usage and their estimated cost"""
+        if usage is None:
+            return
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        self.set(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        if cost is not None:
+            self.set(cost_usd=round(cost, 6))
+
+    def end(self, error=None):
+        self.seconds = time.perf_counter() - self._start
+        if error is not None:
+            self.status = "error"
+            self.error = f"{type(error).__name__}: {error}"
+        _finish(self)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "seconds": self.seconds,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def to_otel(self):
+        """The span as an OTLP/JSON span record"""
+        attributes = []
+        for key, value in self.attributes.items():
+            if isinstance(value, bool):
+                typed = {"boolValue": value}
+            elif isinstance(value, int):
+                typed = {"intValue": str(value)}
+            elif isinstance(value, float):
+                typed = {"doubleValue": value}
+            else:
+                typed = {"stringValue": str(value)}
+            attributes.append({"key": OTEL_ATTRIBUTES.get(key, f"curriculumgpt.{key}"), "value": typed})
+        start = int(self.start * 1e9)
+        record = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 3 if self.kind in ("llm", "search") else 1,  # SPAN_KIND_CLIENT for upstream calls, else INTERNAL
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int((self.seconds or 0) * 1e9)),
+            "attributes": attributes,
+            "status": {"code": 2, "message": self.error} if self.status == "error" else {"code": 1},
+        }
+        if self.parent_id:
+            record["parentSpanId"] = self.parent_id
+        return record
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_collectors = contextvars.ContextVar("span_collectors", default=())
+_exporter = None
+
+def start_span(name, kind="stage", **attributes):
+    """Starts a child span of the current one without making it current (i.e. for spans ending in a generator)
+
+    End it with span.end()
+    """
+    return Span(name, kind, _current_span.get(), **attributes)
+
+@contextmanager
+def span(name, kind="stage", **attributes):
+    """Times the block as a span, nested spans started inside it become its children"""
+    current = start_span(name, kind, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        _current_span.reset(token)
+        current.end(e)
+        raise
+    _current_span.reset(token)
+    current.end()
+
+def traced(kind="stage", name=None):
+    """Decorator running every call of a function in a span named after the function"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name or function.__name__, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def collect_spans():
+    """Collects the spans finished inside the block (including its threads and tasks) into a list"""
+    spans = []
+    token = _collectors.set(_collectors.get() + (spans,))
+    try:
+        yield spans
+    finally:
+        _collectors.reset(token)
+
+def _finish(finished):
+    for spans in _collectors.get():
+        spans.append(finished)
+    if _exporter is not None:
+        _exporter.export(finished)
+
+class JSONLExporter:
+    """Appends every finished span to a JSONL file, as plain records or OTLP/JSON resourceSpans"""
+
+    def __init__(self, path, otel=False, service_name="curriculumgpt"):
+        self.path = path
+        self.otel = otel
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def export(self, finished):
+        if self.otel:
+            record = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "curriculumgpt"}, "spans": [finished.to_otel()]}]
+            }]}
+        else:
+            record = finished.to_dict()
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+def configure_tracing(path=".cache/traces.jsonl", otel=False):
+    """Append every finished span to a JSONL file. path=None stops exporting
+
+    Params:
+        path (str): JSONL file of the spans
+        otel (bool): Write OpenTelemetry OTLP/JSON records instead of plain span records
+    """
+    global _exporter
+    _exporter = JSONLExporter(path, otel) if path else None
+
+def read_spans(path):
+    """Streams the span records of a JSONL file written by configure_tracing(), both formats"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "resourceSpans" not in record:
+                yield record
+                continue
+            for resource_spans in record["resourceSpans"]:
+                for scope_spans in resource_spans["scopeSpans"]:
+                    for otel_span in scope_spans["spans"]:
+                        yield _from_otel(otel_span)
+
+def _from_otel(otel_span):
+    names = {otel_name: name for name, otel_name in OTEL_ATTRIBUTES.items()}
+    attributes = {}
+    for attribute in otel_span["attributes"]:
+        value = next(iter(attribute["value"].values()))
+        key = names.get(attribute["key"], attribute["key"].removeprefix("curriculumgpt."))
+        attributes[key] = int(value) if "intValue" in attribute["value"] else value
+    start, end = int(otel_span["startTimeUnixNano"]), int(otel_span["endTimeUnixNano"])
+    return {
+        "name": otel_span["name"],
+        "span_id": otel_span["spanId"],
+        "parent_id": otel_span.get("parentSpanId"),
+        "seconds": (end - start) / 1e9,
+        "status": "error" if otel_span["status"]["code"] == 2 else "ok",
+        "attributes": attributes,
+    }
+
+_USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cost_usd", "cache_hits")
+
+def summarize_spans(spans):
+    """Per span name: count, errors, p50/p95 duration, tokens, estimated cost and cache hits
+
+    Tokens, cost and cache hits of a span include those of its child spans, so a stage reports the LLM calls made in it.
+
+    Params:
+        spans (iterable): Span objects or span records (i.e. from read_spans())
+
+    Output:
+        summary (dict): Span name -> totals, slowest total time first
+    """
+    records = [finished.to_dict() if isinstance(finished, Span) else finished for finished in spans]
+    usage = {}
+    parents = {record["span_id"]: record.get("parent_id") for record in records if record.get("span_id")}
+    for i, record in enumerate(records):
+        attributes = record["attributes"]
+        own = (attributes.get("prompt_tokens", 0), attributes.get("completion_tokens", 0), attributes.get("cost_usd", 0.0), int(bool(attributes.get("cache_hit"))))
+        if not any(own):
+            continue
+        # Add the usage to the span and every ancestor found in spans
+        span_id = record.get("span_id") or i
+        while span_id is not None:
+            usage[span_id] = [total + value for total, value in zip(usage.get(span_id, (0, 0, 0.0, 0)), own)]
+            span_id = parents.get(span_id)
+
+    totals = {}
+    for i, record in enumerate(records):
+        total = totals.setdefault(record["name"], {"durations": [], "errors": 0, **{key: 0 for key in _USAGE_KEYS}})
+        total["durations"].append(record["seconds"])
+        total["errors"] += record["status"] == "error"
+        for key, value in zip(_USAGE_KEYS, usage.get(record.get("span_id") or i, (0, 0, 0.0, 0))):
+            total[key] += value
+
+    summary = {}
+    for name, total in sorted(totals.items(), key=lambda item: -sum(item[1]["durations"])):
+        durations = sorted(total.pop("durations"))
+        summary[name] = {
+            "count": len(durations),
+            "p50_ms": round(durations[len(durations) // 2] * 1000, 2),
+            "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 2),
+            "total_ms": round(sum(durations) * 1000, 2),
+            **total,
+            "cost_usd": round(total["cost_usd"], 6),
+        }
+    return summary
+
+def usage_totals(spans):
+    """Tokens and cost of the LLM calls in spans, each call counted once
+
+    The totals of summarize_spans() can't be added up across span names, as a call is included in every ancestor.
+    """
+    records = [finished.to_dict() if isinstance(finished, Span) else finished for finished in spans]
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    for record in records:
+        if record["kind"] == "llm":
+            for key in totals:
+                totals[key] += record["attributes"].get(key, 0)
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    return totals
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python tracing_functions.py traces.jsonl")
+    print(json.dumps(summarize_spans(read_spans(sys.argv[1])), indent=4))